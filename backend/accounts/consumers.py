@@ -1,16 +1,25 @@
-import json
+import asyncio
+import logging
+
 from django.contrib.auth import get_user_model
-from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from rest_framework.renderers import JSONRenderer
 
+from core.consumers import BaseConsumer
 from chat.models import Room
-from chat.v1.serializers import RoomSerializer
+from chat.helpers import (
+    with_unread_count, get_room_summaries, is_room_member
+)
+from chat.search import search_messages
+from chat.v1.serializers import RoomSerializer, MessageSearchResultSerializer
+from .presence import (
+    get_presence, flush_presence, PRESENCE_HEARTBEAT_INTERVAL
+)
 
 User = get_user_model()
+logger = logging.getLogger(__name__)
 
 
-class UserConsumer(AsyncWebsocketConsumer):
+class UserConsumer(BaseConsumer):
     async def connect(self):
         self.user: User = self.scope["user"]
 
@@ -34,7 +43,7 @@ class UserConsumer(AsyncWebsocketConsumer):
                 )
 
     async def receive(self, text_data=None, bytes_data=None):
-        json_text_data = json.loads(text_data)
+        json_text_data = self.decode_frame(text_data, bytes_data)
         action = json_text_data["action"]
 
         if action == "get_or_create_room":
@@ -43,18 +52,28 @@ class UserConsumer(AsyncWebsocketConsumer):
                 await self.send_room(serializer)
         elif action == "pull_rooms":
             await self.send_room_list()
-        elif action == "new_message_notification":
-            # await self.send_notification(action, json_text_data)
-            print("got new_message_notification")
+        elif action == "room_detail":
+            serializer = await self.get_room_detail(json_text_data.get("room"))
+            if serializer is not None:
+                await self.send_message({
+                    "action": "room_detail",
+                    "results": serializer,
+                })
+        elif action == "search_messages":
+            await self.send_message({
+                "action": "search_messages",
+                "query": json_text_data.get("q"),
+                **await self.search_messages(json_text_data),
+            })
         else:
-            print("Unknown action", action)
+            logger.debug("Unknown action %r from user %s", action, self.user.id)
 
     async def send_room(self, serializer):
         message = {
             "action": "single_room",
             "results": serializer,
         }
-        await self.send(text_data=json.dumps(message))
+        await self.send_message(message)
 
     async def send_room_list(self):
         rooms = await self.get_room_list()
@@ -62,14 +81,10 @@ class UserConsumer(AsyncWebsocketConsumer):
             "action": "pull_rooms",
             "results": rooms,
         }
-        await self.send(text_data=json.dumps(message))
+        await self.send_message(message)
 
     async def send_notification(self, event):
-        message = {
-            "action": event['message']['action'],
-            "results": event['message']['results'],
-        }
-        await self.send(text_data=json.dumps(message))
+        await self.send_frame(event)
 
     @database_sync_to_async
     def get_or_create_room(self, data):
@@ -88,7 +103,10 @@ class UserConsumer(AsyncWebsocketConsumer):
                 )
                 if room.exists():
                     return self.get_serializer_data_to_dict(
-                        RoomSerializer(room.first(), many=False)
+                        RoomSerializer(
+                            with_unread_count(room, self.user).first(),
+                            many=False
+                        )
                         )
                 else:
                     room = Room.objects.create(
@@ -103,25 +121,74 @@ class UserConsumer(AsyncWebsocketConsumer):
 
             except User.DoesNotExist:
                 return None
-            except Exception as e:
-                print(
-                    "An error occurred while trying to create room: ",
-                    str(e)
-                    )
+            except Exception:
+                logger.exception("Could not create a room")
                 return None
 
-    @database_sync_to_async
-    def update_user_status(self, online):
-        self.user.is_online = online
-        self.user.save(update_fields=["is_online"])
+    async def update_user_status(self, online):
+        presence = get_presence()
+        if online:
+            changed = await presence.connect(self.user.id, self.channel_name)
+            self.heartbeat = asyncio.ensure_future(self.keep_alive(presence))
+        else:
+            if getattr(self, "heartbeat", None) is not None:
+                self.heartbeat.cancel()
+            changed = await presence.disconnect(
+                self.user.id,
+                self.channel_name
+            )
+        if changed and presence.flush_inline:
+            await database_sync_to_async(flush_presence)(presence)
+
+    async def keep_alive(self, presence):
+        while True:
+            await asyncio.sleep(PRESENCE_HEARTBEAT_INTERVAL)
+            await presence.heartbeat(self.user.id, self.channel_name)
 
     @database_sync_to_async
     def get_room_list(self):
-        queryset = self.user.participants.filter(is_active=True)
+        return get_room_summaries(self.user)
+
+    @database_sync_to_async
+    def get_room_detail(self, room_id):
+        if not is_room_member(room_id, self.user.id):
+            return None
+        room = with_unread_count(
+            Room.objects.filter(pk=room_id),
+            self.user
+        ).select_related('family', 'video_call', 'last_message').first()
+        if room is None:
+            return None
         return self.get_serializer_data_to_dict(
-            RoomSerializer(queryset, many=True)
+            RoomSerializer(room, many=False)
             )
 
+    @database_sync_to_async
+    def search_messages(self, data):
+        try:
+            room_id = int(data["room"]) if data.get("room") else None
+            before = int(data["before"]) if data.get("before") else None
+            limit = int(data["limit"]) if data.get("limit") else None
+        except (TypeError, ValueError):
+            room_id = before = limit = None
+        messages, highlights, has_more = search_messages(
+            self.user,
+            data.get("q"),
+            room_id=room_id,
+            before=before,
+            limit=limit,
+        )
+        return {
+            "results": self.get_serializer_data_to_dict(
+                MessageSearchResultSerializer(
+                    messages,
+                    many=True,
+                    context={"highlights": highlights}
+                )
+            ),
+            "next": messages[-1].pk if has_more else None,
+        }
+
     def get_serializer_data_to_dict(self, serializer):
-        serialized_data = JSONRenderer().render(serializer.data)
-        return json.loads(serialized_data.decode())
+        # Frames are encoded once when they are sent, no need to round-trip
+        return serializer.data
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from accounts.presence import (
+    get_presence, flush_presence, PRESENCE_FLUSH_INTERVAL
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Expire stale connections and write presence changes to "
+        "User.is_online/last_seen in batches. Runs until interrupted unless "
+        "--once is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=PRESENCE_FLUSH_INTERVAL,
+            help="Seconds between two flushes.",
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help="Flush once and exit.",
+        )
+
+    def handle(self, *args, **options):
+        presence = get_presence()
+        while True:
+            close_old_connections()
+            try:
+                flush_presence(presence)
+            except Exception as e:
+                self.stderr.write("Presence flush failed: %s" % e)
+            if options['once']:
+                break
+            time.sleep(options['interval'])
@@ -7,6 +7,7 @@ from phonenumber_field.modelfields import PhoneNumberField
 
 from core.utils import UploadPath, BaseModel
 from core.validators import ValidateFileSize
+from uploads.storage import get_media_storage
 
 
 # Create your models here.
@@ -43,6 +44,8 @@ class User(AbstractUser):
     avatar = models.ImageField(
         verbose_name=_("Avatar"),
         upload_to=UploadPath(folder="pictures", sub_path="avatars"),
+        storage=get_media_storage,
+        db_index=True,
         blank=True,
         null=True,
         validators=[ValidateFileSize(allowed_file_size=32)]
@@ -50,6 +53,8 @@ class User(AbstractUser):
     bg_cover = models.ImageField(
         verbose_name=_("Background Cover"),
         upload_to=UploadPath(folder="pictures", sub_path="covers"),
+        storage=get_media_storage,
+        db_index=True,
         validators=[ValidateFileSize(allowed_file_size=128)],
         blank=True,
         null=True,
@@ -59,6 +64,7 @@ class User(AbstractUser):
     last_ip = models.GenericIPAddressField(verbose_name=_("Last IP Address"), null=True, blank=True)
     email_verified = models.BooleanField(verbose_name=_("Email verified"), default=False)
     is_online = models.BooleanField(verbose_name=_("Online"), default=False)
+    last_seen = models.DateTimeField(verbose_name=_("Last Seen"), null=True, blank=True)
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = []
     objects = CustomUserManager()
@@ -0,0 +1,417 @@
+"""
+Presence of users, counted per open WebSocket connection.
+
+Every connection of a user is registered with an expiry that the consumer
+refreshes while the socket is open, so a user stays online as long as one
+of their tabs or devices is connected, and a crashed worker cannot leave
+them online forever. Transitions between online and offline are recorded
+and written to ``User.is_online``/``User.last_seen`` in batches by
+``flush_presence``.
+
+``RedisPresence`` keeps the state in the channel-layer Redis and is shared
+by every process; ``MemoryPresence`` is the single-process stand-in used
+with ``DEBUG``.
+
+Each flush also publishes the transitions as ``presence_delta`` frames to
+the online friends and family members of the users concerned. A flush is
+the coalescing window: every recipient gets at most one frame per flush,
+whatever the number of transitions it covers.
+"""
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone as dt_timezone
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from core.consumers import BaseConsumer
+from chat import fanout
+from main.models import FamilyMembers
+from .models import Friendship
+
+# Seconds a connection stays registered without a heartbeat
+PRESENCE_TTL = 60
+PRESENCE_HEARTBEAT_INTERVAL = PRESENCE_TTL / 3
+PRESENCE_FLUSH_INTERVAL = 2
+
+PRESENCE_AUDIENCE_CACHE_KEY = "accounts:presence_audience:{}"
+PRESENCE_AUDIENCE_CACHE_TIMEOUT = 60 * 60
+
+
+class BasePresence(ABC):
+    # Flush from the process that saw the change, for single-process stand-ins
+    flush_inline = False
+
+    @abstractmethod
+    async def connect(self, user_id, channel_name) -> bool:
+        """Register a connection. Returns True if the user just came online."""
+
+    @abstractmethod
+    async def disconnect(self, user_id, channel_name) -> bool:
+        """Drop a connection. Returns True if the user just went offline."""
+
+    @abstractmethod
+    async def heartbeat(self, user_id, channel_name):
+        """Keep a connection registered for another ``PRESENCE_TTL``."""
+
+    @abstractmethod
+    def online(self, user_ids) -> set:
+        """Ids of the given users that have at least one live connection."""
+
+    @abstractmethod
+    def pop_changes(self) -> dict:
+        """
+        Expire connections that stopped sending heartbeats, then return and
+        forget the pending transitions: ``{user_id: (is_online, timestamp)}``.
+        """
+
+
+class MemoryPresence(BasePresence):
+    flush_inline = True
+
+    def __init__(self, options=None):
+        self.lock = threading.Lock()
+        self.connections = {}
+        self.changes = {}
+
+    def _alive(self, user_id, now):
+        connections = self.connections.get(user_id, {})
+        for channel_name, expires_at in list(connections.items()):
+            if expires_at <= now:
+                del connections[channel_name]
+        return connections
+
+    async def connect(self, user_id, channel_name) -> bool:
+        now = time.time()
+        with self.lock:
+            connections = self._alive(user_id, now)
+            came_online = not connections
+            connections[channel_name] = now + PRESENCE_TTL
+            self.connections[user_id] = connections
+            if came_online:
+                self.changes[user_id] = (True, now)
+        return came_online
+
+    async def disconnect(self, user_id, channel_name) -> bool:
+        now = time.time()
+        with self.lock:
+            connections = self._alive(user_id, now)
+            if connections.pop(channel_name, None) is None or connections:
+                return False
+            self.connections.pop(user_id, None)
+            self.changes[user_id] = (False, now)
+        return True
+
+    async def heartbeat(self, user_id, channel_name):
+        now = time.time()
+        with self.lock:
+            connections = self._alive(user_id, now)
+            if not connections:
+                # Expired by the flusher meanwhile, the user is back online
+                self.changes[user_id] = (True, now)
+            connections[channel_name] = now + PRESENCE_TTL
+            self.connections[user_id] = connections
+
+    def online(self, user_ids) -> set:
+        now = time.time()
+        with self.lock:
+            return {
+                user_id for user_id in user_ids
+                if self._alive(user_id, now)
+            }
+
+    def pop_changes(self) -> dict:
+        now = time.time()
+        with self.lock:
+            for user_id in list(self.connections):
+                if not self._alive(user_id, now):
+                    del self.connections[user_id]
+                    self.changes[user_id] = (False, now)
+            changes, self.changes = self.changes, {}
+        return changes
+
+
+class RedisPresence(BasePresence):
+    """
+    Keys:
+
+    - ``presence:conn:<user id>``: sorted set of channel names scored by
+      expiry, one member per open connection.
+    - ``presence:online``: sorted set of online user ids scored by the
+      latest expiry of their connections.
+    - ``presence:changes``: hash of pending transitions, ``"1|<ts>"`` or
+      ``"0|<ts>"`` per user id.
+
+    Each operation is one Lua script so concurrent connects and disconnects
+    of the same user cannot interleave.
+    """
+    ONLINE_KEY = "presence:online"
+    CHANGES_KEY = "presence:changes"
+
+    # ARGV: channel name, now, expires at, ttl, user id
+    CONNECT = """
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+    redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+    redis.call('EXPIRE', KEYS[1], ARGV[4])
+    local score = redis.call('ZSCORE', KEYS[2], ARGV[5])
+    redis.call('ZADD', KEYS[2], 'GT', ARGV[3], ARGV[5])
+    if not score or tonumber(score) <= tonumber(ARGV[2]) then
+        redis.call('HSET', KEYS[3], ARGV[5], '1|' .. ARGV[2])
+        return 1
+    end
+    return 0
+    """
+    # ARGV: channel name, now, user id
+    DISCONNECT = """
+    redis.call('ZREM', KEYS[1], ARGV[1])
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+    local latest = redis.call('ZRANGE', KEYS[1], -1, -1, 'WITHSCORES')
+    if latest[2] then
+        redis.call('ZADD', KEYS[2], latest[2], ARGV[3])
+        return 0
+    end
+    if redis.call('ZREM', KEYS[2], ARGV[3]) == 1 then
+        redis.call('HSET', KEYS[3], ARGV[3], '0|' .. ARGV[2])
+        return 1
+    end
+    return 0
+    """
+    # ARGV: channel name, now, expires at, ttl, user id
+    HEARTBEAT = """
+    redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+    redis.call('EXPIRE', KEYS[1], ARGV[4])
+    local score = redis.call('ZSCORE', KEYS[2], ARGV[5])
+    redis.call('ZADD', KEYS[2], 'GT', ARGV[3], ARGV[5])
+    if not score or tonumber(score) <= tonumber(ARGV[2]) then
+        -- Expired by the flusher meanwhile, the user is back online
+        redis.call('HSET', KEYS[3], ARGV[5], '1|' .. ARGV[2])
+    end
+    """
+    POP_CHANGES = """
+    local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'WITHSCORES')
+    for index = 1, #expired, 2 do
+        redis.call('ZREM', KEYS[1], expired[index])
+        redis.call('HSET', KEYS[2], expired[index], '0|' .. expired[index + 1])
+    end
+    local changes = redis.call('HGETALL', KEYS[2])
+    redis.call('DEL', KEYS[2])
+    return changes
+    """
+
+    def __init__(self, options=None):
+        import redis
+        import redis.asyncio
+
+        location = (options or {}).get("LOCATION", "redis://localhost:6379")
+        self.client = redis.Redis.from_url(location)
+        self.async_client = redis.asyncio.Redis.from_url(location)
+        self.pop_script = self.client.register_script(self.POP_CHANGES)
+        self.connect_script = self.async_client.register_script(self.CONNECT)
+        self.disconnect_script = self.async_client.register_script(
+            self.DISCONNECT
+        )
+        self.heartbeat_script = self.async_client.register_script(
+            self.HEARTBEAT
+        )
+
+    @staticmethod
+    def connections_key(user_id):
+        return f"presence:conn:{user_id}"
+
+    async def connect(self, user_id, channel_name) -> bool:
+        now = time.time()
+        return bool(await self.connect_script(
+            keys=[
+                self.connections_key(user_id),
+                self.ONLINE_KEY,
+                self.CHANGES_KEY
+            ],
+            args=[channel_name, now, now + PRESENCE_TTL, PRESENCE_TTL, user_id],
+        ))
+
+    async def disconnect(self, user_id, channel_name) -> bool:
+        return bool(await self.disconnect_script(
+            keys=[
+                self.connections_key(user_id),
+                self.ONLINE_KEY,
+                self.CHANGES_KEY
+            ],
+            args=[channel_name, time.time(), user_id],
+        ))
+
+    async def heartbeat(self, user_id, channel_name):
+        now = time.time()
+        await self.heartbeat_script(
+            keys=[
+                self.connections_key(user_id),
+                self.ONLINE_KEY,
+                self.CHANGES_KEY
+            ],
+            args=[channel_name, now, now + PRESENCE_TTL, PRESENCE_TTL, user_id],
+        )
+
+    def online(self, user_ids) -> set:
+        user_ids = list(user_ids)
+        if not user_ids:
+            return set()
+        now = time.time()
+        scores = self.client.zmscore(self.ONLINE_KEY, user_ids)
+        return {
+            user_id for user_id, score in zip(user_ids, scores)
+            if score is not None and score > now
+        }
+
+    def pop_changes(self) -> dict:
+        flat = self.pop_script(
+            keys=[self.ONLINE_KEY, self.CHANGES_KEY],
+            args=[time.time()],
+        )
+        changes = {}
+        for user_id, value in zip(flat[::2], flat[1::2]):
+            state, timestamp = value.decode().split("|")
+            changes[int(user_id)] = (state == "1", float(timestamp))
+        return changes
+
+
+_presence = None
+_presence_lock = threading.Lock()
+
+
+def get_presence() -> BasePresence:
+    global _presence
+    with _presence_lock:
+        if _presence is None:
+            options = getattr(settings, "PRESENCE", {})
+            backend = import_string(
+                options.get("BACKEND", "accounts.presence.MemoryPresence")
+            )
+            _presence = backend(options)
+        return _presence
+
+
+def get_presence_audiences(user_ids) -> dict:
+    """
+    Ids of the users interested in the presence of each of ``user_ids``:
+    the members of their families and their accepted friends. Cached per
+    user until a membership or friendship changes (see ``accounts.signals``).
+    """
+    keys = {
+        user_id: PRESENCE_AUDIENCE_CACHE_KEY.format(user_id)
+        for user_id in user_ids
+    }
+    cached = cache.get_many(list(keys.values()))
+    audiences = {
+        user_id: cached[key] for user_id, key in keys.items() if key in cached
+    }
+    missing = [user_id for user_id in user_ids if user_id not in audiences]
+    if not missing:
+        return audiences
+
+    found = {user_id: set() for user_id in missing}
+    families = {}
+    for family_id, member_id in FamilyMembers.objects.filter(
+        family__my_members__member_id__in=missing
+    ).values_list('family_id', 'member_id').distinct():
+        families.setdefault(family_id, set()).add(member_id)
+    for members in families.values():
+        for user_id in members & found.keys():
+            found[user_id] |= members
+    for from_user_id, to_user_id in Friendship.objects.filter(
+        Q(from_user_id__in=missing) | Q(to_user_id__in=missing),
+        status=Friendship.StatusChoices.ACCEPTED,
+        is_active=True,
+    ).values_list('from_user_id', 'to_user_id'):
+        if from_user_id in found:
+            found[from_user_id].add(to_user_id)
+        if to_user_id in found:
+            found[to_user_id].add(from_user_id)
+
+    found = {
+        user_id: frozenset(audience - {user_id})
+        for user_id, audience in found.items()
+    }
+    cache.set_many(
+        {keys[user_id]: audience for user_id, audience in found.items()},
+        PRESENCE_AUDIENCE_CACHE_TIMEOUT
+    )
+    audiences.update(found)
+    return audiences
+
+
+def invalidate_presence_audiences(user_ids):
+    cache.delete_many(
+        [PRESENCE_AUDIENCE_CACHE_KEY.format(user_id) for user_id in user_ids]
+    )
+
+
+def presence_events(changes, presence):
+    """
+    One ``presence_delta`` event per online recipient, listing every
+    transition of ``changes`` it is interested in.
+    """
+    audiences = get_presence_audiences(list(changes))
+    recipients = presence.online(
+        set().union(*audiences.values()) if audiences else ()
+    )
+    deltas = {}
+    for user_id in sorted(changes):
+        for recipient in audiences[user_id] & recipients:
+            deltas.setdefault(recipient, []).append(user_id)
+
+    # Recipients sharing the same relatives share the same encoded frame
+    frames = {}
+    events = []
+    for recipient, user_ids in deltas.items():
+        user_ids = tuple(user_ids)
+        if user_ids not in frames:
+            frames[user_ids] = BaseConsumer.frame_event(
+                'send_notification',
+                {
+                    "action": "presence_delta",
+                    "results": [
+                        {
+                            "id": user_id,
+                            "is_online": changes[user_id][0],
+                            "last_seen": datetime.fromtimestamp(
+                                changes[user_id][1], tz=dt_timezone.utc
+                            ),
+                        }
+                        for user_id in user_ids
+                    ],
+                }
+            )
+        events.append((f"user_{recipient}", frames[user_ids]))
+    return events
+
+
+def flush_presence(presence=None) -> int:
+    """
+    Write pending transitions to ``User.is_online``/``User.last_seen`` with
+    a single bulk UPDATE, then publish them to the interested users.
+    Returns the number of users written.
+    """
+    presence = presence or get_presence()
+    changes = presence.pop_changes()
+    if not changes:
+        return 0
+    User = get_user_model()
+    users = [
+        User(
+            pk=user_id,
+            is_online=is_online,
+            last_seen=datetime.fromtimestamp(timestamp, tz=dt_timezone.utc),
+        )
+        for user_id, (is_online, timestamp) in changes.items()
+    ]
+    User.objects.bulk_update(users, ['is_online', 'last_seen'])
+    async_to_sync(fanout.send_events)(
+        get_channel_layer(),
+        presence_events(changes, presence)
+    )
+    return len(users)
@@ -1,9 +1,12 @@
 from django.contrib.auth.signals import user_logged_in
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
 
+from main.models import Family, FamilyMembers
 from .helpers import send_email_verification
+from .models import Friendship
+from .presence import invalidate_presence_audiences
 
 User = get_user_model()
 
@@ -21,3 +24,39 @@ def send_verification_email(sender, instance, created, **kwargs):
             send_email_verification(instance)
         except Exception as e:
             print("send_email_verification failed: ", e)
+
+
+def family_member_ids(family_ids):
+    return FamilyMembers.objects.filter(
+        family_id__in=family_ids
+    ).values_list('member_id', flat=True)
+
+
+@receiver(post_save, sender=Friendship)
+@receiver(post_delete, sender=Friendship)
+def invalidate_friend_presence_audiences(sender, instance, **kwargs):
+    invalidate_presence_audiences([instance.from_user_id, instance.to_user_id])
+
+
+@receiver(post_save, sender=FamilyMembers)
+@receiver(post_delete, sender=FamilyMembers)
+def invalidate_family_presence_audiences(sender, instance, **kwargs):
+    invalidate_presence_audiences(
+        {instance.member_id, *family_member_ids([instance.family_id])}
+    )
+
+
+@receiver(m2m_changed, sender=Family.members.through)
+def invalidate_family_members_presence_audiences(sender, instance, action, reverse, pk_set, **kwargs):
+    """Members still belong to the family at pre_clear, not at post_clear."""
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        family_ids = pk_set or instance.my_families.values_list('pk', flat=True)
+        user_ids = {instance.pk}
+    else:
+        family_ids = [instance.pk]
+        user_ids = set(pk_set or ())
+    invalidate_presence_audiences(
+        user_ids | set(family_member_ids(list(family_ids)))
+    )
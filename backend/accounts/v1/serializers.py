@@ -6,7 +6,10 @@ from django.contrib.auth.tokens import PasswordResetTokenGenerator
 from django.utils.http import urlsafe_base64_decode
 from django.utils.encoding import force_str
 
+from drf_spectacular.utils import extend_schema_field
+
 from accounts.models import User, Friendship, Relation
+from accounts.presence import get_presence
 
 
 class UserCreateSerializer(serializers.Serializer):
@@ -70,13 +73,43 @@ class UserSerializer(serializers.ModelSerializer):
         return obj.get_full_name
 
 
+def load_presence(context, user_ids):
+    """
+    Look up the presence of ``user_ids`` in one call and remember it in the
+    serializer context, shared by every nested ``PublicUserSerializer``.
+    """
+    presence = context.setdefault('presence', {})
+    missing = {user_id for user_id in user_ids if user_id not in presence}
+    if missing:
+        online = get_presence().online(missing)
+        for user_id in missing:
+            presence[user_id] = user_id in online
+    return presence
+
+
+class PublicUserListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        iterable = data.all() if hasattr(data, 'all') else data
+        users = list(iterable)
+        load_presence(self.context, [user.pk for user in users])
+        return super().to_representation(users)
+
+
 class PublicUserSerializer(serializers.ModelSerializer):
     initial_name = serializers.SerializerMethodField(read_only=True)
     full_name = serializers.SerializerMethodField(read_only=True)
+    is_online = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = User
-        fields = ['id', 'avatar', 'initial_name', 'full_name', 'is_online']
+        fields = ['id', 'avatar', 'initial_name', 'full_name', 'is_online',
+                  'last_seen']
+        list_serializer_class = PublicUserListSerializer
+
+    @extend_schema_field(serializers.BooleanField())
+    def get_is_online(self, obj):
+        # Live state from the presence service, `User.is_online` lags behind
+        return load_presence(self.context, [obj.pk])[obj.pk]
 
     def get_initial_name(self, obj):
         return obj.get_initials_name
@@ -1,6 +1,9 @@
 from django.contrib import admin
 
-from .models import Room, VideoCall, Message, MessageMedia, IceServer
+from .models import (
+    Room, VideoCall, Message, MessageMedia, IceServer, RoomMember,
+    MessageOutbox, ArchivedMessage
+)
 
 
 @admin.register(VideoCall)
@@ -32,6 +35,26 @@ class MessageAdmin(admin.ModelAdmin):
 admin.site.register(MessageMedia)
 
 
+@admin.register(ArchivedMessage)
+class ArchivedMessageAdmin(admin.ModelAdmin):
+    list_display = ['pk', 'content', 'room', 'created_at', 'archived_at']
+    list_filter = ['archived_at']
+
+
+@admin.register(RoomMember)
+class RoomMemberAdmin(admin.ModelAdmin):
+    list_display = ['pk', 'room', 'user', 'last_read_message_id',
+                    'last_read_at', 'updated_at']
+    list_filter = ['last_read_at']
+
+
+@admin.register(MessageOutbox)
+class MessageOutboxAdmin(admin.ModelAdmin):
+    list_display = ['pk', 'action', 'room', 'message_id', 'attempts',
+                    'dispatched_at', 'created_at']
+    list_filter = ['action', 'dispatched_at']
+
+
 @admin.register(IceServer)
 class IceServerAdmin(admin.ModelAdmin):
     list_display = (
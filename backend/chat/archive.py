@@ -0,0 +1,107 @@
+"""
+Archival of old messages into ``ArchivedMessage``.
+
+Messages older than ``CHAT_ARCHIVE_AFTER_DAYS`` and every message of an
+archived room are moved in chunks, one transaction per chunk, with an
+``INSERT ... SELECT`` and a ``DELETE`` so rows never round-trip through
+Python. The hot table, and with it its indexes, only holds recent messages.
+
+The last message of each room stays hot since ``Room.last_message`` points
+to it. Archived messages are read-only and are not searchable.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Message, ArchivedMessage, Room
+
+ARCHIVE_CHUNK_SIZE = 1000
+
+# Columns copied as is, the archive adds `archived_at`
+ARCHIVED_COLUMNS = (
+    'id', 'created_at', 'updated_at', 'is_active', 'user_id', 'room_id',
+    'content', 'is_edited', 'edited_at', 'reply_to_id',
+)
+
+
+def archivable_messages(cutoff):
+    """
+    Querysets of the messages to archive: first those of archived rooms,
+    then those older than ``cutoff``, never the last message of a room.
+    """
+    last_messages = Room.objects.filter(
+        last_message__isnull=False
+    ).values('last_message_id')
+    hot = Message.objects.exclude(pk__in=last_messages).order_by('id')
+    return [
+        hot.filter(room__in=Room.objects.filter(is_archived=True)),
+        hot.filter(created_at__lt=cutoff),
+    ]
+
+
+def archive_chunk(message_ids) -> int:
+    """Move the given messages to the archive. Returns the number moved."""
+    qn = connection.ops.quote_name
+    columns = ", ".join(qn(column) for column in ARCHIVED_COLUMNS)
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Keep concurrent edits from landing between the copy and the delete
+        message_ids = list(
+            Message.objects.select_for_update().filter(
+                pk__in=message_ids
+            ).order_by().values_list('pk', flat=True)
+        )
+        if not message_ids:
+            return 0
+        placeholders = ", ".join(["%s"] * len(message_ids))
+        cursor.execute(
+            "INSERT INTO {archive} ({columns}, {archived_at}) "
+            "SELECT {columns}, %s FROM {hot} WHERE {id} IN ({ids})".format(
+                archive=qn(ArchivedMessage._meta.db_table),
+                hot=qn(Message._meta.db_table),
+                columns=columns,
+                archived_at=qn('archived_at'),
+                id=qn('id'),
+                ids=placeholders,
+            ),
+            [timezone.now(), *message_ids]
+        )
+        # Deprecated read receipts, the watermarks do not reference rows
+        Message.have_read.through.objects.filter(
+            message_id__in=message_ids
+        ).delete()
+        # Bypass the delete signals: archiving is not deleting
+        cursor.execute(
+            "DELETE FROM {hot} WHERE {id} IN ({ids})".format(
+                hot=qn(Message._meta.db_table),
+                id=qn('id'),
+                ids=placeholders,
+            ),
+            message_ids
+        )
+        return cursor.rowcount
+
+
+def archive_messages(
+        older_than_days=None,
+        chunk_size=ARCHIVE_CHUNK_SIZE,
+        max_chunks=None
+):
+    """
+    Archive chunks until nothing is left or ``max_chunks`` is reached.
+    Yields the number of messages moved by every chunk.
+    """
+    if older_than_days is None:
+        older_than_days = settings.CHAT_ARCHIVE_AFTER_DAYS
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    chunks = 0
+    for queryset in archivable_messages(cutoff):
+        while max_chunks is None or chunks < max_chunks:
+            message_ids = list(
+                queryset.values_list('pk', flat=True)[:chunk_size]
+            )
+            if not message_ids:
+                break
+            chunks += 1
+            yield archive_chunk(message_ids)
@@ -0,0 +1,474 @@
+"""
+State of the video calls, held next to the channel layer.
+
+Joining or leaving a call only touches this state: the open connections
+of the call, its status, creator and timestamps. Rooms whose call changed
+are marked dirty and written to ``VideoCall`` in batches by
+``checkpoint_calls``. A call starting or ending is checkpointed right away,
+since saving ``VideoCall`` is what notifies the room members.
+
+``RedisCallState`` keeps the state in the channel-layer Redis and is shared
+by every process; ``MemoryCallState`` is the single-process stand-in used
+with ``DEBUG``.
+"""
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from .models import VideoCall
+
+# Abandoned call state is dropped from Redis after a day
+CALL_STATE_TTL = 60 * 60 * 24
+CALL_CHECKPOINT_INTERVAL = 5
+
+ONGOING = VideoCall.StatusChoices.ONGOING.value
+ENDED = VideoCall.StatusChoices.ENDED.value
+
+
+class BaseCallState(ABC):
+    # Checkpoint from the process that saw the change, for single-process stand-ins
+    checkpoint_inline = False
+
+    @abstractmethod
+    async def join(self, room_id, user_id, channel_name) -> bool:
+        """Register a connection. Returns True if the call just started."""
+
+    @abstractmethod
+    async def leave(self, room_id, channel_name) -> bool:
+        """Drop a connection. Returns True if the call just ended."""
+
+    @abstractmethod
+    async def start(self, room_id, user_id) -> bool:
+        """Mark the call ongoing. Returns True if it just started."""
+
+    @abstractmethod
+    async def end(self, room_id) -> bool:
+        """Mark the call ended. Returns True if it just ended."""
+
+    # Synchronous counterparts, for the HTTP views
+    @abstractmethod
+    def join_sync(self, room_id, user_id, channel_name) -> bool:
+        """See ``join``."""
+
+    @abstractmethod
+    def leave_sync(self, room_id, channel_name) -> bool:
+        """See ``leave``."""
+
+    @abstractmethod
+    def finish_sync(self, room_id) -> bool:
+        """
+        End the call and drop all its connections. Returns True if the call
+        just ended.
+        """
+
+    @abstractmethod
+    def participants(self, room_id) -> set:
+        """Ids of the users with at least one connection to the call."""
+
+    @abstractmethod
+    def pop_dirty(self) -> dict:
+        """
+        Return and forget the calls changed since the last checkpoint:
+        ``{room_id: {"status", "creator", "started_at", "ended_at",
+        "participants"}}``.
+        """
+
+    @abstractmethod
+    def mark_dirty(self, room_ids):
+        """Have the next checkpoint write these calls again."""
+
+
+class MemoryCallState(BaseCallState):
+    checkpoint_inline = True
+
+    def __init__(self, options=None):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.dirty = set()
+
+    def _call(self, room_id):
+        return self.calls.setdefault(int(room_id), {
+            "status": None,
+            "creator": None,
+            "started_at": None,
+            "ended_at": None,
+            "connections": {},
+        })
+
+    @staticmethod
+    def _start(call, user_id, now):
+        if call["status"] == ONGOING:
+            return False
+        call.update(status=ONGOING, started_at=now, ended_at=None)
+        if user_id is not None:
+            call["creator"] = user_id
+        return True
+
+    @staticmethod
+    def _end(call, now):
+        if call["status"] != ONGOING:
+            return False
+        call.update(status=ENDED, ended_at=now)
+        return True
+
+    async def join(self, room_id, user_id, channel_name) -> bool:
+        return self.join_sync(room_id, user_id, channel_name)
+
+    async def leave(self, room_id, channel_name) -> bool:
+        return self.leave_sync(room_id, channel_name)
+
+    def join_sync(self, room_id, user_id, channel_name) -> bool:
+        with self.lock:
+            call = self._call(room_id)
+            call["connections"][channel_name] = user_id
+            self.dirty.add(int(room_id))
+            return self._start(call, user_id, time.time())
+
+    def leave_sync(self, room_id, channel_name) -> bool:
+        with self.lock:
+            call = self._call(room_id)
+            if call["connections"].pop(channel_name, None) is None:
+                return False
+            self.dirty.add(int(room_id))
+            if call["connections"]:
+                return False
+            return self._end(call, time.time())
+
+    async def start(self, room_id, user_id) -> bool:
+        with self.lock:
+            call = self._call(room_id)
+            # Keep the creator of the call that was re-started
+            started = self._start(call, call["creator"] or user_id, time.time())
+            if started:
+                self.dirty.add(int(room_id))
+            return started
+
+    async def end(self, room_id) -> bool:
+        with self.lock:
+            ended = self._end(self._call(room_id), time.time())
+            if ended:
+                self.dirty.add(int(room_id))
+            return ended
+
+    def finish_sync(self, room_id) -> bool:
+        with self.lock:
+            call = self._call(room_id)
+            if call["connections"]:
+                call["connections"].clear()
+                self.dirty.add(int(room_id))
+            ended = self._end(call, time.time())
+            if ended:
+                self.dirty.add(int(room_id))
+            return ended
+
+    def participants(self, room_id) -> set:
+        with self.lock:
+            call = self.calls.get(int(room_id))
+            return set(call["connections"].values()) if call else set()
+
+    def pop_dirty(self) -> dict:
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+            return {
+                room_id: {
+                    "status": self.calls[room_id]["status"],
+                    "creator": self.calls[room_id]["creator"],
+                    "started_at": self.calls[room_id]["started_at"],
+                    "ended_at": self.calls[room_id]["ended_at"],
+                    "participants": set(
+                        self.calls[room_id]["connections"].values()
+                    ),
+                }
+                for room_id in dirty
+            }
+
+    def mark_dirty(self, room_ids):
+        with self.lock:
+            self.dirty.update(int(room_id) for room_id in room_ids)
+
+
+class RedisCallState(BaseCallState):
+    """
+    Keys:
+
+    - ``call:<room id>:conns``: hash of channel name to user id, one field
+      per open connection.
+    - ``call:<room id>:meta``: hash with ``status``, ``creator``,
+      ``started_at`` and ``ended_at``.
+    - ``call:dirty``: set of the room ids changed since the last checkpoint.
+
+    Each operation is one Lua script so concurrent joins and leaves of the
+    same call cannot interleave.
+    """
+    PREFIX = "call:"
+    DIRTY_KEY = "call:dirty"
+
+    # ARGV: channel name, user id, now, room id, ttl
+    JOIN = """
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+    redis.call('EXPIRE', KEYS[1], ARGV[5])
+    redis.call('SADD', KEYS[3], ARGV[4])
+    local started = 0
+    if redis.call('HGET', KEYS[2], 'status') ~= 'ongoing' then
+        redis.call('HSET', KEYS[2], 'status', 'ongoing', 'started_at', ARGV[3], 'creator', ARGV[2])
+        redis.call('HDEL', KEYS[2], 'ended_at')
+        started = 1
+    end
+    redis.call('EXPIRE', KEYS[2], ARGV[5])
+    return started
+    """
+    # ARGV: channel name, now, room id
+    LEAVE = """
+    if redis.call('HDEL', KEYS[1], ARGV[1]) == 0 then
+        return 0
+    end
+    redis.call('SADD', KEYS[3], ARGV[3])
+    if redis.call('HLEN', KEYS[1]) == 0 and redis.call('HGET', KEYS[2], 'status') == 'ongoing' then
+        redis.call('HSET', KEYS[2], 'status', 'ended', 'ended_at', ARGV[2])
+        return 1
+    end
+    return 0
+    """
+    # ARGV: now, room id, user id, ttl
+    START = """
+    if redis.call('HGET', KEYS[1], 'status') == 'ongoing' then
+        return 0
+    end
+    redis.call('HSET', KEYS[1], 'status', 'ongoing', 'started_at', ARGV[1])
+    redis.call('HSETNX', KEYS[1], 'creator', ARGV[3])
+    redis.call('HDEL', KEYS[1], 'ended_at')
+    redis.call('EXPIRE', KEYS[1], ARGV[4])
+    redis.call('SADD', KEYS[2], ARGV[2])
+    return 1
+    """
+    # ARGV: now, room id
+    END = """
+    if redis.call('HGET', KEYS[1], 'status') ~= 'ongoing' then
+        return 0
+    end
+    redis.call('HSET', KEYS[1], 'status', 'ended', 'ended_at', ARGV[1])
+    redis.call('SADD', KEYS[2], ARGV[2])
+    return 1
+    """
+    # ARGV: now, room id
+    FINISH = """
+    if redis.call('DEL', KEYS[1]) == 1 then
+        redis.call('SADD', KEYS[3], ARGV[2])
+    end
+    if redis.call('HGET', KEYS[2], 'status') ~= 'ongoing' then
+        return 0
+    end
+    redis.call('HSET', KEYS[2], 'status', 'ended', 'ended_at', ARGV[1])
+    redis.call('SADD', KEYS[3], ARGV[2])
+    return 1
+    """
+    # ARGV: key prefix
+    POP_DIRTY = """
+    local rooms = redis.call('SMEMBERS', KEYS[1])
+    redis.call('DEL', KEYS[1])
+    local calls = {}
+    for _, room in ipairs(rooms) do
+        table.insert(calls, {
+            room,
+            redis.call('HGETALL', ARGV[1] .. room .. ':meta'),
+            redis.call('HVALS', ARGV[1] .. room .. ':conns'),
+        })
+    end
+    return calls
+    """
+
+    def __init__(self, options=None):
+        import redis
+        import redis.asyncio
+
+        location = (options or {}).get("LOCATION", "redis://localhost:6379")
+        self.client = redis.Redis.from_url(location)
+        self.async_client = redis.asyncio.Redis.from_url(location)
+        self.pop_script = self.client.register_script(self.POP_DIRTY)
+        self.join_script = self.async_client.register_script(self.JOIN)
+        self.leave_script = self.async_client.register_script(self.LEAVE)
+        self.start_script = self.async_client.register_script(self.START)
+        self.end_script = self.async_client.register_script(self.END)
+        self.sync_join_script = self.client.register_script(self.JOIN)
+        self.sync_leave_script = self.client.register_script(self.LEAVE)
+        self.finish_script = self.client.register_script(self.FINISH)
+
+    def connections_key(self, room_id):
+        return f"{self.PREFIX}{room_id}:conns"
+
+    def meta_key(self, room_id):
+        return f"{self.PREFIX}{room_id}:meta"
+
+    def call_keys(self, room_id):
+        return [
+            self.connections_key(room_id),
+            self.meta_key(room_id),
+            self.DIRTY_KEY
+        ]
+
+    async def join(self, room_id, user_id, channel_name) -> bool:
+        return bool(await self.join_script(
+            keys=self.call_keys(room_id),
+            args=[channel_name, user_id, time.time(), room_id, CALL_STATE_TTL],
+        ))
+
+    async def leave(self, room_id, channel_name) -> bool:
+        return bool(await self.leave_script(
+            keys=self.call_keys(room_id),
+            args=[channel_name, time.time(), room_id],
+        ))
+
+    def join_sync(self, room_id, user_id, channel_name) -> bool:
+        return bool(self.sync_join_script(
+            keys=self.call_keys(room_id),
+            args=[channel_name, user_id, time.time(), room_id, CALL_STATE_TTL],
+        ))
+
+    def leave_sync(self, room_id, channel_name) -> bool:
+        return bool(self.sync_leave_script(
+            keys=self.call_keys(room_id),
+            args=[channel_name, time.time(), room_id],
+        ))
+
+    def finish_sync(self, room_id) -> bool:
+        return bool(self.finish_script(
+            keys=self.call_keys(room_id),
+            args=[time.time(), room_id],
+        ))
+
+    async def start(self, room_id, user_id) -> bool:
+        return bool(await self.start_script(
+            keys=[self.meta_key(room_id), self.DIRTY_KEY],
+            args=[time.time(), room_id, user_id, CALL_STATE_TTL],
+        ))
+
+    async def end(self, room_id) -> bool:
+        return bool(await self.end_script(
+            keys=[self.meta_key(room_id), self.DIRTY_KEY],
+            args=[time.time(), room_id],
+        ))
+
+    def participants(self, room_id) -> set:
+        return {
+            int(user_id)
+            for user_id in self.client.hvals(self.connections_key(room_id))
+        }
+
+    def pop_dirty(self) -> dict:
+        calls = {}
+        for room_id, flat, user_ids in self.pop_script(
+            keys=[self.DIRTY_KEY],
+            args=[self.PREFIX],
+        ):
+            meta = {
+                key.decode(): value.decode()
+                for key, value in zip(flat[::2], flat[1::2])
+            }
+            calls[int(room_id)] = {
+                "status": meta.get("status"),
+                "creator": int(meta["creator"]) if meta.get("creator") else None,
+                "started_at": float(meta["started_at"]) if meta.get("started_at") else None,
+                "ended_at": float(meta["ended_at"]) if meta.get("ended_at") else None,
+                "participants": {int(user_id) for user_id in user_ids},
+            }
+        return calls
+
+    def mark_dirty(self, room_ids):
+        room_ids = list(room_ids)
+        if room_ids:
+            self.client.sadd(self.DIRTY_KEY, *room_ids)
+
+
+_call_state = None
+_call_state_lock = threading.Lock()
+
+
+def get_call_state() -> BaseCallState:
+    global _call_state
+    with _call_state_lock:
+        if _call_state is None:
+            options = getattr(settings, "CALL_STATE", {})
+            backend = import_string(
+                options.get("BACKEND", "chat.call_state.MemoryCallState")
+            )
+            _call_state = backend(options)
+        return _call_state
+
+
+def to_datetime(timestamp):
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, tz=dt_timezone.utc)
+
+
+def checkpoint_calls(call_state=None) -> int:
+    """
+    Write the calls changed since the last checkpoint to ``VideoCall`` and
+    its participants. Saving a call whose status changed notifies the room
+    members (see ``chat.signals``). Returns the number of calls written.
+    """
+    call_state = call_state or get_call_state()
+    calls = call_state.pop_dirty()
+    if not calls:
+        return 0
+    try:
+        write_calls(calls)
+    except Exception:
+        call_state.mark_dirty(calls)
+        raise
+    return len(calls)
+
+
+def write_calls(calls):
+    existing = VideoCall.objects.in_bulk(list(calls), field_name='room_id')
+    through = VideoCall.participants.through
+    with transaction.atomic():
+        for room_id, snapshot in calls.items():
+            if snapshot["status"] is None:
+                continue
+            values = {
+                "status": snapshot["status"],
+                "started_at": to_datetime(snapshot["started_at"]),
+                "ended_at": to_datetime(snapshot["ended_at"]),
+            }
+            call = existing.get(room_id)
+            if call is None:
+                existing[room_id] = VideoCall.objects.create(
+                    room_id=room_id,
+                    creator_id=snapshot["creator"],
+                    **values
+                )
+                continue
+            changed = [
+                name for name, value in values.items()
+                if getattr(call, name) != value
+            ]
+            if "status" in changed:
+                values["creator_id"] = snapshot["creator"]
+                changed.append("creator_id")
+            if changed:
+                for name in changed:
+                    setattr(call, name, values[name])
+                call.save(update_fields=changed)
+
+        for room_id, snapshot in calls.items():
+            call = existing.get(room_id)
+            if call is None:
+                continue
+            through.objects.filter(videocall_id=call.pk).exclude(
+                user_id__in=snapshot["participants"]
+            ).delete()
+        through.objects.bulk_create(
+            [
+                through(videocall_id=existing[room_id].pk, user_id=user_id)
+                for room_id, snapshot in calls.items()
+                if room_id in existing
+                for user_id in snapshot["participants"]
+            ],
+            ignore_conflicts=True
+        )
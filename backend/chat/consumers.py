@@ -1,19 +1,29 @@
-import json
+from urllib.parse import parse_qs
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.utils import timezone
-from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from rest_framework.renderers import JSONRenderer
-from asgiref.sync import sync_to_async
 
+from core.consumers import BaseConsumer
 from chat.v1.serializers import MessageSerializer, PublicUserSerializer
-from .models import Message, Room, VideoCall
+from .models import Message
+from .call_state import get_call_state, checkpoint_calls
+from .signaling import IceCandidateBatcher, peer_group_name
+from .typing_state import get_typing_aggregator, forget_typer
+from .helpers import (
+    get_history_page,
+    mark_read_up_to,
+    is_room_member,
+    get_room_member_ids,
+    HISTORY_PAGE_SIZE,
+)
+from . import fanout
 
 User = get_user_model()
 
 
-class ChatConsumer(AsyncWebsocketConsumer):
+class ChatConsumer(BaseConsumer):
     async def connect(self):
         self.user = self.scope.get("user", None)
         self.room_id = self.scope['url_route']['kwargs'].get('room_id')
@@ -23,17 +33,31 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.close(code=403)
             return
 
+        if not await self.is_member():
+            await self.close(code=403)
+            return
+
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
 
         await self.accept()
-        await self.send_history()
+
+        # Reconnect handshake: a client that already holds part of the history
+        # passes ``?last_seen=<message id>`` and only receives the gap.
+        query = parse_qs(self.scope.get("query_string", b"").decode("utf8"))
+        last_seen = self.parse_cursor(query.get("last_seen", [None])[0])
+        if last_seen:
+            await self.send_history(action="resume_history", after=last_seen)
+        else:
+            await self.send_history()
 
     async def disconnect(self, close_code):
         if hasattr(self, "room_id"):
             try:
+                if self.user and self.user.is_authenticated:
+                    await forget_typer(self.room_id, self.user.id)
                 await self.channel_layer.group_discard(
                     self.room_group_name,
                     self.channel_name
@@ -43,8 +67,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     f"[ChatConsumer] Disconnect cleanup failed: {e}"
                 )
 
-    async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
+    async def receive(self, text_data=None, bytes_data=None):
+        text_data_json = self.decode_frame(text_data, bytes_data)
         action = text_data_json['action']
         if action == "new_message":
             await self.save_message(text_data_json)
@@ -54,19 +78,91 @@ class ChatConsumer(AsyncWebsocketConsumer):
             result = await self.delete_message(text_data_json)
             if result:
                 await self.broadcast_message(text_data_json, action)
+        elif action == "read_up_to":
+            await self.read_up_to(
+                self.parse_cursor(text_data_json.get('message'))
+            )
         elif action == "read_messages":
-            serializer = await self.set_read(text_data_json)
-            await self.broadcast_message(serializer, action)
-        elif action == "typing" or action == "stop_typing":
-            await self.broadcast_message(text_data_json, action)
+            # Legacy clients send every message they have seen.
+            message_ids = [
+                self.parse_cursor(item.get('id'))
+                for item in text_data_json.get('messages', [])
+            ]
+            await self.read_up_to(max(filter(None, message_ids), default=None))
+        elif action == "typing":
+            await self.typing_aggregator.typing(
+                self.user.id, self.user.get_full_name
+            )
+        elif action == "stop_typing":
+            await self.typing_aggregator.stop(self.user.id)
+        elif action == "load_history":
+            await self.send_history(
+                action="load_history",
+                before=self.parse_cursor(text_data_json.get('before')),
+                after=self.parse_cursor(text_data_json.get('after')),
+                limit=text_data_json.get('limit'),
+            )
+        elif action == "resume":
+            await self.send_history(
+                action="resume_history",
+                after=self.parse_cursor(text_data_json.get('last_seen')),
+            )
 
-    async def send_history(self):
-        queryset = await self.pull_history(self.room_id)
+    @property
+    def typing_aggregator(self):
+        return get_typing_aggregator(self.channel_layer, self.room_id)
+
+    async def send_history(
+            self,
+            action="pull_history",
+            before=None,
+            after=None,
+            limit=None
+    ):
+        queryset, has_more = await self.pull_history(
+            self.room_id,
+            before=before,
+            after=after,
+            limit=limit
+        )
         message = {
-            "action": "pull_history",
+            "action": action,
             "results": queryset,
+            "has_more": has_more,
         }
-        await self.send(text_data=json.dumps(message))
+        await self.send_message(message)
+
+    @staticmethod
+    def parse_cursor(value):
+        try:
+            return int(value) if value else None
+        except (TypeError, ValueError):
+            return None
+
+    async def read_up_to(self, message_id):
+        if not message_id:
+            return
+        unread_count = await self.set_read(message_id)
+        if unread_count is None:
+            return
+        await self.broadcast_message(
+            {"user": self.user.id, "message": message_id},
+            "read_up_to"
+        )
+        # Keep the room list of the reader's other tabs/devices in sync
+        await self.channel_layer.group_send(
+            f"user_{self.user.id}",
+            self.frame_event(
+                'send_notification',
+                {
+                    "action": "unread_changed",
+                    "results": {
+                        "room": int(self.room_id),
+                        "unread": unread_count
+                    },
+                }
+            )
+        )
 
     async def broadcast_message(self, data: dict, action=None):
         if (isinstance(data, dict) and
@@ -95,12 +191,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 "action": action,
                 "results": data['message']
             }
-        elif action == "read_messages":
-            message = {
-                "action": action,
-                "results": data
-            }
-        elif action == "typing" or action == "stop_typing":
+        elif action == "read_up_to":
             message = {
                 "action": action,
                 "results": data
@@ -111,72 +202,58 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 "results": None
             }
 
-        # Send message to room group
+        # Encode once, every member of the room group gets the same frame
         await self.channel_layer.group_send(
             self.room_group_name,
-            {
-                'type': 'chat_message',
-                'message': message
-            }
+            self.frame_event('chat_message', message)
         )
 
     async def chat_message(self, event):
-        message = event['message']
-
         # Send message to WebSocket
-        await self.send(text_data=json.dumps(message))
+        await self.send_frame(event)
 
     async def send_notification(self, data: dict, action=None):
         if data.get("type", '') == "send_notification":
             action = data['message']['action']
             data = data['message']['data']
-        participants = await self.get_participants()
-        messages = await self.ready_message(action, participants, data)
-        for message in messages:
-            await self.channel_layer.group_send(
-                f"user_{message['target']}",
-                {
-                    'type': 'send_notification',
-                    'message': message
-                }
-            )
+        participants = await self.get_participant_ids()
+        event = self.frame_event(
+            'send_notification',
+            {"action": action, "results": data}
+        )
+        await fanout.send_events(
+            self.channel_layer,
+            fanout.user_events(participants, event),
+            room_size=len(participants)
+        )
 
-    @sync_to_async
-    def ready_message(self, action, participants, data):
-        messages = []
-        for participant in participants:
-            messages.append(
-                {
-                    "action": action,
-                    "target": participant.id,
-                    "results": data
-                }
-            )
-        return messages
+    @database_sync_to_async
+    def is_member(self):
+        return is_room_member(self.room_id, self.user.id)
 
     @database_sync_to_async
-    def get_participants(self):
-        room = Room.objects.get(id=self.room_id)
-        return list(room.participants.all())
+    def get_participant_ids(self):
+        return get_room_member_ids(self.room_id)
 
     @database_sync_to_async
-    def pull_history(self, room_id):
-        queryset = Message.objects.filter(room_id=room_id)[:25]
+    def pull_history(self, room_id, before=None, after=None, limit=None):
+        try:
+            limit = int(limit) if limit else HISTORY_PAGE_SIZE
+        except (TypeError, ValueError):
+            limit = HISTORY_PAGE_SIZE
+        queryset, has_more = get_history_page(
+            room_id,
+            before=before,
+            after=after,
+            limit=limit
+        )
         return self.get_serializer_data_to_dict(
             MessageSerializer(queryset, many=True)
-        )
+        ), has_more
 
     @database_sync_to_async
-    def set_read(self, data):
-        dict_data = data['messages']
-        queryset = []
-        for data in dict_data:
-            message = Message.objects.get(id=data['id'])
-            message.have_read.add(self.user)
-            queryset.append(message)
-        return self.get_serializer_data_to_dict(
-            MessageSerializer(queryset, many=True)
-        )
+    def set_read(self, message_id):
+        return mark_read_up_to(self.room_id, self.user.id, message_id)
 
     @database_sync_to_async
     def save_message(self, data):
@@ -238,8 +315,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
             return False
 
     def get_serializer_data_to_dict(self, serializer):
-        serialized_data = JSONRenderer().render(serializer.data)
-        return json.loads(serialized_data.decode())
+        # Frames are encoded once when they are sent, no need to round-trip
+        return serializer.data
 
     def have_delete_permission(self, message: Message) -> bool:
         """
@@ -280,55 +357,73 @@ class ChatConsumer(AsyncWebsocketConsumer):
         return False
 
 
-class VideoCallConsumer(AsyncWebsocketConsumer):
+class VideoCallConsumer(BaseConsumer):
     async def connect(self):
         # Always set essential attributes first
         self.room_id = self.scope["url_route"]["kwargs"].get("room_id")
         self.room_group_name = f"video_call_{self.room_id}"
         self.user = self.scope.get("user")
+        self.joined = False
+        self.ice_batcher = IceCandidateBatcher(self.send_candidates)
 
-        # Reject unauthenticated users
+        # Reject unauthenticated users and non participants
         if not self.user or not self.user.is_authenticated:
             await self.close(code=403)
             return
 
+        if not await self.is_member():
+            await self.close(code=403)
+            return
+
         # Safely join channel layer group
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
+        # Signaling addressed to this user only
+        self.peer_group_name = peer_group_name(self.room_id, self.user.id)
+        await self.channel_layer.group_add(
+            self.peer_group_name,
+            self.channel_name
+        )
 
         # Accept connection after group join
         await self.accept()
+        self.joined = True
 
         # Notify others and update DB
         await self.send_leave_join_call("joined_call")
         await self.join_call()
 
     async def disconnect(self, close_code):
-        # Only perform cleanup if room_id was set
-        if hasattr(self, "room_id"):
+        # Only perform cleanup if the connection was accepted
+        if getattr(self, "joined", False):
             try:
+                await self.ice_batcher.close()
                 await self.leave_call()
                 await self.send_leave_join_call("leave_call")
                 await self.channel_layer.group_discard(
                     self.room_group_name,
                     self.channel_name
                 )
+                await self.channel_layer.group_discard(
+                    self.peer_group_name,
+                    self.channel_name
+                )
             except Exception as e:
                 # Optional: log the error, but don't crash
                 print(
                     f"[VideoCallConsumer] Disconnect cleanup failed: {e}"
                 )
 
-    async def receive(self, text_data):
-        data = json.loads(text_data)
+    async def receive(self, text_data=None, bytes_data=None):
+        data = self.decode_frame(text_data, bytes_data)
         action = data.get("action")
 
         action_map = {
-            "offer": self.broadcast_message,
-            "answer": self.broadcast_message,
-            "ice_candidate": self.broadcast_message,
+            "offer": self.send_signal,
+            "answer": self.send_signal,
+            "ice_candidate": self.queue_candidate,
             "start_call": lambda _: self.start_call(),
             "end_call": lambda _: self.end_call(),
             "leave_call": lambda _: self.send_leave_join_call(
@@ -360,99 +455,116 @@ class VideoCallConsumer(AsyncWebsocketConsumer):
         """Send WebRTC signaling events to all participants."""
         await self.channel_layer.group_send(
             self.room_group_name,
-            {"type": "video_message", "message": data}
+            self.frame_event("video_message", data)
+        )
+
+    @staticmethod
+    def parse_peer(value):
+        try:
+            return int(value) if value is not None else None
+        except (TypeError, ValueError):
+            return None
+
+    async def send_signal(self, data):
+        """Relay an offer or answer to the ``to`` peer, or to everyone."""
+        to = self.parse_peer(data.get("to"))
+        # A new negotiation restarts ICE, candidates may be sent again
+        self.ice_batcher.reset(to)
+        await self.send_to_peer(to, {**data, "from": self.user.id})
+
+    async def queue_candidate(self, data):
+        self.ice_batcher.add(
+            self.parse_peer(data.get("to")),
+            data.get("candidate")
+        )
+
+    async def send_candidates(self, to, candidates):
+        await self.send_to_peer(to, {
+            "action": "ice_candidates",
+            "results": {
+                "from": self.user.id,
+                "candidates": candidates,
+            },
+        })
+
+    async def send_to_peer(self, to, data):
+        """Send to the connections of one peer, or to the whole call."""
+        group = (
+            self.room_group_name if to is None
+            else peer_group_name(self.room_id, to)
+        )
+        await self.channel_layer.group_send(
+            group,
+            self.frame_event("video_message", data)
         )
 
     async def video_message(self, event):
         """Receive messages from group and forward to WebSocket."""
-        await self.send(text_data=json.dumps(event["message"]))
+        await self.send_frame(event)
 
     async def broadcast_status(self, action):
         """Broadcast participant updates."""
         participants = await self.get_participants()
         await self.channel_layer.group_send(
             self.room_group_name,
-            {
-                "type": "video_message",
-                "message": {
+            self.frame_event(
+                "video_message",
+                {
                     "action": action,
                     "results": {"participants": participants},
                 }
-            }
+            )
         )
 
-    # --- Database operations ---
-    @database_sync_to_async
-    def join_call(self):
-        from django.utils import timezone
-
-        room = Room.objects.get(id=self.room_id)
-
-        # Try retrieving existing call
-        call, created = VideoCall.objects.get_or_create(
-            room=room,
-            defaults={
-                "creator": self.user,
-                "status": VideoCall.StatusChoices.ONGOING,
-                "started_at": timezone.now(),
-            }
-        )
+    # --- Call state ---
+    @property
+    def call_state(self):
+        return get_call_state()
 
-        # If call existed and was ended, "re-open" it
-        if not created and call.status == VideoCall.StatusChoices.ENDED:
-            call.creator = self.user  # update host if needed
-            call.status = VideoCall.StatusChoices.ONGOING
-            call.started_at = timezone.now()  # reset start time
-            call.ended_at = None  # clear end time
-            call.save(
-                update_fields=["creator", "status", "started_at",
-                               "ended_at"]
-                )
+    async def checkpoint(self, transition):
+        """Write the call to the database now if it started or ended."""
+        if transition or self.call_state.checkpoint_inline:
+            await database_sync_to_async(checkpoint_calls)(self.call_state)
 
-        # Add participant if not already present
-        call.participants.add(self.user)
+    async def join_call(self):
+        if settings.CALL_PARTICIPANTS_FROM_LIVEKIT:
+            return
+        await self.checkpoint(await self.call_state.join(
+            self.room_id,
+            self.user.id,
+            self.channel_name
+        ))
 
-        return call
+    async def leave_call(self):
+        if settings.CALL_PARTICIPANTS_FROM_LIVEKIT:
+            return
+        await self.checkpoint(await self.call_state.leave(
+            self.room_id,
+            self.channel_name
+        ))
 
-    @database_sync_to_async
-    def leave_call(self):
-        try:
-            call = VideoCall.objects.get(room_id=self.room_id)
-            call.participants.remove(self.user)
-            if call.participants.count() == 0:
-                call.mark_end()
-        except VideoCall.DoesNotExist:
-            pass
+    async def start_call(self):
+        await self.checkpoint(
+            await self.call_state.start(self.room_id, self.user.id)
+        )
 
-    @database_sync_to_async
-    def start_call(self):
-        try:
-            call = VideoCall.objects.get(room_id=self.room_id)
-            if call.status != VideoCall.StatusChoices.ONGOING:
-                call.mark_started()
-        except VideoCall.DoesNotExist:
-            pass
+    async def end_call(self):
+        await self.checkpoint(await self.call_state.end(self.room_id))
 
     @database_sync_to_async
-    def end_call(self):
-        try:
-            call = VideoCall.objects.get(room_id=self.room_id)
-            call.mark_end()
-        except VideoCall.DoesNotExist:
-            pass
+    def is_member(self):
+        return is_room_member(self.room_id, self.user.id)
 
     @database_sync_to_async
     def get_participants(self):
-        try:
-            call = VideoCall.objects.get(room_id=self.room_id)
-            serializer = PublicUserSerializer(
-                call.participants.all(),
-                many=True
-            )
-            return self._serializer_to_dict(serializer)
-        except VideoCall.DoesNotExist:
-            return []
+        serializer = PublicUserSerializer(
+            User.objects.filter(
+                pk__in=self.call_state.participants(self.room_id)
+            ),
+            many=True
+        )
+        return self._serializer_to_dict(serializer)
 
     def _serializer_to_dict(self, serializer):
-        """Convert DRF serializer to dict."""
-        return json.loads(JSONRenderer().render(serializer.data).decode())
+        """Serializer data; frames are encoded once when they are sent."""
+        return serializer.data
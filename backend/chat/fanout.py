@@ -0,0 +1,214 @@
+"""
+Fan-out of WebSocket events to many channel-layer groups.
+
+Callers resolve their recipients once and hand over a list of
+``(group, event)`` pairs. The sends are issued concurrently on one event
+loop, so a room of N participants costs one batch instead of N blocking
+round-trips. Sync code (signals, views) only enqueues the batch; a
+background thread owning its own loop performs the sends.
+
+Fan-out latency is recorded per room, in the bucket of its number of
+participants, and periodically written to the cache from an executor thread,
+see the ``fanout_stats`` management command. Batches spanning several rooms
+(the outbox) are sent as one ``(room size, events)`` batch per room.
+"""
+import asyncio
+import logging
+import os
+import socket
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer, InMemoryChannelLayer
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Concurrent group sends per batch chunk
+FANOUT_CONCURRENCY = 100
+# Upper bounds of the room-size buckets used for the latency metric
+FANOUT_SIZE_BUCKETS = (10, 50, 200, 1000)
+FANOUT_METRICS_CACHE_KEY = "chat:fanout_metrics"
+FANOUT_METRICS_TIMEOUT = 60 * 60
+FANOUT_METRICS_FLUSH_INTERVAL = 10
+
+
+def user_events(user_ids, event):
+    """Pair ``event`` with the personal group of every user."""
+    return [(f"user_{user_id}", event) for user_id in user_ids]
+
+
+class FanOutMetrics:
+    """Count, total and max fan-out latency per room-size bucket."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.flushed_at = time.monotonic()
+        self.key = "%s:%s:%s" % (
+            FANOUT_METRICS_CACHE_KEY, socket.gethostname(), os.getpid()
+        )
+
+    @staticmethod
+    def bucket(size):
+        for bound in FANOUT_SIZE_BUCKETS:
+            if size <= bound:
+                return f"<={bound}"
+        return f">{FANOUT_SIZE_BUCKETS[-1]}"
+
+    def observe(self, size, seconds) -> bool:
+        """Record one fan-out. Returns whether the stats are due a ``flush``."""
+        with self.lock:
+            stats = self.buckets.setdefault(
+                self.bucket(size),
+                {"count": 0, "total_ms": 0.0, "max_ms": 0.0}
+            )
+            stats["count"] += 1
+            stats["total_ms"] += seconds * 1000
+            stats["max_ms"] = max(stats["max_ms"], seconds * 1000)
+            now = time.monotonic()
+            due = now - self.flushed_at >= FANOUT_METRICS_FLUSH_INTERVAL
+            if due:
+                self.flushed_at = now
+        return due
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                bucket: dict(stats) for bucket, stats in self.buckets.items()
+            }
+
+    def flush(self):
+        """
+        Publish this process's stats so they can be read from elsewhere.
+        Blocking, run it off the event loop.
+        """
+        try:
+            cache.set(self.key, self.snapshot(), FANOUT_METRICS_TIMEOUT)
+            keys = set(cache.get(FANOUT_METRICS_CACHE_KEY) or ())
+            if self.key not in keys:
+                keys.add(self.key)
+                cache.set(FANOUT_METRICS_CACHE_KEY, keys, None)
+        except Exception as e:
+            logger.warning("Could not store fan-out metrics: %s", e)
+
+
+metrics = FanOutMetrics()
+
+
+async def send_events(channel_layer, events, room_size=None, semaphore=None):
+    """
+    Send every ``(group, event)`` pair, at most ``FANOUT_CONCURRENCY`` at a
+    time. Returns the groups the send failed for.
+
+    ``room_size``, the number of participants of the room the events are
+    for, buckets the latency; fan-outs outside of a room are not recorded.
+    """
+    failed = []
+    if not events:
+        return failed
+    semaphore = semaphore or asyncio.Semaphore(FANOUT_CONCURRENCY)
+
+    async def send(group, event):
+        async with semaphore:
+            await channel_layer.group_send(group, event)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        *(send(group, event) for group, event in events),
+        return_exceptions=True
+    )
+    for (group, _), result in zip(events, results):
+        if isinstance(result, Exception):
+            logger.error("Fan-out to %s failed: %s", group, result)
+            failed.append(group)
+    elapsed = time.perf_counter() - started
+    if room_size is not None:
+        if metrics.observe(room_size, elapsed):
+            asyncio.get_running_loop().run_in_executor(None, metrics.flush)
+        logger.debug(
+            "Fan-out to %s groups of a room of %s took %.1f ms",
+            len(events), room_size, elapsed * 1000
+        )
+    return failed
+
+
+async def send_batches(channel_layer, batches):
+    """
+    Send ``(room size, events)`` batches concurrently, each timed on its own.
+    Returns the groups the send failed for.
+    """
+    semaphore = asyncio.Semaphore(FANOUT_CONCURRENCY)
+    results = await asyncio.gather(*(
+        send_events(channel_layer, events, room_size, semaphore)
+        for room_size, events in batches
+    ))
+    return [group for failed in results for group in failed]
+
+
+class FanOutWorker:
+    """Daemon thread running the loop that performs queued fan-outs."""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever,
+            name="chat-fanout",
+            daemon=True
+        )
+        self.thread.start()
+
+    def submit(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_worker() -> FanOutWorker:
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = FanOutWorker()
+        return _worker
+
+
+def run(send, channel_layer, *args):
+    """
+    Run ``send(channel_layer, *args)`` without blocking the caller. Meant for
+    sync code; async code should await the send on its own loop.
+    """
+    channel_layer = channel_layer or get_channel_layer()
+    if isinstance(channel_layer, InMemoryChannelLayer):
+        # The in-memory layer can only be used from the loop that owns it
+        async_to_sync(send)(channel_layer, *args)
+        return
+    get_worker().submit(send(channel_layer, *args))
+
+
+def submit(events, channel_layer=None, room_size=None):
+    """Fan ``events`` out in the background, see ``send_events``."""
+    run(send_events, channel_layer, events, room_size)
+
+
+def submit_batches(batches, channel_layer=None):
+    """Fan ``(room size, events)`` batches out in the background."""
+    run(send_batches, channel_layer, batches)
+
+
+def collect_metrics():
+    """Merge the stats published by every process."""
+    merged = {}
+    keys = cache.get(FANOUT_METRICS_CACHE_KEY) or ()
+    for snapshot in cache.get_many(list(keys)).values():
+        for bucket, stats in snapshot.items():
+            total = merged.setdefault(
+                bucket,
+                {"count": 0, "total_ms": 0.0, "max_ms": 0.0}
+            )
+            total["count"] += stats["count"]
+            total["total_ms"] += stats["total_ms"]
+            total["max_ms"] = max(total["max_ms"], stats["max_ms"])
+    return merged
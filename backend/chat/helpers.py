@@ -0,0 +1,451 @@
+from typing import Optional
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import models
+from django.db.models import (
+    Q, F, Exists, Case, When, Value, Count, Subquery, OuterRef, Window
+)
+from django.db.models.functions import Coalesce, RowNumber
+from django.utils import timezone
+
+from accounts.v1.serializers import PublicUserSerializer, load_presence
+from main.models import Family
+from uploads.storage import get_media_storage
+from .models import Message, ArchivedMessage, Room, RoomMember
+
+HISTORY_PAGE_SIZE = 25
+HISTORY_MAX_PAGE_SIZE = 100
+
+ROOM_PREVIEW_PARTICIPANTS = 4
+
+ROOM_MEMBERS_CACHE_KEY = "chat:room_members:{}"
+ROOM_MEMBERS_CACHE_TIMEOUT = 60 * 60
+
+
+def get_history_page(
+        room_id,
+        before: Optional[int] = None,
+        after: Optional[int] = None,
+        limit: int = HISTORY_PAGE_SIZE
+):
+    """
+    Return one page of room history using keyset pagination on
+    ``(room_id, created_at, id)``.
+
+    - ``before``: messages strictly older than the given message id.
+    - ``after``: messages strictly newer than the given message id, starting
+      from the oldest one (used to fill the gap after a reconnect).
+    - neither: the newest page.
+
+    Archived messages are all older than the hot ones of their room, so a
+    page reads the hot table first and only continues into
+    ``ArchivedMessage`` when it runs out (the other way round for
+    ``after``).
+
+    Returns ``(messages, has_more)`` where ``messages`` is always ordered
+    newest first, like ``pull_history``.
+    """
+    limit = max(1, min(int(limit or HISTORY_PAGE_SIZE), HISTORY_MAX_PAGE_SIZE))
+    cursor_id = before or after
+    cursor = None
+    archived_cursor = False
+
+    if cursor_id:
+        cursor = Message.objects.filter(
+            room_id=room_id,
+            pk=cursor_id
+        ).values('created_at', 'id').first()
+        if cursor is None:
+            archived_cursor = True
+            cursor = ArchivedMessage.objects.filter(
+                room_id=room_id,
+                pk=cursor_id
+            ).values('created_at', 'id').first()
+        if cursor is None:
+            return [], False
+
+    if after:
+        # A hot cursor has nothing newer in the archive
+        sources = [ArchivedMessage, Message] if archived_cursor else [Message]
+    else:
+        # An archived cursor has nothing older in the hot table
+        sources = [ArchivedMessage] if archived_cursor else [Message, ArchivedMessage]
+
+    messages = []
+    for model in sources:
+        queryset = model.objects.filter(room_id=room_id)
+        if before:
+            queryset = queryset.filter(
+                Q(created_at__lt=cursor['created_at']) |
+                Q(created_at=cursor['created_at'], id__lt=cursor['id'])
+            ).order_by('-created_at', '-id')
+        elif after:
+            queryset = queryset.filter(
+                Q(created_at__gt=cursor['created_at']) |
+                Q(created_at=cursor['created_at'], id__gt=cursor['id'])
+            ).order_by('created_at', 'id')
+        else:
+            queryset = queryset.order_by('-created_at', '-id')
+        if model is Message:
+            queryset = queryset.select_related('user', 'reply_to')
+        else:
+            queryset = queryset.select_related('user')
+        messages += queryset[:limit + 1 - len(messages)]
+        if len(messages) > limit:
+            break
+
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+
+    if after:
+        messages.reverse()
+
+    return messages, has_more
+
+
+def count_unread(room_id, user_id, after_id):
+    """
+    Subquery counting the messages of a room newer than ``after_id`` that
+    were not sent by ``user_id``. Arguments may be ``OuterRef`` expressions.
+    """
+    queryset = Message.objects.filter(
+        room_id=room_id,
+        pk__gt=after_id
+    ).exclude(
+        user_id=user_id
+    ).order_by().values('room_id').annotate(count=Count('pk'))
+    return Coalesce(Subquery(queryset.values('count')[:1]), 0)
+
+
+def create_missing_room_members(batch_size=1000) -> int:
+    """
+    Create the ``RoomMember`` rows missing for room participants, with their
+    unread counter and activity time, so no room is left out of the room
+    list. Returns the number created.
+    """
+    missing = Room.participants.through.objects.exclude(
+        Exists(
+            RoomMember.objects.filter(
+                room_id=OuterRef('room_id'),
+                user_id=OuterRef('user_id')
+            )
+        )
+    ).annotate(
+        unread_count=count_unread(OuterRef('room_id'), OuterRef('user_id'), 0),
+        last_activity_at=F('room__last_activity_at'),
+    ).values_list('room_id', 'user_id', 'unread_count', 'last_activity_at')
+    created = RoomMember.objects.bulk_create(
+        [
+            RoomMember(
+                room_id=room_id,
+                user_id=user_id,
+                unread_count=unread_count,
+                last_activity_at=last_activity_at
+            )
+            for room_id, user_id, unread_count, last_activity_at
+            in missing.iterator()
+        ],
+        batch_size=batch_size,
+        ignore_conflicts=True
+    )
+    return len(created)
+
+
+def mark_read_up_to(room_id, user_id, message_id) -> Optional[int]:
+    """
+    Move the (room, user) read watermark forward to ``message_id`` and reset
+    the unread counter to what is left after it.
+
+    The common case is a single conditional UPDATE; the watermark never moves
+    backwards and only accepts messages that belong to the room. Returns the
+    new unread count, or ``None`` when the watermark did not change.
+    """
+    now = timezone.now()
+    in_room = Message.objects.filter(room_id=room_id, pk=message_id)
+    updated = RoomMember.objects.filter(
+        Q(last_read_message__isnull=True) |
+        Q(last_read_message_id__lt=message_id),
+        Exists(in_room),
+        room_id=room_id,
+        user_id=user_id,
+    ).update(
+        last_read_message_id=message_id,
+        last_read_at=now,
+        unread_count=count_unread(room_id, user_id, message_id),
+    )
+    if updated:
+        return RoomMember.objects.filter(
+            room_id=room_id,
+            user_id=user_id
+        ).values_list('unread_count', flat=True).first()
+
+    if not in_room.exists():
+        return None
+    member, created = RoomMember.objects.get_or_create(
+        room_id=room_id,
+        user_id=user_id,
+        defaults={
+            'last_read_message_id': message_id,
+            'last_read_at': now,
+            'unread_count': Message.objects.filter(
+                room_id=room_id,
+                pk__gt=message_id
+            ).exclude(user_id=user_id).count(),
+        }
+    )
+    return member.unread_count if created else None
+
+
+def record_new_message(message: Message):
+    """
+    Bump the unread counters of every participant except the sender in one
+    statement. Sending a message also moves the sender's watermark to it.
+    The room's last message and activity time move to the new message.
+    """
+    Room.objects.filter(pk=message.room_id).update(
+        last_message=message.id,
+        last_activity_at=message.created_at,
+    )
+    is_sender = Q(user_id=message.user_id)
+    RoomMember.objects.filter(room_id=message.room_id).update(
+        last_activity_at=message.created_at,
+        unread_count=Case(
+            When(is_sender, then=Value(0)),
+            default=F('unread_count') + 1,
+            output_field=models.PositiveIntegerField(),
+        ),
+        last_read_message_id=Case(
+            When(is_sender, then=Value(message.id)),
+            default=F('last_read_message_id'),
+            output_field=models.BigIntegerField(),
+        ),
+        last_read_at=Case(
+            When(is_sender, then=Value(message.created_at)),
+            default=F('last_read_at'),
+            output_field=models.DateTimeField(),
+        ),
+    )
+
+
+def record_deleted_message(message: Message):
+    """
+    Drop a deleted message from the counters of users who had not read it.
+    When it was the last message of the room, point the room at the
+    previous one.
+    """
+    RoomMember.objects.filter(
+        Q(last_read_message__isnull=True) |
+        Q(last_read_message_id__lt=message.id),
+        room_id=message.room_id,
+        unread_count__gt=0,
+    ).exclude(
+        user_id=message.user_id
+    ).update(unread_count=F('unread_count') - 1)
+
+    # `on_delete=SET_NULL` already cleared the pointer if it was this message
+    latest = Message.objects.filter(
+        room_id=OuterRef('pk')
+    ).order_by('-created_at', '-id')
+    updated = Room.objects.filter(
+        pk=message.room_id,
+        last_message__isnull=True
+    ).update(
+        last_message=Subquery(latest.values('pk')[:1]),
+        last_activity_at=Coalesce(
+            Subquery(latest.values('created_at')[:1]),
+            F('last_activity_at')
+        ),
+    )
+    if updated:
+        RoomMember.objects.filter(room_id=message.room_id).update(
+            last_activity_at=Subquery(
+                Room.objects.filter(
+                    pk=message.room_id
+                ).values('last_activity_at')[:1]
+            )
+        )
+
+
+def with_unread_count(queryset, user):
+    """Annotate a Room queryset with ``unread_count`` for ``user``."""
+    return queryset.annotate(
+        unread_count=Coalesce(
+            Subquery(
+                RoomMember.objects.filter(
+                    room_id=OuterRef('pk'),
+                    user_id=user.pk
+                ).values('unread_count')[:1]
+            ),
+            0
+        )
+    )
+
+
+def get_room_summaries(user, room_ids=None):
+    """
+    Compact projection of the inbox of ``user`` for the room list: one
+    ``values()`` query for the rooms and their last message, and one for the
+    first ``ROOM_PREVIEW_PARTICIPANTS`` participants of every room (the user
+    last) with the participant count, and one for the admins of their
+    families, which the permission checks of the client read.
+    ``RoomSerializer`` is kept for the room detail.
+    """
+    queryset = Room.objects.filter(
+        members_state__user=user,
+        is_active=True,
+    )
+    if room_ids is not None:
+        queryset = queryset.filter(pk__in=room_ids)
+    rows = list(
+        queryset.order_by(
+            '-members_state__last_activity_at', '-pk'
+        ).values(
+            'id',
+            'type',
+            'title',
+            'avatar',
+            'is_archived',
+            'last_activity_at',
+            'last_message_id',
+            'created_by_id',
+            'family_id',
+            unread_count=F('members_state__unread_count'),
+            family_name=F('family__name'),
+            family_avatar=F('family__avatar'),
+            family_creator_id=F('family__creator_id'),
+            video_call_status=F('video_call__status'),
+            message_content=F('last_message__content'),
+            message_created_at=F('last_message__created_at'),
+            message_user_id=F('last_message__user_id'),
+            message_user_username=F('last_message__user__username'),
+            message_user_first_name=F('last_message__user__first_name'),
+            message_user_last_name=F('last_message__user__last_name'),
+        )
+    )
+
+    previews = {}
+    participants = Room.participants.through.objects.filter(
+        room_id__in=[row['id'] for row in rows]
+    ).annotate(
+        position=Window(
+            RowNumber(),
+            partition_by=[F('room_id')],
+            order_by=[
+                Case(When(user_id=user.pk, then=1), default=0).asc(),
+                F('user_id').asc(),
+            ],
+        ),
+        total=Window(Count('pk'), partition_by=[F('room_id')]),
+    ).filter(
+        position__lte=ROOM_PREVIEW_PARTICIPANTS
+    ).select_related('user').order_by('room_id', 'position')
+    participants = list(participants)
+    context = {}
+    load_presence(context, {item.user_id for item in participants})
+    for item in participants:
+        preview = previews.setdefault(
+            item.room_id,
+            {"participants": [], "participants_count": item.total}
+        )
+        preview["participants"].append(
+            PublicUserSerializer(item.user, context=context).data
+        )
+
+    admins = {}
+    family_ids = {row['family_id'] for row in rows if row['family_id']}
+    if family_ids:
+        for family_id, user_id in Family.admins.through.objects.filter(
+            family_id__in=family_ids
+        ).values_list('family_id', 'user_id'):
+            admins.setdefault(family_id, []).append(user_id)
+
+    return [
+        summarize_room(row, previews.get(row['id']), admins.get(row['family_id']))
+        for row in rows
+    ]
+
+
+def summarize_room(row, preview=None, admin_ids=None):
+    preview = preview or {"participants": [], "participants_count": 0}
+    last_message = None
+    if row['last_message_id']:
+        author = None
+        if row['message_user_id']:
+            user = get_user_model()(
+                id=row['message_user_id'],
+                username=row['message_user_username'],
+                first_name=row['message_user_first_name'],
+                last_name=row['message_user_last_name'],
+            )
+            author = {"id": user.id, "full_name": user.get_full_name}
+        last_message = {
+            "id": row['last_message_id'],
+            "room": row['id'],
+            "content": row['message_content'],
+            "created_at": row['message_created_at'],
+            "user": author,
+        }
+    family = None
+    if row['family_id']:
+        family = {
+            "id": row['family_id'],
+            "name": row['family_name'],
+            "avatar": file_url(row['family_avatar']),
+            "creator": row['family_creator_id'],
+            "admins": admin_ids or [],
+        }
+    video_call = None
+    if row['video_call_status']:
+        video_call = {"status": row['video_call_status']}
+    return {
+        "id": row['id'],
+        "type": row['type'],
+        "title": row['title'],
+        "avatar": file_url(row['avatar']),
+        "created_by": row['created_by_id'],
+        "is_archived": row['is_archived'],
+        "family": family,
+        "video_call": video_call,
+        "participants": preview["participants"],
+        "participants_count": preview["participants_count"],
+        "last_message": last_message,
+        "last_activity_at": row['last_activity_at'],
+        "unread_count": row['unread_count'],
+    }
+
+
+def file_url(name):
+    return get_media_storage().url(name) if name else None
+
+
+def get_room_member_ids(room_id) -> frozenset:
+    """
+    Ids of the participants of a room, cached per room until its membership
+    changes (see ``chat.signals``).
+    """
+    key = ROOM_MEMBERS_CACHE_KEY.format(room_id)
+    member_ids = cache.get(key)
+    if member_ids is None:
+        member_ids = frozenset(
+            Room.participants.through.objects.filter(
+                room_id=room_id
+            ).values_list('user_id', flat=True)
+        )
+        cache.set(key, member_ids, ROOM_MEMBERS_CACHE_TIMEOUT)
+    return member_ids
+
+
+def is_room_member(room_id, user_id) -> bool:
+    """Whether ``user_id`` participates in ``room_id``, served from cache."""
+    try:
+        room_id = int(room_id)
+    except (TypeError, ValueError):
+        return False
+    return user_id in get_room_member_ids(room_id)
+
+
+def invalidate_room_members(room_ids):
+    cache.delete_many(
+        [ROOM_MEMBERS_CACHE_KEY.format(room_id) for room_id in room_ids]
+    )
@@ -0,0 +1,187 @@
+"""
+Selection of the ICE servers handed out with call tokens.
+
+Active ``IceServer`` rows are kept in process memory for
+``ICE_SERVER_CACHE_TTL`` seconds, and dropped when one is saved or deleted
+in this process; the other processes pick the change up when their copy
+expires.
+
+Clients get the servers of their region, found from their IP address in the
+CIDR table at ``settings.ICE_REGION_TABLE``: one ``<network>,<region>`` line
+per network, ``#`` starting a comment. The most specific network wins.
+Clients outside the table, or in a region without servers, get those of
+``settings.ICE_DEFAULT_REGION``. Servers without a region are global and
+come last for everyone. A client left without any server gets them all.
+
+The address of a client is the ``X-Real-IP`` header set by nginx, only
+trusted from the proxies of ``settings.ICE_TRUSTED_PROXIES`` (networks, or
+host names such as the nginx service of docker-compose). Anyone reaching
+the app server directly is located by their own address.
+"""
+import ipaddress
+import socket
+import threading
+import time
+
+from django.conf import settings
+
+from .models import IceServer
+
+ICE_SERVER_CACHE_TTL = 60
+
+
+class RegionTable:
+    """Longest-prefix match of IP addresses to region labels."""
+
+    def __init__(self, entries=()):
+        # {(version, prefix length): {network address: region}}
+        self.networks = {}
+        for network, region in entries:
+            network = ipaddress.ip_network(network, strict=False)
+            self.networks.setdefault(
+                (network.version, network.prefixlen), {}
+            )[int(network.network_address)] = region
+        # Most specific first
+        self.prefixes = sorted(
+            self.networks, key=lambda prefix: prefix[1], reverse=True
+        )
+
+    @classmethod
+    def from_file(cls, path):
+        entries = []
+        with open(path) as table:
+            for line in table:
+                line = line.split("#", 1)[0].strip()
+                if line:
+                    network, region = line.split(",", 1)
+                    entries.append((network.strip(), region.strip()))
+        return cls(entries)
+
+    def lookup(self, address):
+        """Region of an IP address, None if it is not in the table."""
+        try:
+            address = ipaddress.ip_address(address)
+        except ValueError:
+            return None
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        value = int(address)
+        for version, prefixlen in self.prefixes:
+            if version != address.version:
+                continue
+            host_bits = address.max_prefixlen - prefixlen
+            region = self.networks[version, prefixlen].get(
+                value >> host_bits << host_bits
+            )
+            if region is not None:
+                return region
+        return None
+
+
+class IceServerRegistry:
+    def __init__(self, ttl=ICE_SERVER_CACHE_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.loaded_at = None
+        self.by_region = {}
+        self.regions = None
+        self.proxies = None
+        self.proxies_loaded_at = None
+
+    def invalidate(self):
+        with self.lock:
+            self.loaded_at = None
+
+    def servers(self):
+        """``{region or None: [server dict, ...]}``, best first."""
+        with self.lock:
+            if self.loaded_at is None or time.monotonic() - self.loaded_at > self.ttl:
+                by_region = {}
+                for server in IceServer.objects.filter(
+                        is_active=True
+                ).order_by("priority", "type"):
+                    by_region.setdefault(server.region or None, []).append(
+                        server.as_dict()
+                    )
+                self.by_region = by_region
+                self.loaded_at = time.monotonic()
+            return self.by_region
+
+    def region_table(self):
+        with self.lock:
+            if self.regions is None:
+                path = getattr(settings, "ICE_REGION_TABLE", "")
+                self.regions = (
+                    RegionTable.from_file(path) if path else RegionTable()
+                )
+            return self.regions
+
+    def trusted_proxies(self):
+        """Networks of the proxies allowed to set ``X-Real-IP``."""
+        with self.lock:
+            # Host names are resolved again with the servers, containers move
+            if self.proxies is None or time.monotonic() - self.proxies_loaded_at > self.ttl:
+                networks = []
+                for entry in getattr(settings, "ICE_TRUSTED_PROXIES", ()):
+                    try:
+                        networks.append(ipaddress.ip_network(entry, strict=False))
+                        continue
+                    except ValueError:
+                        pass
+                    try:
+                        addresses = {
+                            info[4][0] for info in socket.getaddrinfo(entry, None)
+                        }
+                    except OSError:
+                        continue
+                    networks += [
+                        ipaddress.ip_network(address) for address in addresses
+                        if "%" not in address
+                    ]
+                self.proxies = networks
+                self.proxies_loaded_at = time.monotonic()
+            return self.proxies
+
+    def is_trusted_proxy(self, address):
+        try:
+            address = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        return any(address in network for network in self.trusted_proxies())
+
+    def for_address(self, address):
+        """The ICE servers a client at this IP address should use."""
+        servers = self.servers()
+        region = self.region_table().lookup(address) if address else None
+        if region is None or region not in servers:
+            region = getattr(settings, "ICE_DEFAULT_REGION", "") or None
+        regional = servers.get(region, []) if region else []
+        selected = regional + servers.get(None, [])
+        if not selected:
+            # Better a far server than none
+            selected = [
+                server for region_servers in servers.values()
+                for server in region_servers
+            ]
+        return selected
+
+
+registry = IceServerRegistry()
+
+
+def client_address(request):
+    """IP address of the client, as seen by nginx when nginx is the peer."""
+    address = request.META.get("REMOTE_ADDR")
+    if address and registry.is_trusted_proxy(address):
+        return request.META.get("HTTP_X_REAL_IP") or address
+    return address
+
+
+def get_ice_servers(request):
+    return registry.for_address(client_address(request))
+
+
+def invalidate_ice_servers():
+    registry.invalidate()
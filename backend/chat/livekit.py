@@ -0,0 +1,134 @@
+"""
+LiveKit webhooks as the source of call participants.
+
+LiveKit knows who is connected to its rooms, so its ``participant_joined``,
+``participant_left`` and ``room_finished`` events are applied to the call
+state (see ``chat.call_state``), each LiveKit participant session being one
+connection ``livekit:<participant sid>``. Like socket connections, the
+changes reach ``VideoCall`` through ``checkpoint_calls`` in batches, right
+away only when a call starts or ends.
+
+LiveKit retries deliveries and does not guarantee their order: events are
+applied once per event id, and a participant that left is remembered for a
+while so a late ``participant_joined`` cannot bring it back.
+
+Access tokens name the LiveKit room after the chat room id and use the user
+id as participant identity, see ``livekit_room_name``.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from livekit import api
+
+from .call_state import get_call_state, checkpoint_calls
+
+LIVEKIT_ROOM_PREFIX = "room-"
+LIVEKIT_CONNECTION_PREFIX = "livekit:"
+
+LIVEKIT_EVENT_CACHE_KEY = "chat:livekit_event:{}"
+LIVEKIT_LEFT_CACHE_KEY = "chat:livekit_left:{}"
+# Longer than LiveKit keeps retrying a delivery
+LIVEKIT_EVENT_CACHE_TIMEOUT = 60 * 60 * 24
+
+PARTICIPANT_JOINED = "participant_joined"
+PARTICIPANT_LEFT = "participant_left"
+ROOM_FINISHED = "room_finished"
+
+
+class InvalidWebhook(Exception):
+    pass
+
+
+def livekit_room_name(room_id):
+    return f"{LIVEKIT_ROOM_PREFIX}{room_id}"
+
+
+def parse_room_id(name):
+    """Chat room id of a LiveKit room name, None for other rooms."""
+    if not name.startswith(LIVEKIT_ROOM_PREFIX):
+        return None
+    room_id = name[len(LIVEKIT_ROOM_PREFIX):]
+    return int(room_id) if room_id.isdigit() else None
+
+
+def parse_user_id(identity):
+    """User id of a participant, None for egress, agents and the like."""
+    return int(identity) if identity.isdigit() else None
+
+
+def connection_name(participant_sid):
+    return f"{LIVEKIT_CONNECTION_PREFIX}{participant_sid}"
+
+
+def receive_webhook(body, authorization):
+    """
+    Verify the signature of a webhook request and return its event.
+    Raises ``InvalidWebhook`` if it is not signed with our API secret.
+    """
+    if not settings.LIVEKIT_API_KEY or not settings.LIVEKIT_API_SECRET:
+        raise InvalidWebhook("LiveKit API key is not configured")
+    receiver = api.WebhookReceiver(api.TokenVerifier(
+        settings.LIVEKIT_API_KEY,
+        settings.LIVEKIT_API_SECRET
+    ))
+    try:
+        return receiver.receive(body, authorization or "")
+    except Exception as e:
+        raise InvalidWebhook(str(e)) from e
+
+
+def claim_event(event) -> bool:
+    """False if this event id was already applied."""
+    if not event.id:
+        return True
+    return cache.add(
+        LIVEKIT_EVENT_CACHE_KEY.format(event.id),
+        1,
+        LIVEKIT_EVENT_CACHE_TIMEOUT
+    )
+
+
+def apply_event(event, call_state=None) -> bool:
+    """
+    Apply a webhook event to the call state. Returns True if a call
+    started or ended, in which case it should be checkpointed now.
+    """
+    call_state = call_state or get_call_state()
+    room_id = parse_room_id(event.room.name)
+    if room_id is None or not claim_event(event):
+        return False
+    try:
+        return _apply_event(event, room_id, call_state)
+    except Exception:
+        # Let the delivery LiveKit retries apply it
+        cache.delete(LIVEKIT_EVENT_CACHE_KEY.format(event.id))
+        raise
+
+
+def _apply_event(event, room_id, call_state):
+    if event.event == ROOM_FINISHED:
+        return call_state.finish_sync(room_id)
+
+    user_id = parse_user_id(event.participant.identity)
+    if user_id is None or not event.participant.sid:
+        return False
+    connection = connection_name(event.participant.sid)
+    left_key = LIVEKIT_LEFT_CACHE_KEY.format(event.participant.sid)
+
+    if event.event == PARTICIPANT_JOINED:
+        if cache.get(left_key):
+            return False
+        return call_state.join_sync(room_id, user_id, connection)
+    if event.event == PARTICIPANT_LEFT:
+        cache.set(left_key, 1, LIVEKIT_EVENT_CACHE_TIMEOUT)
+        return call_state.leave_sync(room_id, connection)
+    return False
+
+
+def handle_webhook(body, authorization) -> str:
+    """Verify and apply a webhook request. Returns the event name."""
+    event = receive_webhook(body, authorization)
+    call_state = get_call_state()
+    if apply_event(event, call_state) or call_state.checkpoint_inline:
+        checkpoint_calls(call_state)
+    return event.event
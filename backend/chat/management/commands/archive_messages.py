@@ -0,0 +1,54 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat.archive import archive_messages, ARCHIVE_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = (
+        "Move messages older than CHAT_ARCHIVE_AFTER_DAYS, and the messages "
+        "of archived rooms, to the archive table in chunks."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=settings.CHAT_ARCHIVE_AFTER_DAYS,
+            help="Archive messages older than this many days.",
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=ARCHIVE_CHUNK_SIZE,
+            help="Number of messages moved per transaction.",
+        )
+        parser.add_argument(
+            '--max-chunks',
+            type=int,
+            default=None,
+            help="Stop after this many chunks.",
+        )
+        parser.add_argument(
+            '--pause',
+            type=float,
+            default=0,
+            help="Seconds to sleep between two chunks, to spare the database.",
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        for moved in archive_messages(
+            older_than_days=options['days'],
+            chunk_size=options['chunk_size'],
+            max_chunks=options['max_chunks'],
+        ):
+            total += moved
+            self.stdout.write("Archived %s messages" % total)
+            if options['pause']:
+                time.sleep(options['pause'])
+        self.stdout.write(self.style.SUCCESS(
+            "Done, %s messages archived." % total
+        ))
@@ -0,0 +1,112 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from chat.models import Message, Room
+from chat.search import search_messages
+
+WORDS = (
+    "hello family dinner tonight photo birthday grandma trip weekend call "
+    "school garden recipe holiday football doctor tomorrow airport wedding "
+    "movie music coffee train letter garage beach winter summer picnic"
+).split()
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure message search latency, optionally seeding a room of the "
+        "given user with random messages first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            type=int,
+            help="Id of the user searching. Defaults to the first user.",
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help="Number of messages to create before measuring.",
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10000,
+        )
+        parser.add_argument(
+            '--queries',
+            type=int,
+            default=200,
+            help="Number of searches measured.",
+        )
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        user = (
+            User.objects.filter(pk=options['user']).first() if options['user']
+            else User.objects.order_by('pk').first()
+        )
+        if user is None:
+            raise CommandError("No user to search as.")
+
+        if options['seed']:
+            self.seed(user, options['seed'], options['batch_size'])
+
+        # The first page and the one after it, to cover the keyset cursor
+        pages = []
+        for _ in range(options['queries']):
+            query = " ".join(random.sample(WORDS, random.randint(1, 2)))
+            before = None
+            for _ in range(2):
+                started = time.perf_counter()
+                messages, _, has_more = search_messages(
+                    user, query, before=before
+                )
+                pages.append((time.perf_counter() - started) * 1000)
+                if not has_more:
+                    break
+                before = messages[-1].pk
+
+        pages.sort()
+        self.stdout.write(
+            "%s searches over %s messages: p50 %.1f ms, p95 %.1f ms, "
+            "p99 %.1f ms, max %.1f ms per page" % (
+                len(pages),
+                Message.objects.count(),
+                statistics.median(pages),
+                pages[int(len(pages) * 0.95) - 1],
+                pages[int(len(pages) * 0.99) - 1],
+                pages[-1],
+            )
+        )
+
+    def seed(self, user, count, batch_size):
+        room, created = Room.objects.get_or_create(
+            title="Search benchmark",
+            type=Room.TypeChoices.GROUP,
+            defaults={"created_by": user},
+        )
+        if created:
+            room.participants.add(user)
+        created = 0
+        while created < count:
+            size = min(batch_size, count - created)
+            with transaction.atomic():
+                Message.objects.bulk_create([
+                    Message(
+                        room=room,
+                        user=user,
+                        content=" ".join(
+                            random.choices(WORDS, k=random.randint(3, 20))
+                        ),
+                    )
+                    for _ in range(size)
+                ])
+            created += size
+            self.stdout.write("Seeded %s/%s messages" % (created, count))
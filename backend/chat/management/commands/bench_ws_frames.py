@@ -0,0 +1,91 @@
+import json
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from core import encoders
+
+
+def sample_message(index):
+    """A payload shaped like ``MessageSerializer`` output."""
+    now = timezone.now()
+    return {
+        "id": index,
+        "guid": uuid.uuid4(),
+        "room": 1,
+        "user": {
+            "id": 7,
+            "first_name": "Ана",
+            "last_name": "Example",
+            "avatar": "/media/users/avatars/7.webp",
+            "is_online": True,
+            "last_seen": now,
+        },
+        "text": "Hello there, this is message number %s" % index,
+        "reply_to": None,
+        "medias": [],
+        "have_read": [7],
+        "is_edited": False,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure how many WebSocket frames per second the chat fan-out can "
+        "produce with the old per-recipient encoding and with the current "
+        "encode-once path."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--messages',
+            type=int,
+            default=2000,
+            help="Number of messages broadcast per run.",
+        )
+        parser.add_argument(
+            '--recipients',
+            type=int,
+            nargs='+',
+            default=[1, 10, 50, 200],
+            help="Room sizes to measure.",
+        )
+
+    @staticmethod
+    def legacy(payload, recipients):
+        # render -> parse -> dump again for every recipient
+        data = json.loads(JSONRenderer().render(payload).decode())
+        message = {"action": "new_message", "results": data}
+        return [json.dumps(message) for _ in range(recipients)]
+
+    @staticmethod
+    def encode_once(payload, recipients):
+        frame = encoders.dumps_text({"action": "new_message", "results": payload})
+        return [frame] * recipients
+
+    def measure(self, func, payloads, recipients):
+        start = time.perf_counter()
+        for payload in payloads:
+            func(payload, recipients)
+        elapsed = time.perf_counter() - start
+        return len(payloads) * recipients / elapsed
+
+    def handle(self, *args, **options):
+        payloads = [sample_message(i) for i in range(options['messages'])]
+        self.stdout.write("Encoder backend: %s" % encoders.BACKEND)
+        self.stdout.write(
+            "%10s %18s %20s %8s" % ("recipients", "legacy frames/s", "encode-once frames/s", "speedup")
+        )
+        for recipients in options['recipients']:
+            legacy = self.measure(self.legacy, payloads, recipients)
+            current = self.measure(self.encode_once, payloads, recipients)
+            self.stdout.write(
+                "%10d %18.0f %20.0f %7.1fx" % (
+                    recipients, legacy, current, current / legacy
+                )
+            )
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from chat.call_state import (
+    get_call_state, checkpoint_calls, CALL_CHECKPOINT_INTERVAL
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Write the video calls changed since the last checkpoint to "
+        "VideoCall in batches. Runs until interrupted unless --once is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=CALL_CHECKPOINT_INTERVAL,
+            help="Seconds between two checkpoints.",
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help="Checkpoint once and exit.",
+        )
+
+    def handle(self, *args, **options):
+        call_state = get_call_state()
+        while True:
+            close_old_connections()
+            try:
+                checkpoint_calls(call_state)
+            except Exception as e:
+                self.stderr.write("Call checkpoint failed: %s" % e)
+            if options['once']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,83 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+
+from chat.models import Message, RoomMember
+
+
+class Command(BaseCommand):
+    help = (
+        "Collapse the legacy Message.have_read rows into per-(room, user) "
+        "read watermarks and delete them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keep',
+            action='store_true',
+            help="Do not delete the have_read rows after collapsing them.",
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help="Number of watermarks written per statement.",
+        )
+
+    def handle(self, *args, **options):
+        through = Message.have_read.through
+        marks = through.objects.values(
+            'message__room_id', 'user_id'
+        ).annotate(last_read=Max('message_id')).order_by()
+
+        with transaction.atomic():
+            existing = {
+                (room_id, user_id): (pk, last_read_id)
+                for pk, room_id, user_id, last_read_id in
+                RoomMember.objects.values_list(
+                    'pk', 'room_id', 'user_id', 'last_read_message_id'
+                )
+            }
+            to_create, to_update = [], []
+            for mark in marks.iterator():
+                key = (mark['message__room_id'], mark['user_id'])
+                if key not in existing:
+                    to_create.append(
+                        RoomMember(
+                            room_id=key[0],
+                            user_id=key[1],
+                            last_read_message_id=mark['last_read'],
+                        )
+                    )
+                    continue
+                pk, last_read_id = existing[key]
+                if last_read_id is None or last_read_id < mark['last_read']:
+                    to_update.append(
+                        RoomMember(
+                            pk=pk,
+                            last_read_message_id=mark['last_read'],
+                        )
+                    )
+
+            RoomMember.objects.bulk_create(
+                to_create,
+                batch_size=options['batch_size']
+            )
+            RoomMember.objects.bulk_update(
+                to_update,
+                ['last_read_message'],
+                batch_size=options['batch_size']
+            )
+            created, updated = len(to_create), len(to_update)
+
+            if not options['keep']:
+                deleted, _ = through.objects.all().delete()
+            else:
+                deleted = 0
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Watermarks created: {created}, updated: {updated}, "
+                f"have_read rows deleted: {deleted}."
+            )
+        )
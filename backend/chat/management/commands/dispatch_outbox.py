@@ -0,0 +1,95 @@
+import asyncio
+import time
+from datetime import timedelta
+
+from channels.layers import get_channel_layer
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from chat import fanout
+from chat.models import MessageOutbox
+from chat.outbox import dispatch, OutboxPublishError, OUTBOX_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = (
+        "Publish committed message events from the outbox to the channel "
+        "layer. Runs until interrupted unless --once is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=OUTBOX_BATCH_SIZE,
+            help="Number of outbox rows claimed per batch.",
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=0.2,
+            help="Seconds to wait when the outbox is empty.",
+        )
+        parser.add_argument(
+            '--max-backoff',
+            type=float,
+            default=10,
+            help="Longest wait, in seconds, after failed publishes.",
+        )
+        parser.add_argument(
+            '--keep-hours',
+            type=int,
+            default=24,
+            help="Dispatched rows older than this are deleted.",
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help="Drain the outbox once and exit.",
+        )
+
+    def handle(self, *args, **options):
+        channel_layer = get_channel_layer()
+        # One loop for the whole run, so the layer keeps its connections
+        loop = asyncio.new_event_loop()
+
+        def publish(batches):
+            failed = loop.run_until_complete(
+                fanout.send_batches(channel_layer, batches)
+            )
+            if failed:
+                raise OutboxPublishError(
+                    "%s of %s sends failed" % (
+                        len(failed), sum(len(events) for _, events in batches)
+                    )
+                )
+
+        backoff = options['interval']
+        purged_at = 0
+        try:
+            while True:
+                close_old_connections()
+                try:
+                    count = dispatch(publish, options['batch_size'])
+                except OutboxPublishError as e:
+                    self.stderr.write("Outbox publish failed: %s" % e)
+                    backoff = min(backoff * 2, options['max_backoff'])
+                    time.sleep(backoff)
+                    continue
+                backoff = options['interval']
+
+                if time.monotonic() - purged_at > 60:
+                    purged_at = time.monotonic()
+                    MessageOutbox.objects.filter(
+                        dispatched_at__lt=timezone.now() - timedelta(
+                            hours=options['keep_hours']
+                        )
+                    ).delete()
+
+                if count < options['batch_size']:
+                    if options['once']:
+                        break
+                    time.sleep(options['interval'])
+        finally:
+            loop.close()
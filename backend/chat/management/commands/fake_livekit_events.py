@@ -0,0 +1,90 @@
+import json
+import random
+import urllib.error
+import urllib.request
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.models import Room
+from chat.testing import FakeLiveKit
+
+
+class Command(BaseCommand):
+    help = (
+        "Play a LiveKit call in a room by posting signed webhooks to the "
+        "receiver: participants join and leave, some deliveries are repeated "
+        "or out of order, then the room finishes. Development only."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('room', type=int, help="Id of the chat room.")
+        parser.add_argument(
+            '--url',
+            default="http://localhost:8000/api/v1/chat/livekit/webhook/",
+            help="URL of the webhook receiver.",
+        )
+        parser.add_argument(
+            '--keep',
+            action='store_true',
+            help="Do not finish the room at the end.",
+        )
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG:
+            raise CommandError("Forging LiveKit webhooks needs DEBUG.")
+        room = Room.objects.filter(pk=options['room']).first()
+        if room is None:
+            raise CommandError("Room %s does not exist." % options['room'])
+        user_ids = list(room.participants.values_list('pk', flat=True))
+        if not user_ids:
+            raise CommandError("Room %s has no participants." % room.pk)
+
+        livekit = FakeLiveKit(settings.LIVEKIT_API_KEY, settings.LIVEKIT_API_SECRET)
+        sessions = {
+            user_id: "PA_%s_%s" % (room.pk, user_id) for user_id in user_ids
+        }
+        requests = [
+            livekit.participant_joined(room.pk, user_id, sid)
+            for user_id, sid in sessions.items()
+        ]
+        # LiveKit retries deliveries
+        requests.append(random.choice(requests))
+        leaving = random.sample(user_ids, len(user_ids) // 2)
+        for user_id in leaving:
+            left = livekit.participant_left(room.pk, user_id, sessions[user_id])
+            joined = livekit.participant_joined(room.pk, user_id, sessions[user_id])
+            # A late join of a session that already left
+            requests.extend([left, joined])
+        if not options['keep']:
+            requests.append(livekit.room_finished(room.pk))
+
+        for body, authorization in requests:
+            event = json.loads(body)
+            self.stdout.write("%s %s %s" % (
+                self.post(options['url'], body, authorization),
+                event["event"],
+                event.get("participant", {}).get("identity", ""),
+            ))
+        self.stdout.write(
+            "Expected participants: %s" % (
+                [] if not options['keep']
+                else sorted(set(user_ids) - set(leaving))
+            )
+        )
+
+    def post(self, url, body, authorization):
+        request = urllib.request.Request(
+            url,
+            data=body.encode(),
+            headers={
+                "Content-Type": "application/webhook+json",
+                "Authorization": authorization,
+            },
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
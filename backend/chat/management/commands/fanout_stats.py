@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from chat.fanout import collect_metrics, FANOUT_SIZE_BUCKETS
+
+
+class Command(BaseCommand):
+    help = "Show WebSocket fan-out latency by room size, across all processes."
+
+    def handle(self, *args, **options):
+        stats = collect_metrics()
+        if not stats:
+            self.stdout.write("No fan-out recorded yet.")
+            return
+        order = ["<=%s" % bound for bound in FANOUT_SIZE_BUCKETS]
+        order.append(">%s" % FANOUT_SIZE_BUCKETS[-1])
+        self.stdout.write(
+            "%10s %10s %12s %12s" % ("room size", "fan-outs", "avg ms", "max ms")
+        )
+        for bucket in order:
+            if bucket not in stats:
+                continue
+            item = stats[bucket]
+            self.stdout.write(
+                "%10s %10d %12.2f %12.2f" % (
+                    bucket,
+                    item["count"],
+                    item["total_ms"] / item["count"],
+                    item["max_ms"],
+                )
+            )
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from chat.helpers import count_unread, create_missing_room_members
+from chat.models import Room, RoomMember, Message
+
+
+class Command(BaseCommand):
+    help = (
+        "Create missing RoomMember rows for every room participant, "
+        "recompute all unread counters from the read watermarks and the "
+        "last message and activity time of every room."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help="Number of rows written per statement.",
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            created = create_missing_room_members(options['batch_size'])
+            updated = RoomMember.objects.update(
+                unread_count=count_unread(
+                    OuterRef('room_id'),
+                    OuterRef('user_id'),
+                    Coalesce(OuterRef('last_read_message_id'), Value(0)),
+                )
+            )
+            latest = Message.objects.filter(
+                room_id=OuterRef('pk')
+            ).order_by('-created_at', '-id')
+            Room.objects.update(
+                last_message=Subquery(latest.values('pk')[:1]),
+                last_activity_at=Coalesce(
+                    Subquery(latest.values('created_at')[:1]),
+                    F('created_at')
+                ),
+            )
+            RoomMember.objects.update(
+                last_activity_at=Subquery(
+                    Room.objects.filter(
+                        pk=OuterRef('room_id')
+                    ).values('last_activity_at')[:1]
+                )
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Room members created: {created}, "
+                f"unread counters recomputed: {updated}."
+            )
+        )
@@ -1,12 +1,16 @@
 import os
 
 from django.db import models
+from django.utils import timezone
+from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
 from django.contrib.auth import get_user_model
 
 from core.utils import BaseModel, UploadPath
 from core.validators import FileExtensionValidator, ValidateFileSize
 from main.models import Family
+from uploads.models import ProcessedMedia
+from uploads.storage import get_media_storage
 
 
 class Room(BaseModel):
@@ -49,6 +53,8 @@ class Room(BaseModel):
     avatar = models.ImageField(
         verbose_name=_('Avatar'),
         upload_to=UploadPath(folder="pictures", sub_path="avatars"),
+        storage=get_media_storage,
+        db_index=True,
         blank=True,
         null=True
     )
@@ -63,12 +69,25 @@ class Room(BaseModel):
         verbose_name=_('Is Archived'),
         default=False
     )
+    # Maintained by the chat signals when messages are created or deleted
+    last_message = models.ForeignKey(
+        'Message',
+        verbose_name=_("Last Message"),
+        on_delete=models.SET_NULL,
+        related_name="+",
+        blank=True,
+        null=True
+    )
+    last_activity_at = models.DateTimeField(
+        verbose_name=_("Last Activity At"),
+        default=timezone.now
+    )
 
     def __str__(self):
         return self.title if self.title else f'Room {self.id}'
 
     def latest_message(self):
-        return self.messages.order_by('-created_at').first()
+        return self.last_message
 
 
 class VideoCall(BaseModel):
@@ -106,9 +125,10 @@ class VideoCall(BaseModel):
         default=StatusChoices.ONGOING
     )
 
+    # Not auto_now_add: checkpoints write the start time held by the call state
     started_at = models.DateTimeField(
         verbose_name=_("Date Start"),
-        auto_now_add=True
+        default=timezone.now
     )
     ended_at = models.DateTimeField(
         verbose_name=_("Date End"),
@@ -160,6 +180,8 @@ class Message(BaseModel):
         blank=True,
         null=False
     )
+    # Deprecated: read receipts are derived from RoomMember watermarks.
+    # Kept only until `manage.py collapse_read_receipts` has been run.
     have_read = models.ManyToManyField(
         get_user_model(),
         verbose_name=_('Have Read'),
@@ -175,9 +197,11 @@ class Message(BaseModel):
         null=True
     )
 
+    # No db constraint: the replied message may have been archived.
     reply_to = models.ForeignKey(
         'self',
         on_delete=models.SET_NULL,
+        db_constraint=False,
         verbose_name=_("Reply To"),
         null=True,
         blank=True,
@@ -187,23 +211,85 @@ class Message(BaseModel):
     class Meta:
         verbose_name = _("Message")
         verbose_name_plural = _("Messages")
-        ordering = ('-created_at',)
+        ordering = ('-created_at', '-id')
+        indexes = [
+            models.Index(fields=["room", "-created_at", "-id"]),
+        ]
 
     def __str__(self):
         return f'{self.room}: {self.content}'
 
 
-class MessageMedia(BaseModel):
+class RoomMember(BaseModel):
+    """
+    Per-(room, user) state. ``last_read_message`` is a read watermark: every
+    message of the room with an id lower than or equal to it is read.
+    ``unread_count`` is maintained incrementally by the chat signals.
+    """
+    room = models.ForeignKey(
+        Room,
+        verbose_name=_("Room"),
+        on_delete=models.CASCADE,
+        related_name="members_state",
+    )
+    user = models.ForeignKey(
+        get_user_model(),
+        verbose_name=_("User"),
+        on_delete=models.CASCADE,
+        related_name="rooms_state",
+    )
+    # No db constraint: the watermark must survive deletion of the message.
+    last_read_message = models.ForeignKey(
+        Message,
+        verbose_name=_("Last Read Message"),
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name="+",
+        blank=True,
+        null=True,
+    )
+    last_read_at = models.DateTimeField(
+        verbose_name=_("Last Read At"),
+        blank=True,
+        null=True
+    )
+    unread_count = models.PositiveIntegerField(
+        verbose_name=_("Unread Count"),
+        default=0
+    )
+    # Copy of ``Room.last_activity_at`` so a user's inbox is one index scan
+    last_activity_at = models.DateTimeField(
+        verbose_name=_("Last Activity At"),
+        default=timezone.now
+    )
+
+    class Meta:
+        verbose_name = _("Room member")
+        verbose_name_plural = _("Room members")
+        unique_together = ('room', 'user')
+        indexes = [
+            models.Index(fields=["user", "-last_activity_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.user} in {self.room}"
+
+
+class MessageMedia(ProcessedMedia):
+    # No db constraint: medias stay attached to archived messages.
     message = models.ForeignKey(
         Message,
         verbose_name=_("Message"),
         on_delete=models.SET_NULL,
+        db_constraint=False,
         related_name="medias",
         blank=True,
         null=True
     )
     file = models.FileField(
         upload_to=UploadPath(folder="chat", sub_path="media"),
+        storage=get_media_storage,
+        db_index=True,
         validators=[
             FileExtensionValidator(
                 allowed_extensions=[
@@ -313,3 +399,150 @@ class IceServer(BaseModel):
         if self.credential:
             data["credential"] = self.credential
         return data
+
+
+class MessageOutbox(BaseModel):
+    """
+    Message events written in the same transaction as the message and
+    published to the channel layer by the ``dispatch_outbox`` process.
+    The payload is serialized when the event is dispatched.
+    """
+
+    class ActionChoices(models.TextChoices):
+        NEW_MESSAGE = 'new_message', _('New message')
+        EDIT_MESSAGE = 'edit_message', _('Edit message')
+
+    room = models.ForeignKey(
+        Room,
+        verbose_name=_("Room"),
+        on_delete=models.CASCADE,
+        related_name="outbox",
+    )
+    # No db constraint: a message deleted before dispatch is just skipped.
+    message = models.ForeignKey(
+        Message,
+        verbose_name=_("Message"),
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name="+",
+    )
+    action = models.CharField(
+        verbose_name=_("Action"),
+        max_length=20,
+        choices=ActionChoices.choices,
+    )
+    attempts = models.PositiveSmallIntegerField(
+        verbose_name=_("Attempts"),
+        default=0
+    )
+    # Set by the dispatcher publishing the event, so others skip it
+    claimed_until = models.DateTimeField(
+        verbose_name=_("Claimed Until"),
+        blank=True,
+        null=True
+    )
+    dispatched_at = models.DateTimeField(
+        verbose_name=_("Dispatched At"),
+        blank=True,
+        null=True
+    )
+
+    class Meta:
+        verbose_name = _("Message outbox event")
+        verbose_name_plural = _("Message outbox")
+        indexes = [
+            models.Index(fields=["dispatched_at", "id"]),
+        ]
+
+    def __str__(self):
+        return f'{self.action}: {self.message_id}'
+
+
+class ArchivedMessage(BaseModel):
+    """
+    Cold storage for messages moved out of ``Message`` by
+    ``archive_messages``, keeping their ids. Read-only, history pages read
+    through it transparently (see ``chat.helpers.get_history_page``).
+    """
+    id = models.BigIntegerField(primary_key=True)
+    # Copied from the hot row instead of set on insert
+    created_at = models.DateTimeField(verbose_name=_("Date Created"))
+    updated_at = models.DateTimeField(verbose_name=_("Date Updated"))
+    user = models.ForeignKey(
+        get_user_model(),
+        verbose_name=_("User"),
+        related_name="+",
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True
+    )
+    room = models.ForeignKey(
+        Room,
+        verbose_name=_("Room"),
+        on_delete=models.CASCADE,
+        related_name='archived_messages',
+    )
+    content = models.TextField(
+        verbose_name=_('Message content'),
+        blank=True,
+        null=False
+    )
+    is_edited = models.BooleanField(
+        verbose_name=_('Is Edited'),
+        default=False
+    )
+    edited_at = models.DateTimeField(
+        verbose_name=_('Edited At'),
+        blank=True,
+        null=True
+    )
+    # Either a hot or an archived message
+    reply_to_id = models.BigIntegerField(
+        verbose_name=_("Reply To"),
+        blank=True,
+        null=True
+    )
+    archived_at = models.DateTimeField(
+        verbose_name=_("Archived At"),
+        default=timezone.now
+    )
+
+    class Meta:
+        verbose_name = _("Archived message")
+        verbose_name_plural = _("Archived messages")
+        ordering = ('-created_at', '-id')
+        indexes = [
+            models.Index(fields=["room", "-created_at", "-id"]),
+        ]
+
+    def __str__(self):
+        return f'{self.room}: {self.content}'
+
+    @property
+    def medias(self):
+        return MessageMedia.objects.filter(message_id=self.pk)
+
+    @cached_property
+    def reply_to(self):
+        return find_message(self.reply_to_id)
+
+
+def find_message(message_id):
+    """A message by id, from the hot table or else from the archive."""
+    if not message_id:
+        return None
+    return (
+        Message.objects.filter(pk=message_id).first() or
+        ArchivedMessage.objects.filter(pk=message_id).first()
+    )
+
+
+def message_room_ids(message_ids) -> set:
+    """Room ids of messages, from the hot table and from the archive."""
+    return set(
+        Message.objects.filter(pk__in=message_ids).values_list('room_id', flat=True)
+    ) | set(
+        ArchivedMessage.objects.filter(
+            pk__in=message_ids
+        ).values_list('room_id', flat=True)
+    )
\ No newline at end of file
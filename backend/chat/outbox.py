@@ -0,0 +1,159 @@
+"""
+Transactional outbox for message broadcasts.
+
+Saving a message only inserts a ``MessageOutbox`` row in the same
+transaction. The ``dispatch_outbox`` process claims committed rows in
+batches, serializes the messages and publishes the frames. Rows are marked
+as dispatched only once the channel layer accepted every send, so a Redis
+outage delays broadcasts instead of losing them.
+
+Claiming and marking are two short transactions and publishing happens
+between them, so a slow channel layer holds no row lock. A claim expires
+after ``OUTBOX_CLAIM_TIMEOUT``, the rows of a dispatcher that died while
+publishing are then claimed again.
+"""
+import logging
+from datetime import timedelta
+
+from channels.layers import get_channel_layer, InMemoryChannelLayer
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from core.consumers import BaseConsumer
+from chat.v1.serializers import MessageSerializer
+from . import fanout
+from .helpers import get_room_member_ids
+from .models import Message, MessageOutbox, RoomMember
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_CLAIM_TIMEOUT = timedelta(seconds=60)
+
+
+class OutboxPublishError(Exception):
+    pass
+
+
+def build_events(outbox_events):
+    """
+    Channel-layer ``(group, event)`` pairs for a batch of outbox rows, as one
+    ``(room size, events)`` batch per room.
+
+    Members are notified of a new message with their unread count of the
+    room in the notification, members with the same count sharing a frame.
+    """
+    messages = Message.objects.select_related(
+        'user', 'reply_to'
+    ).in_bulk([item.message_id for item in outbox_events])
+    unread_counts = {}
+    for room_id, user_id, unread_count in RoomMember.objects.filter(
+        room_id__in={
+            item.room_id for item in outbox_events
+            if item.action == MessageOutbox.ActionChoices.NEW_MESSAGE
+        }
+    ).values_list('room_id', 'user_id', 'unread_count'):
+        unread_counts.setdefault(room_id, {})[user_id] = unread_count
+    context = {}
+    rooms = {}
+
+    for item in outbox_events:
+        message = messages.get(item.message_id)
+        if message is None:
+            # Deleted before it was dispatched
+            continue
+        member_ids = get_room_member_ids(item.room_id)
+        events = rooms.setdefault(item.room_id, (len(member_ids), []))[1]
+        results = MessageSerializer(message, context=context).data
+        events.append((
+            f"private_chat_{item.room_id}",
+            BaseConsumer.frame_event(
+                'chat_message',
+                {"action": item.action, "results": results}
+            )
+        ))
+        if item.action != MessageOutbox.ActionChoices.NEW_MESSAGE:
+            events += fanout.user_events(
+                member_ids,
+                BaseConsumer.frame_event(
+                    'send_notification',
+                    {"action": item.action, "results": results}
+                )
+            )
+            continue
+        counts = unread_counts.get(item.room_id, {})
+        members = {}
+        for user_id in member_ids:
+            members.setdefault(counts.get(user_id), []).append(user_id)
+        for unread_count, user_ids in members.items():
+            notification = results
+            if unread_count is not None:
+                notification = {**results, "unread_count": unread_count}
+            events += fanout.user_events(
+                user_ids,
+                BaseConsumer.frame_event(
+                    'send_notification',
+                    {"action": item.action, "results": notification}
+                )
+            )
+    return list(rooms.values())
+
+
+def claim(batch_size):
+    """Claim up to ``batch_size`` pending rows for this dispatcher."""
+    now = timezone.now()
+    with transaction.atomic():
+        outbox_events = list(
+            MessageOutbox.objects.select_for_update(
+                skip_locked=True
+            ).filter(
+                Q(claimed_until__isnull=True) | Q(claimed_until__lt=now),
+                dispatched_at__isnull=True,
+            ).order_by('id')[:batch_size]
+        )
+        MessageOutbox.objects.filter(
+            pk__in=[item.pk for item in outbox_events]
+        ).update(
+            attempts=F('attempts') + 1,
+            claimed_until=now + OUTBOX_CLAIM_TIMEOUT
+        )
+    return outbox_events
+
+
+def dispatch(publish, batch_size=OUTBOX_BATCH_SIZE) -> int:
+    """
+    Claim one batch of pending events, publish it with ``publish(batches)``
+    and mark it as dispatched. Several dispatchers may run at once, rows
+    claimed by another one are skipped.
+
+    Returns the number of rows dispatched. Raises ``OutboxPublishError``
+    when publishing failed; the rows stay pending and are retried.
+    """
+    outbox_events = claim(batch_size)
+    if not outbox_events:
+        return 0
+    claimed = MessageOutbox.objects.filter(
+        pk__in=[item.pk for item in outbox_events]
+    )
+    try:
+        publish(build_events(outbox_events))
+    except Exception as e:
+        claimed.update(claimed_until=None)
+        raise OutboxPublishError(e) from e
+    claimed.update(claimed_until=None, dispatched_at=timezone.now())
+    return len(outbox_events)
+
+
+def dispatch_inline():
+    """
+    Publish pending events from the current process. Only used with the
+    in-memory channel layer, which a separate dispatcher cannot reach.
+    """
+    channel_layer = get_channel_layer()
+    if not isinstance(channel_layer, InMemoryChannelLayer):
+        return
+    try:
+        dispatch(lambda batches: fanout.submit_batches(batches, channel_layer))
+    except OutboxPublishError as e:
+        logger.error("Outbox dispatch failed: %s", e)
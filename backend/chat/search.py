@@ -0,0 +1,255 @@
+"""
+Full-text search over ``Message.content``.
+
+The index lives in the database and is kept current by it, so creating,
+editing or deleting a message needs no extra work from the application:
+
+- PostgreSQL: a GIN index on ``to_tsvector(SEARCH_CONFIG, content)``.
+- SQLite: an external-content FTS5 table synchronised by triggers.
+
+Both are created by ``install_search_index`` after every ``migrate``.
+Other databases fall back to an unindexed ``icontains`` scan.
+
+Results are ordered newest first by id and paginated with an id keyset,
+which the FTS5 rowid and the primary key index can both walk backwards
+without sorting every match.
+"""
+import html
+import re
+
+from django.db import connection
+from django.db.models import Func
+from django.db.models.expressions import RawSQL
+
+from .helpers import HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE
+from .models import Message, Room
+
+SEARCH_CONFIG = "simple"
+SEARCH_MAX_QUERY_LENGTH = 256
+SEARCH_SNIPPET_WORDS = 16
+
+# Highlight delimiters used in the database, escaped to <mark> afterwards
+START_SEL = "\x02"
+STOP_SEL = "\x03"
+
+
+class MessageSearch:
+    """Unindexed fallback, also the interface of the indexed backends."""
+
+    def install(self):
+        pass
+
+    def filter(self, queryset, query):
+        for term in query.split():
+            queryset = queryset.filter(content__icontains=term)
+        return queryset
+
+    def snippets(self, message_ids, query):
+        """Content of each message with the matched terms delimited."""
+        pattern = re.compile(
+            "|".join(re.escape(term) for term in query.split()),
+            re.IGNORECASE
+        )
+        contents = Message.objects.filter(
+            pk__in=message_ids
+        ).values_list('pk', 'content')
+        return {
+            pk: pattern.sub(
+                lambda match: START_SEL + match.group(0) + STOP_SEL,
+                content
+            )
+            for pk, content in contents
+        }
+
+
+class PostgresMessageSearch(MessageSearch):
+    # Must stay identical to the indexed expression for the index to apply
+    DOCUMENT = "to_tsvector('" + SEARCH_CONFIG + "'::regconfig, {})"
+
+    def install(self):
+        table = connection.ops.quote_name(Message._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS chat_message_content_search "
+                "ON %s USING gin (%s)" % (table, self.DOCUMENT.format("content"))
+            )
+
+    def filter(self, queryset, query):
+        from django.contrib.postgres.search import SearchQuery, SearchVectorField
+
+        return queryset.annotate(
+            document=Func(
+                'content',
+                template=self.DOCUMENT.format("%(expressions)s"),
+                output_field=SearchVectorField()
+            )
+        ).filter(
+            document=SearchQuery(
+                query, config=SEARCH_CONFIG, search_type="websearch"
+            )
+        )
+
+    def snippets(self, message_ids, query):
+        from django.contrib.postgres.search import SearchHeadline, SearchQuery
+
+        return dict(
+            Message.objects.filter(pk__in=message_ids).annotate(
+                snippet=SearchHeadline(
+                    'content',
+                    SearchQuery(
+                        query, config=SEARCH_CONFIG, search_type="websearch"
+                    ),
+                    config=SEARCH_CONFIG,
+                    start_sel=START_SEL,
+                    stop_sel=STOP_SEL,
+                    max_words=SEARCH_SNIPPET_WORDS,
+                    min_words=SEARCH_SNIPPET_WORDS // 2,
+                )
+            ).values_list('pk', 'snippet')
+        )
+
+
+class SQLiteMessageSearch(MessageSearch):
+    TABLE = "chat_message_fts"
+    TRIGGERS = ("insert", "delete", "update")
+
+    def install(self):
+        table = Message._meta.db_table
+        with connection.cursor() as cursor:
+            # Rebuilding a table in a migration drops its triggers
+            cursor.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' "
+                "AND name IN (%s, %s, %s)",
+                ["%s_%s" % (self.TABLE, name) for name in self.TRIGGERS]
+            )
+            if cursor.fetchone()[0] == len(self.TRIGGERS):
+                return
+            cursor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+                "content, content='{table}', content_rowid='id', "
+                "tokenize='unicode61 remove_diacritics 2')".format(
+                    fts=self.TABLE, table=table
+                )
+            )
+            cursor.execute(
+                "CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} "
+                "BEGIN INSERT INTO {fts}(rowid, content) "
+                "VALUES (new.id, new.content); END".format(
+                    fts=self.TABLE, table=table
+                )
+            )
+            cursor.execute(
+                "CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} "
+                "BEGIN INSERT INTO {fts}({fts}, rowid, content) "
+                "VALUES ('delete', old.id, old.content); END".format(
+                    fts=self.TABLE, table=table
+                )
+            )
+            cursor.execute(
+                "CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF content "
+                "ON {table} BEGIN "
+                "INSERT INTO {fts}({fts}, rowid, content) "
+                "VALUES ('delete', old.id, old.content); "
+                "INSERT INTO {fts}(rowid, content) "
+                "VALUES (new.id, new.content); END".format(
+                    fts=self.TABLE, table=table
+                )
+            )
+            # Index the rows written while the triggers were missing
+            cursor.execute(
+                "INSERT INTO {fts}({fts}) VALUES ('rebuild')".format(
+                    fts=self.TABLE
+                )
+            )
+
+    @staticmethod
+    def match(query):
+        """Every term must match; FTS5 operators in user input are literal."""
+        return " ".join(
+            '"%s"' % term.replace('"', '""') for term in query.split()
+        )
+
+    def filter(self, queryset, query):
+        return queryset.filter(
+            pk__in=RawSQL(
+                "SELECT rowid FROM %s WHERE %s MATCH %%s" % (self.TABLE, self.TABLE),
+                [self.match(query)]
+            )
+        )
+
+    def snippets(self, message_ids, query):
+        if not message_ids:
+            return {}
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT rowid, snippet({fts}, 0, %s, %s, '…', %s) FROM {fts} "
+                "WHERE {fts} MATCH %s AND rowid IN ({ids})".format(
+                    fts=self.TABLE,
+                    ids=", ".join(["%s"] * len(message_ids))
+                ),
+                [
+                    START_SEL,
+                    STOP_SEL,
+                    SEARCH_SNIPPET_WORDS,
+                    self.match(query),
+                    *message_ids
+                ]
+            )
+            return dict(cursor.fetchall())
+
+
+def get_message_search() -> MessageSearch:
+    if connection.vendor == "postgresql":
+        return PostgresMessageSearch()
+    if connection.vendor == "sqlite":
+        return SQLiteMessageSearch()
+    return MessageSearch()
+
+
+def install_search_index():
+    get_message_search().install()
+
+
+def highlight(snippet):
+    """Escape a snippet and turn the delimiters into ``<mark>`` tags."""
+    return html.escape(snippet).replace(
+        START_SEL, "<mark>"
+    ).replace(
+        STOP_SEL, "</mark>"
+    )
+
+
+def search_messages(user, query, room_id=None, before=None, limit=HISTORY_PAGE_SIZE):
+    """
+    Messages matching ``query`` in the rooms ``user`` participates in,
+    newest first. ``before`` is the id of the last message of the previous
+    page.
+
+    Returns ``(messages, highlights, has_more)``; ``highlights`` maps
+    message ids to an HTML-escaped excerpt with ``<mark>``-ed terms.
+    """
+    query = (query or "").strip()[:SEARCH_MAX_QUERY_LENGTH]
+    if not query:
+        return [], {}, False
+    limit = max(1, min(int(limit or HISTORY_PAGE_SIZE), HISTORY_MAX_PAGE_SIZE))
+
+    rooms = Room.participants.through.objects.filter(user_id=user.pk)
+    if room_id is not None:
+        rooms = rooms.filter(room_id=room_id)
+    queryset = Message.objects.filter(room_id__in=rooms.values('room_id'))
+    if before:
+        queryset = queryset.filter(pk__lt=before)
+
+    search = get_message_search()
+    messages = list(
+        search.filter(queryset, query).select_related(
+            'user', 'reply_to'
+        ).order_by('-id')[:limit + 1]
+    )
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    snippets = search.snippets([message.pk for message in messages], query)
+    highlights = {
+        pk: highlight(snippet) for pk, snippet in snippets.items()
+    }
+    return messages, highlights, has_more
@@ -0,0 +1,69 @@
+import asyncio
+
+from core import encoders
+
+# Candidates gathered within this many seconds leave in one frame
+ICE_BATCH_WINDOW = 0.02
+
+
+def peer_group_name(room_id, user_id):
+    """Group of the connections of one user to one call."""
+    return f"video_call_{room_id}_{user_id}"
+
+
+class IceCandidateBatcher:
+    """
+    Collects the trickle-ICE candidates one connection sends and hands them
+    over per target peer, one batch per ``ICE_BATCH_WINDOW``. A candidate
+    already sent to a peer is dropped until ``reset`` is called for it, on
+    a new offer or answer (ICE restart).
+
+    ``publish(to, candidates)`` is awaited for every batch; ``to`` is None
+    for candidates sent without a target.
+    """
+
+    def __init__(self, publish):
+        self.publish = publish
+        self.pending = {}
+        self.seen = {}
+        self.task = None
+
+    @staticmethod
+    def key(candidate):
+        if isinstance(candidate, dict):
+            return (
+                candidate.get("candidate"),
+                candidate.get("sdpMid"),
+                candidate.get("sdpMLineIndex"),
+            )
+        return encoders.dumps(candidate)
+
+    def add(self, to, candidate) -> bool:
+        """Queue a candidate. Returns False if it is a duplicate."""
+        key = self.key(candidate)
+        seen = self.seen.setdefault(to, set())
+        if key in seen:
+            return False
+        seen.add(key)
+        self.pending.setdefault(to, []).append(candidate)
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.run())
+        return True
+
+    def reset(self, to):
+        self.seen.pop(to, None)
+
+    async def run(self):
+        await asyncio.sleep(ICE_BATCH_WINDOW)
+        await self.flush()
+
+    async def flush(self):
+        pending, self.pending = self.pending, {}
+        for to, candidates in pending.items():
+            await self.publish(to, candidates)
+
+    async def close(self):
+        """Send what is still pending and stop."""
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+        await self.flush()
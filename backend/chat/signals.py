@@ -1,15 +1,29 @@
-from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.db.models.signals import (
+    post_save, post_delete, m2m_changed, post_migrate
+)
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
 from django.db import transaction
-from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
 
 from main.models import Family, FamilyMembers
 
-from .models import Room, Message, VideoCall
-from chat.v1.serializers import MessageSerializer, RoomSerializer
+from .models import (
+    Room, Message, VideoCall, RoomMember, MessageOutbox, IceServer
+)
+from chat.v1.serializers import RoomSerializer
 from .consumers import ChatConsumer
+from .helpers import (
+    record_new_message,
+    record_deleted_message,
+    invalidate_room_members,
+    get_room_member_ids,
+    create_missing_room_members,
+)
+from . import fanout
+from .outbox import dispatch_inline
+from .search import install_search_index
+from .ice_servers import invalidate_ice_servers
 
 
 @receiver(post_save, sender=Family)
@@ -59,49 +73,106 @@ def delete_family_member(sender, instance, **kwargs):
         pass  # Handle case where family member doesn't exist
 
 
-def send_layer_signal(channel_layer, channel_name, action, serializer):
-    message = {"action": action, "data": serializer}
-    async_to_sync(channel_layer.group_send)(
-        channel_name,
-        {'type': 'broadcast_message', 'message': message}
-    )
-    async_to_sync(channel_layer.group_send)(
-        channel_name,
-        {'type': 'send_notification', 'message': message}
-    )
-    return True
+@receiver(m2m_changed, sender=Room.participants.through)
+def sync_room_members(sender, instance, action, reverse, pk_set, **kwargs):
+    """Keep one RoomMember row per (room, participant)."""
+    if action == 'post_add':
+        pairs = [
+            (pk, instance.pk) if reverse else (instance.pk, pk)
+            for pk in pk_set
+        ]
+        activity = dict(
+            Room.objects.filter(
+                pk__in={room for room, _ in pairs}
+            ).values_list('pk', 'last_activity_at')
+        )
+        RoomMember.objects.bulk_create(
+            [
+                RoomMember(
+                    room_id=room,
+                    user_id=user,
+                    last_activity_at=activity.get(room)
+                )
+                for room, user in pairs
+            ],
+            ignore_conflicts=True
+        )
+    elif action == 'post_remove':
+        if reverse:
+            RoomMember.objects.filter(
+                user=instance,
+                room_id__in=pk_set
+            ).delete()
+        else:
+            RoomMember.objects.filter(
+                room=instance,
+                user_id__in=pk_set
+            ).delete()
+    elif action == 'post_clear':
+        if reverse:
+            RoomMember.objects.filter(user=instance).delete()
+        else:
+            RoomMember.objects.filter(room=instance).delete()
+
+
+@receiver(m2m_changed, sender=Room.participants.through)
+def invalidate_room_membership(sender, instance, action, reverse, pk_set, **kwargs):
+    """Drop the cached member ids of every room whose participants changed."""
+    if action not in ('post_add', 'post_remove', 'pre_clear', 'post_clear'):
+        return
+    if not reverse:
+        invalidate_room_members([instance.pk])
+    elif action == 'pre_clear':
+        # The rooms are gone by post_clear, remember them for it
+        instance._cleared_room_ids = list(
+            instance.participants.values_list('pk', flat=True)
+        )
+    elif action == 'post_clear':
+        invalidate_room_members(getattr(instance, '_cleared_room_ids', []))
+    else:
+        invalidate_room_members(pk_set)
+
+
+@receiver(m2m_changed, sender=Family.members.through)
+def invalidate_family_room_membership(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        rooms = Room.objects.filter(family_id__in=pk_set or [])
+    else:
+        rooms = Room.objects.filter(family=instance)
+    invalidate_room_members(rooms.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Room)
+def invalidate_deleted_room_membership(sender, instance, **kwargs):
+    invalidate_room_members([instance.pk])
 
 
 @receiver(post_save, sender=Message)
 def notify_new_message(sender, instance, created, **kwargs):
-    serializer = ChatConsumer.get_serializer_data_to_dict(
-        None,
-        MessageSerializer(instance)
-    )
+    """
+    Queue the broadcast in the outbox, within the transaction of the save.
+    The dispatcher serializes and publishes it once committed.
+    """
     if created:
-        action = "new_message"
-        channel_layer = get_channel_layer()
-        channel_name = f"private_chat_{instance.room.id}"
-        transaction.on_commit(
-            lambda: send_layer_signal(
-                channel_layer,
-                channel_name,
-                action,
-                serializer
-            )
-        )
-    else:
-        action = "edit_message"
-        channel_layer = get_channel_layer()
-        channel_name = f"private_chat_{instance.room.id}"
-        transaction.on_commit(
-            lambda: send_layer_signal(
-                channel_layer,
-                channel_name,
-                action,
-                serializer
-            )
-        )
+        record_new_message(instance)
+    MessageOutbox.objects.create(
+        room_id=instance.room_id,
+        message=instance,
+        action=(
+            MessageOutbox.ActionChoices.NEW_MESSAGE if created
+            else MessageOutbox.ActionChoices.EDIT_MESSAGE
+        ),
+    )
+    transaction.on_commit(dispatch_inline)
+
+
+@receiver(post_delete, sender=Message)
+def update_unread_on_delete(sender, instance, origin=None, **kwargs):
+    # Cascades (e.g. a deleted room) take the counters with them.
+    if isinstance(origin, Message) or getattr(origin, 'model', None) is Message:
+        record_deleted_message(instance)
 
 
 @receiver(post_save, sender=VideoCall)
@@ -115,7 +186,8 @@ def notify_video_call_participants(
     Notify all participants in the chat room when a video call starts or ends.
     """
     room = instance.room
-    participants = room.participants.exclude(id=instance.creator.id)
+    member_ids = get_room_member_ids(room.id)
+    participants = member_ids - {instance.creator_id}
     action = "video_call_started" if instance.status == VideoCall.StatusChoices.ONGOING else "video_call_ended"
 
     serializer = RoomSerializer(
@@ -124,22 +196,43 @@ def notify_video_call_participants(
     ).data
 
     channel_layer = get_channel_layer()
-
-    for user in participants:
-        # send notification to each user's personal channel
-        async_to_sync(channel_layer.group_send)(
-            f"user_{user.id}",
-            {
-                "type": "send_notification",
-                "message": {
-                    "action": action,
-                    "results": {
-                        "room": serializer,
-                        "call_id": instance.id,
-                        "status": instance.status,
-                        "creator": instance.creator.get_full_name,
-                        "creator_id": instance.creator.id,
-                    },
-                },
-            }
+    event = ChatConsumer.frame_event(
+        "send_notification",
+        {
+            "action": action,
+            "results": {
+                "room": serializer,
+                "call_id": instance.id,
+                "status": instance.status,
+                "creator": instance.creator.get_full_name,
+                "creator_id": instance.creator.id,
+            },
+        }
+    )
+    # send notification to each user's personal channel, once committed
+    transaction.on_commit(
+        lambda: fanout.submit(
+            fanout.user_events(participants, event),
+            channel_layer,
+            room_size=len(member_ids)
         )
+    )
+
+
+@receiver(post_migrate)
+def create_search_index(sender, **kwargs):
+    if sender.name == 'chat':
+        install_search_index()
+
+
+@receiver(post_migrate)
+def backfill_room_members(sender, **kwargs):
+    # Rooms older than RoomMember would be missing from the room list
+    if sender.name == 'chat':
+        create_missing_room_members()
+
+
+@receiver(post_save, sender=IceServer)
+@receiver(post_delete, sender=IceServer)
+def invalidate_ice_server_registry(sender, **kwargs):
+    invalidate_ice_servers()
@@ -0,0 +1,76 @@
+"""
+Test support for the LiveKit webhook receiver. Not imported by the
+application: the fake signs webhooks with whatever key it is given.
+"""
+import base64
+import hashlib
+import time
+import uuid
+
+from google.protobuf.json_format import MessageToJson
+from livekit import api
+from livekit.protocol import models as livekit_models
+
+from .livekit import (
+    PARTICIPANT_JOINED, PARTICIPANT_LEFT, ROOM_FINISHED, livekit_room_name,
+)
+
+
+class FakeLiveKit:
+    """
+    Builds signed webhook requests the way a LiveKit server sends them, to
+    exercise the receiver without one. Every method returns
+    ``(body, authorization)``.
+    """
+
+    def __init__(self, api_key, api_secret):
+        self.api_key = api_key
+        self.api_secret = api_secret
+
+    def sign(self, body):
+        token = api.AccessToken(self.api_key, self.api_secret)
+        token.with_sha256(base64.b64encode(
+            hashlib.sha256(body.encode()).digest()
+        ).decode())
+        return token.to_jwt()
+
+    def event(self, name, room_id, participant=None, event_id=None):
+        event = api.WebhookEvent(
+            event=name,
+            id=event_id or f"EV_{uuid.uuid4().hex[:12]}",
+            created_at=int(time.time()),
+            room=livekit_models.Room(
+                sid=f"RM_{room_id}",
+                name=livekit_room_name(room_id),
+            ),
+        )
+        if participant is not None:
+            event.participant.CopyFrom(participant)
+        body = MessageToJson(event)
+        return body, self.sign(body)
+
+    @staticmethod
+    def participant(user_id, sid=None):
+        return livekit_models.ParticipantInfo(
+            sid=sid or f"PA_{uuid.uuid4().hex[:12]}",
+            identity=str(user_id),
+        )
+
+    def participant_joined(self, room_id, user_id, sid, event_id=None):
+        return self.event(
+            PARTICIPANT_JOINED,
+            room_id,
+            self.participant(user_id, sid),
+            event_id
+        )
+
+    def participant_left(self, room_id, user_id, sid, event_id=None):
+        return self.event(
+            PARTICIPANT_LEFT,
+            room_id,
+            self.participant(user_id, sid),
+            event_id
+        )
+
+    def room_finished(self, room_id, event_id=None):
+        return self.event(ROOM_FINISHED, room_id, event_id=event_id)
@@ -0,0 +1,273 @@
+"""
+Typing indicators of the chat rooms.
+
+The typers of a room are held next to the channel layer, each with an
+expiry that repeated ``typing`` frames push back. ``TypingAggregator``
+publishes them to the room as a single ``typing_state`` snapshot, at most
+once every ``TYPING_FLUSH_INTERVAL`` and only when the set of typers
+changed, so a keystroke burst costs nothing on the channel layer.
+
+``RedisTypingState`` keeps the typers in the channel-layer Redis, so every
+worker process publishes the same snapshot of a room and a snapshot is
+published once, whichever process saw the change. ``MemoryTypingState`` is
+the single-process stand-in used with ``DEBUG``.
+"""
+import asyncio
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from core.consumers import BaseConsumer
+
+# Snapshots of a room are published at most once per interval
+TYPING_FLUSH_INTERVAL = 0.3
+# A typer that did not refresh its state for this long is dropped
+TYPING_TIMEOUT = 5
+
+_aggregators = {}
+
+
+class BaseTypingState(ABC):
+    @abstractmethod
+    async def typing(self, room_id, user_id, name):
+        """Register a typer, or push back its expiry."""
+
+    @abstractmethod
+    async def stop(self, room_id, user_id) -> bool:
+        """Drop a typer. Returns True if it was typing."""
+
+    @abstractmethod
+    async def take_snapshot(self, room_id):
+        """
+        Drop the expired typers of a room and return the others as sorted
+        ``(user_id, name)`` pairs, or None if they are the ones of the last
+        snapshot taken.
+        """
+
+
+class MemoryTypingState(BaseTypingState):
+    def __init__(self, options=None):
+        self.lock = threading.Lock()
+        self.typers = {}
+        self.published = {}
+
+    async def typing(self, room_id, user_id, name):
+        with self.lock:
+            self.typers.setdefault(room_id, {})[user_id] = (
+                name, time.time() + TYPING_TIMEOUT
+            )
+
+    async def stop(self, room_id, user_id) -> bool:
+        with self.lock:
+            return self.typers.get(room_id, {}).pop(user_id, None) is not None
+
+    async def take_snapshot(self, room_id):
+        now = time.time()
+        with self.lock:
+            typers = {
+                user_id: (name, expires_at)
+                for user_id, (name, expires_at)
+                in self.typers.pop(room_id, {}).items()
+                if expires_at > now
+            }
+            if typers:
+                self.typers[room_id] = typers
+            snapshot = tuple(sorted(
+                (user_id, name) for user_id, (name, _) in typers.items()
+            ))
+            if snapshot == self.published.get(room_id, ()):
+                return None
+            if snapshot:
+                self.published[room_id] = snapshot
+            else:
+                self.published.pop(room_id, None)
+            return snapshot
+
+
+class RedisTypingState(BaseTypingState):
+    """
+    Keys:
+
+    - ``typing:<room id>``: hash of user id to ``"<expiry>|<name>"``, one
+      field per typer.
+    - ``typing:<room id>:published``: the last snapshot taken, encoded.
+
+    Both expire with the last typer, so an idle room leaves nothing behind.
+    """
+    PREFIX = "typing:"
+
+    # ARGV: now, ttl
+    TAKE_SNAPSHOT = """
+    local now = tonumber(ARGV[1])
+    local entries = redis.call('HGETALL', KEYS[1])
+    local typers = {}
+    for index = 1, #entries, 2 do
+        local value = entries[index + 1]
+        local separator = string.find(value, '|', 1, true)
+        if tonumber(string.sub(value, 1, separator - 1)) <= now then
+            redis.call('HDEL', KEYS[1], entries[index])
+        else
+            table.insert(typers, {tonumber(entries[index]), string.sub(value, separator + 1)})
+        end
+    end
+    table.sort(typers, function(a, b) return a[1] < b[1] end)
+    -- Led by the number of typers, an empty table would read as nil
+    local result = {#typers}
+    local encoded = ''
+    for _, typer in ipairs(typers) do
+        table.insert(result, typer[1])
+        table.insert(result, typer[2])
+        encoded = encoded .. typer[1] .. '|' .. typer[2] .. '\\n'
+    end
+    if encoded == (redis.call('GET', KEYS[2]) or '') then
+        return false
+    end
+    if encoded == '' then
+        redis.call('DEL', KEYS[2])
+    else
+        redis.call('SET', KEYS[2], encoded, 'EX', ARGV[2])
+    end
+    return result
+    """
+
+    def __init__(self, options=None):
+        import redis.asyncio
+
+        location = (options or {}).get("LOCATION", "redis://localhost:6379")
+        self.client = redis.asyncio.Redis.from_url(location)
+        self.snapshot_script = self.client.register_script(self.TAKE_SNAPSHOT)
+
+    def typers_key(self, room_id):
+        return f"{self.PREFIX}{room_id}"
+
+    async def typing(self, room_id, user_id, name):
+        key = self.typers_key(room_id)
+        async with self.client.pipeline(transaction=True) as pipeline:
+            pipeline.hset(key, user_id, f"{time.time() + TYPING_TIMEOUT}|{name}")
+            pipeline.expire(key, TYPING_TIMEOUT * 2)
+            await pipeline.execute()
+
+    async def stop(self, room_id, user_id) -> bool:
+        return bool(await self.client.hdel(self.typers_key(room_id), user_id))
+
+    async def take_snapshot(self, room_id):
+        key = self.typers_key(room_id)
+        flat = await self.snapshot_script(
+            keys=[key, f"{key}:published"],
+            args=[time.time(), TYPING_TIMEOUT * 2],
+        )
+        if flat is None:
+            return None
+        return tuple(
+            (int(user_id), name.decode())
+            for user_id, name in zip(flat[1::2], flat[2::2])
+        )
+
+
+_typing_state = None
+_typing_state_lock = threading.Lock()
+
+
+def get_typing_state() -> BaseTypingState:
+    global _typing_state
+    with _typing_state_lock:
+        if _typing_state is None:
+            options = getattr(settings, "TYPING_STATE", {})
+            backend = import_string(
+                options.get("BACKEND", "chat.typing_state.MemoryTypingState")
+            )
+            _typing_state = backend(options)
+        return _typing_state
+
+
+class TypingAggregator:
+    """
+    Publishes the typing snapshots of one room from this process, while
+    users of its connections are typing. Every process with typers in the
+    room polls the shared state, the first to see a change publishes it.
+    """
+
+    def __init__(self, channel_layer, room_id, state):
+        self.channel_layer = channel_layer
+        self.room_id = room_id
+        self.group_name = f"private_chat_{room_id}"
+        self.state = state
+        # Typers of this process, kept until the snapshot of their expiry
+        self.typers = {}
+        self.task = None
+
+    async def typing(self, user_id, name):
+        self.typers[user_id] = (
+            time.monotonic() + TYPING_TIMEOUT + TYPING_FLUSH_INTERVAL
+        )
+        await self.state.typing(self.room_id, user_id, name)
+        self.schedule()
+
+    async def stop(self, user_id):
+        self.typers.pop(user_id, None)
+        if await self.state.stop(self.room_id, user_id):
+            self.schedule()
+
+    def schedule(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(TYPING_FLUSH_INTERVAL)
+            snapshot = await self.state.take_snapshot(self.room_id)
+            if snapshot is not None:
+                await self.publish(snapshot)
+            now = time.monotonic()
+            self.typers = {
+                user_id: expires_at
+                for user_id, expires_at in self.typers.items()
+                if expires_at > now
+            }
+            if not self.typers:
+                break
+        if _aggregators.get(self.room_id) is self:
+            del _aggregators[self.room_id]
+
+    async def publish(self, snapshot):
+        await self.channel_layer.group_send(
+            self.group_name,
+            BaseConsumer.frame_event(
+                'chat_message',
+                {
+                    "action": "typing_state",
+                    "results": {
+                        "room": self.room_id,
+                        "users": [
+                            {"id": user_id, "name": name}
+                            for user_id, name in snapshot
+                        ],
+                    },
+                }
+            )
+        )
+
+
+def get_typing_aggregator(channel_layer, room_id) -> TypingAggregator:
+    room_id = int(room_id)
+    aggregator = _aggregators.get(room_id)
+    if aggregator is None:
+        aggregator = _aggregators[room_id] = TypingAggregator(
+            channel_layer,
+            room_id,
+            get_typing_state()
+        )
+    return aggregator
+
+
+async def forget_typer(room_id, user_id):
+    """Drop a user from the typers of a room, e.g. when their socket closes."""
+    try:
+        aggregator = _aggregators.get(int(room_id))
+    except (TypeError, ValueError):
+        return
+    if aggregator is not None:
+        await aggregator.stop(user_id)
@@ -4,18 +4,23 @@ from django.contrib.auth import get_user_model
 
 from main.v1.serializers import FamilySerializer
 from accounts.v1.serializers import PublicUserSerializer
+from uploads.v1.serializers import MediaVariantsField
 
-from chat.models import Room, Message, MessageMedia, VideoCall
+from chat.models import (
+    Room, Message, MessageMedia, VideoCall, RoomMember, find_message
+)
 
 User = get_user_model()
 
 
 class MessageMediaSerializer(serializers.ModelSerializer):
     ext = serializers.SerializerMethodField(read_only=True)
+    variants = MediaVariantsField()
 
     class Meta:
         model = MessageMedia
-        fields = ['file', 'size', 'ext']
+        fields = ['file', 'size', 'ext', 'width', 'height', 'placeholder',
+                  'variants']
 
     def get_ext(self, obj):
         return obj.get_extension()
@@ -40,6 +45,7 @@ class RoomSerializer(serializers.ModelSerializer):
     family = FamilySerializer(read_only=True)
     participants = PublicUserSerializer(many=True, read_only=True)
     video_call = VideoCallSerializer(read_only=True)
+    unread_count = serializers.SerializerMethodField()
 
     class Meta:
         model = Room
@@ -57,9 +63,16 @@ class RoomSerializer(serializers.ModelSerializer):
             'created_at',
             'updated_at',
             'last_message',
+            'last_activity_at',
             'video_call',
+            'unread_count',
         ]
 
+    @extend_schema_field(serializers.IntegerField(allow_null=True))
+    def get_unread_count(self, obj: Room):
+        # Only present when the queryset was built with `with_unread_count`
+        return getattr(obj, 'unread_count', None)
+
     def get_last_message(self, obj: Room):
         return MessageSerializer(
             obj.latest_message(),
@@ -84,11 +97,31 @@ class MessageSerializer(serializers.ModelSerializer):
     user = PublicUserSerializer(read_only=True)
     reply_to = serializers.SerializerMethodField(read_only=True)
     medias = serializers.SerializerMethodField(read_only=True)
+    have_read = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = Message
         fields = '__all__'
 
+    @extend_schema_field(
+        serializers.ListField(child=serializers.IntegerField())
+    )
+    def get_have_read(self, obj):
+        # Watermarks are loaded once per room and shared through the context,
+        # so a page of messages costs a single query.
+        watermarks = self.context.setdefault('read_watermarks', {})
+        if obj.room_id not in watermarks:
+            watermarks[obj.room_id] = list(
+                RoomMember.objects.filter(
+                    room_id=obj.room_id,
+                    last_read_message__isnull=False
+                ).values_list('user_id', 'last_read_message_id')
+            )
+        return [
+            user_id for user_id, last_read_id in watermarks[obj.room_id]
+            if last_read_id >= obj.id
+        ]
+
     @extend_schema_field(
         serializers.ListSerializer(child=MessageMediaSerializer())
     )
@@ -103,15 +136,46 @@ class MessageSerializer(serializers.ModelSerializer):
 
     @extend_schema_field(MessageReplySerializer())
     def get_reply_to(self, obj):
-        if obj.reply_to:
+        if not obj.reply_to_id:
+            return None
+        try:
+            reply_to = obj.reply_to
+        except Message.DoesNotExist:
+            reply_to = None
+        # The replied message may have been moved to the archive
+        reply_to = reply_to or find_message(obj.reply_to_id)
+        if reply_to:
             # Prevent full recursive nesting by using a smaller serializer or limiting depth
             return MessageSerializer(
-                obj.reply_to,
+                reply_to,
                 context=self.context
             ).data
         return None
 
 
+class MessageSearchResultSerializer(MessageSerializer):
+    highlight = serializers.SerializerMethodField(read_only=True)
+
+    def get_highlight(self, obj) -> str:
+        # HTML-escaped excerpt with the matched terms wrapped in <mark>
+        return self.context.get('highlights', {}).get(obj.pk)
+
+
+class MessageSearchQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=256)
+    room = serializers.IntegerField(required=False)
+    before = serializers.IntegerField(required=False)
+    limit = serializers.IntegerField(required=False, min_value=1, max_value=100)
+
+
+class MessageSearchResponseSerializer(serializers.Serializer):
+    results = MessageSearchResultSerializer(many=True)
+    next = serializers.IntegerField(
+        allow_null=True,
+        help_text="Pass as `before` to get the next page"
+    )
+
+
 class MessageCreateSerializer(serializers.ModelSerializer):
     media = serializers.ListField(
         child=serializers.ImageField(),
@@ -128,6 +192,8 @@ class MessageMediaCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = MessageMedia
         fields = "__all__"
+        read_only_fields = ['width', 'height', 'placeholder', 'variants',
+                            'processed_at']
 
 
 class LiveKitTokenRequestSerializer(serializers.Serializer):
@@ -1,8 +1,9 @@
 from django.urls import path
 
 from .views import (
-    MessageView, LiveKitTokenView, GroupCreateView,
-    GroupUpdateView, GroupAddParticipantsView, GroupRemoveParticipantsView,
+    MessageView, MessageSearchView, LiveKitTokenView, LiveKitWebhookView,
+    GroupCreateView, GroupUpdateView, GroupAddParticipantsView,
+    GroupRemoveParticipantsView,
     GroupLeaveView, GroupTransferOwnershipView, GroupDeleteView,
 )
 
@@ -10,6 +11,7 @@ app_name = 'v1-chat'
 
 urlpatterns = [
     path('', MessageView.as_view(), name='message_view'),
+    path('search/', MessageSearchView.as_view(), name='message_search'),
     path('groups/', GroupCreateView.as_view(), name='group_create'),
     path("groups/<int:group_id>/", GroupUpdateView.as_view()),
     path("groups/<int:group_id>/participants/add/", GroupAddParticipantsView.as_view()),
@@ -22,4 +24,9 @@ urlpatterns = [
         LiveKitTokenView.as_view(),
         name='livekit_token_view'
     ),
+    path(
+        'livekit/webhook/',
+        LiveKitWebhookView.as_view(),
+        name='livekit_webhook_view'
+    ),
 ]
@@ -2,7 +2,7 @@ from datetime import timedelta
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.request import Request
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework import status
 from drf_spectacular.utils import (
     extend_schema, OpenApiResponse,OpenApiExample
@@ -20,14 +20,23 @@ from .serializers import (
     GroupCreateSerializer,
     RoomSerializer, GroupUpdateSerializer, AddParticipantsSerializer,
     RemoveParticipantsSerializer, TransferOwnershipSerializer,
+    MessageSearchQuerySerializer, MessageSearchResponseSerializer,
+    MessageSearchResultSerializer,
 )
-from chat.models import Room, IceServer
+from chat.models import MessageMedia, Room
+from chat.helpers import is_room_member
+from chat.search import search_messages
+from chat.livekit import handle_webhook, InvalidWebhook, livekit_room_name
+from chat.ice_servers import get_ice_servers
+from uploads.handlers import StreamingUploadMixin
+from uploads.helpers import attach_message_uploads
 
 
 @extend_schema(tags=["Chat"])
-class MessageView(APIView):
+class MessageView(StreamingUploadMixin, APIView):
     permission_classes = [IsAuthenticated]
     serializer_class = MessageSerializer
+    upload_fields = {"media": MessageMedia._meta.get_field("file")}
 
     @extend_schema(
         request=MessageCreateSerializer,
@@ -41,7 +50,11 @@ class MessageView(APIView):
             ),
         },
         summary="Send a new chat message",
-        description="Creates a message and optionally attaches media files (as multipart).",
+        description=(
+            "Creates a message and optionally attaches media files (as "
+            "multipart `media`) or completed resumable uploads (`uploads`, "
+            "a list of upload ids)."
+        ),
         methods=["POST"],
     )
     @transaction.atomic
@@ -75,6 +88,20 @@ class MessageView(APIView):
                             status=status.HTTP_400_BAD_REQUEST
                         )
 
+                upload_ids = (
+                    request.data.getlist('uploads')
+                    if hasattr(request.data, 'getlist')
+                    else request.data.get('uploads') or []
+                )
+                try:
+                    attach_message_uploads(user, upload_ids, obj)
+                except ValueError as e:
+                    transaction.set_rollback(True)
+                    return Response(
+                        {"uploads": [str(e)]},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+
                 return Response(
                     {"message": "success",
                      "result": MessageSerializer(
@@ -96,6 +123,46 @@ class MessageView(APIView):
             )
 
 
+@extend_schema(tags=["Chat"])
+class MessageSearchView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        parameters=[MessageSearchQuerySerializer],
+        responses={
+            200: MessageSearchResponseSerializer,
+            400: OpenApiResponse(description="Missing or invalid query."),
+        },
+        summary="Search messages",
+        description=(
+            "Full-text search over the messages of the rooms the user "
+            "participates in, newest first. Pass `next` back as `before` "
+            "to get the following page."
+        ),
+    )
+    def get(self, request, format=None):
+        params = MessageSearchQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        messages, highlights, has_more = search_messages(
+            request.user,
+            params.validated_data['q'],
+            room_id=params.validated_data.get('room'),
+            before=params.validated_data.get('before'),
+            limit=params.validated_data.get('limit'),
+        )
+        return Response(
+            {
+                "results": MessageSearchResultSerializer(
+                    messages,
+                    many=True,
+                    context={"request": request, "highlights": highlights}
+                ).data,
+                "next": messages[-1].pk if has_more else None,
+            },
+            status=status.HTTP_200_OK
+        )
+
+
 @extend_schema(tags=["Chat"])
 class LiveKitTokenView(APIView):
     """
@@ -127,33 +194,30 @@ class LiveKitTokenView(APIView):
             )
 
         try:
-            # Ensure the room exists
-            room, created = Room.objects.get_or_create(id=room_id)
-
-            if not user in room.participants.all():
+            if not is_room_member(room_id, user.id):
                 return Response(
                     {
                         "detail": "You are not authorized to join this room.",
                     },
                     status=status.HTTP_401_UNAUTHORIZED
                 )
+            room = Room.objects.get(id=room_id)
 
             # Generate LiveKit access token
             token = api.AccessToken(
                 settings.LIVEKIT_API_KEY,
                 settings.LIVEKIT_API_SECRET
             )
-            token.with_identity(user.get_full_name)
+            # Webhooks map the identity and the room back to ids
+            token.with_identity(str(user.id))
+            token.with_name(user.get_full_name)
             token.with_grants(
-                api.VideoGrants(room_join=True, room=room.title)
+                api.VideoGrants(room_join=True, room=livekit_room_name(room.id))
             )
             token.with_ttl(ttl=timedelta(hours=1))
             jwt = token.to_jwt()
 
-            ice_servers_qs = IceServer.objects.filter(
-                is_active=True
-            ).order_by("priority")
-            ice_servers = [server.as_dict() for server in ice_servers_qs]
+            ice_servers = get_ice_servers(request)
 
             return Response(
                 {
@@ -173,6 +237,29 @@ class LiveKitTokenView(APIView):
             )
 
 
+@extend_schema(exclude=True)
+class LiveKitWebhookView(APIView):
+    """
+    Receive LiveKit webhooks and apply participant and room events to the
+    video calls. Requests must be signed with the LiveKit API secret.
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def post(self, request, format=None):
+        try:
+            event = handle_webhook(
+                request.body.decode(),
+                request.headers.get("Authorization")
+            )
+        except InvalidWebhook:
+            return Response(
+                {"detail": "Invalid webhook signature"},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+        return Response({"event": event}, status=status.HTTP_200_OK)
+
+
 
 
 @extend_schema(
@@ -294,8 +381,10 @@ class GroupCreateView(APIView):
         ),
     ],
 )
-class GroupUpdateView(APIView):
+class GroupUpdateView(StreamingUploadMixin, APIView):
     permission_classes = [IsAuthenticated]
+    upload_fields = {"avatar": Room._meta.get_field("avatar")}
+    upload_max_files = 1
 
     def patch(self, request, group_id):
         try:
@@ -343,7 +432,7 @@ class GroupAddParticipantsView(APIView):
         except Room.DoesNotExist:
             return Response({"detail": "Group not found."}, status=404)
 
-        if request.user not in room.participants.all():
+        if not is_room_member(room.id, request.user.id):
             return Response({"detail": "Not authorized."}, status=403)
 
         serializer = AddParticipantsSerializer(data=request.data)
@@ -382,7 +471,7 @@ class GroupRemoveParticipantsView(APIView):
         except Room.DoesNotExist:
             return Response({"detail": "Group not found."}, status=404)
 
-        if request.user not in room.participants.all():
+        if not is_room_member(room.id, request.user.id):
             return Response({"detail": "Not authorized."}, status=403)
 
         serializer = RemoveParticipantsSerializer(
@@ -423,7 +512,7 @@ class GroupLeaveView(APIView):
 
         user = request.user
 
-        if user not in room.participants.all():
+        if not is_room_member(room.id, user.id):
             return Response({"detail": "You are not a member of this group."}, status=403)
 
         # Creator cannot leave without transferring ownership
@@ -0,0 +1,77 @@
+from channels.generic.websocket import AsyncWebsocketConsumer
+
+from core import encoders
+
+
+class BaseConsumer(AsyncWebsocketConsumer):
+    """
+    WebSocket consumer that encodes each outgoing frame exactly once.
+
+    Group events built with ``frame_event`` carry the JSON frame under
+    ``text``, so every recipient forwards the same frame instead of encoding
+    the payload again.
+
+    JSON text frames are the default. Clients may negotiate the ``msgpack``
+    subprotocol to send and receive binary MessagePack frames instead; their
+    consumers pack group events themselves, so the other recipients do not
+    pay for it.
+    """
+    JSON = "json"
+    MSGPACK = "msgpack"
+    SUBPROTOCOLS = (MSGPACK, JSON)
+
+    codec = JSON
+
+    @classmethod
+    def decode_json(cls, text_data):
+        return encoders.loads(text_data)
+
+    @classmethod
+    def encode_json(cls, content):
+        return encoders.dumps_text(content)
+
+    @classmethod
+    def frame_event(cls, handler, message):
+        """Build a channel-layer event for ``handler`` with its JSON frame."""
+        return {
+            "type": handler,
+            "text": cls.encode_json(message),
+        }
+
+    async def accept(self, subprotocol=None, headers=None):
+        if subprotocol is None:
+            requested = self.scope.get("subprotocols") or []
+            subprotocol = next(
+                (item for item in requested if item in self.SUBPROTOCOLS),
+                None
+            )
+        if subprotocol in self.SUBPROTOCOLS:
+            self.codec = subprotocol
+        await super().accept(subprotocol=subprotocol, headers=headers)
+
+    def decode_frame(self, text_data=None, bytes_data=None):
+        """Decode an incoming frame, whichever way the client sent it."""
+        if bytes_data is not None:
+            return encoders.unpackb(bytes_data)
+        return self.decode_json(text_data)
+
+    async def send_message(self, message):
+        if self.codec == self.MSGPACK:
+            await self.send(bytes_data=encoders.packb(message))
+        else:
+            await self.send(text_data=self.encode_json(message))
+
+    async def send_frame(self, event):
+        """Forward a group event to the socket, re-encoded only for MessagePack."""
+        if self.codec == self.MSGPACK:
+            if "text" in event:
+                message = self.decode_json(event["text"])
+            else:
+                # Event produced without `frame_event`
+                message = event["message"]
+            await self.send(bytes_data=encoders.packb(message))
+        else:
+            text = event.get("text")
+            if text is None:
+                text = self.encode_json(event["message"])
+            await self.send(text_data=text)
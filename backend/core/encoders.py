@@ -0,0 +1,55 @@
+"""
+Encoding of WebSocket frames.
+
+Serializer output is encoded in a single pass, with orjson when it is
+installed and the standard library otherwise. Types JSON does not know about
+(lazy translations, datetimes built by hand, decimals, ...) are handled by
+DRF's encoder so the output matches what ``JSONRenderer`` would produce.
+
+Clients that negotiate the ``msgpack`` subprotocol get the same payloads as
+binary MessagePack frames (``packb``/``unpackb``).
+"""
+import json
+
+import msgpack
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+if orjson is not None:
+    BACKEND = "orjson"
+
+    def dumps(data) -> bytes:
+        return orjson.dumps(
+            data,
+            default=_encoder.default,
+            option=orjson.OPT_PASSTHROUGH_DATETIME,
+        )
+
+    loads = orjson.loads
+else:
+    BACKEND = "json"
+
+    def dumps(data) -> bytes:
+        return _encoder.encode(data).encode()
+
+    loads = json.loads
+
+
+def dumps_text(data) -> str:
+    """Encode ``data`` for a WebSocket text frame."""
+    return dumps(data).decode()
+
+
+def packb(data) -> bytes:
+    """Encode ``data`` for a binary MessagePack frame."""
+    return msgpack.packb(data, default=_encoder.default)
+
+
+def unpackb(data: bytes):
+    return msgpack.unpackb(data)
@@ -43,6 +43,7 @@ INSTALLED_APPS = [
     "events.apps.EventsConfig",
     "posts.apps.PostsConfig",
     "chat.apps.ChatConfig",
+    "uploads.apps.UploadsConfig",
     # Third party packages
     "rest_framework",
     'django_filters',
@@ -176,6 +177,43 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# Internal nginx location serving MEDIA_ROOT, empty to stream media from Django
+MEDIA_ACCEL_REDIRECT = env.str('MEDIA_ACCEL_REDIRECT', default='' if DEBUG else '/protected-media/')
+# Part files of resumable and streamed uploads, on the same file system as MEDIA_ROOT
+UPLOAD_TEMP_DIR = env.str('UPLOAD_TEMP_DIR', default=str(BASE_DIR / 'tmp' / 'uploads'))
+
+# Media referenced by models go to the content-addressed storage
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    "media": {
+        "BACKEND": "uploads.storage.ContentAddressedStorage",
+    },
+    # Hashed file names from the manifest written by collectstatic
+    "staticfiles": {
+        "BACKEND": (
+            "django.contrib.staticfiles.storage.StaticFilesStorage" if DEBUG
+            else "django.contrib.staticfiles.storage.ManifestStaticFilesStorage"
+        ),
+    },
+}
+
+# Media in an S3-compatible bucket (AWS S3, MinIO), with direct uploads
+if env.str('MEDIA_STORAGE', default='filesystem') == 's3':
+    STORAGES["media"] = {
+        "BACKEND": "uploads.s3.S3ContentAddressedStorage",
+        "OPTIONS": {
+            "bucket_name": env.str('S3_BUCKET'),
+            "endpoint_url": env.str('S3_ENDPOINT_URL', default=None),
+            "access_key": env.str('S3_ACCESS_KEY'),
+            "secret_key": env.str('S3_SECRET_KEY'),
+            "region_name": env.str('S3_REGION', default='us-east-1'),
+            "addressing_style": "path",
+            "signature_version": "s3v4",
+            "default_acl": None,
+        },
+    }
 
 STATICFILES_DIRS = [
     BASE_DIR / 'static'
@@ -286,7 +324,31 @@ if DEBUG:
             "BACKEND": "channels.layers.InMemoryChannelLayer"
         },
     }
+    PRESENCE = {
+        "BACKEND": "accounts.presence.MemoryPresence",
+    }
+    CALL_STATE = {
+        "BACKEND": "chat.call_state.MemoryCallState",
+    }
+    TYPING_STATE = {
+        "BACKEND": "chat.typing_state.MemoryTypingState",
+    }
+    # No process_media worker in development
+    MEDIA_PROCESSING_INLINE = True
 else:
+    MEDIA_PROCESSING_INLINE = False
+    PRESENCE = {
+        "BACKEND": "accounts.presence.RedisPresence",
+        "LOCATION": env('REDIS_HOST', default='redis://localhost:6379'),
+    }
+    CALL_STATE = {
+        "BACKEND": "chat.call_state.RedisCallState",
+        "LOCATION": env('REDIS_HOST', default='redis://localhost:6379'),
+    }
+    TYPING_STATE = {
+        "BACKEND": "chat.typing_state.RedisTypingState",
+        "LOCATION": env('REDIS_HOST', default='redis://localhost:6379'),
+    }
     CHANNEL_LAYERS = {
         'default': {
             'BACKEND': 'channels_redis.core.RedisChannelLayer',
@@ -349,7 +411,9 @@ if not DEBUG:
     EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
     # expires in 6 months
     # DEFAULTS['ACCESS_TOKEN_EXPIRE_SECONDS'] = 1.577e7
-    FILE_UPLOAD_MAX_MEMORY_SIZE = 1024 * 1024 * 1024 * 2  # 2 GB limit
+    # Default size limit of uploaded files, FILE_UPLOAD_MAX_MEMORY_SIZE keeps
+    # its default: bigger files are streamed to disk
+    MAX_UPLOAD_SIZE = 1024 * 1024 * 1024 * 2  # 2 GB limit
 
 else:
     CACHES = {
@@ -359,7 +423,7 @@ else:
     }
     EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
     DEFAULTS['ACCESS_TOKEN_EXPIRE_SECONDS'] = 1.577e7
-    FILE_UPLOAD_MAX_MEMORY_SIZE = 200 * 1024 * 1024  # 200 Mb limit
+    MAX_UPLOAD_SIZE = 200 * 1024 * 1024  # 200 Mb limit
 
 EMAIL_HOST = env("EMAIL_HOST", default="")
 EMAIL_PORT = env("EMAIL_PORT", default="")
@@ -373,6 +437,19 @@ LIVEKIT_API_KEY = env.str('LIVEKIT_API_KEY', default="")
 LIVEKIT_API_SECRET = env.str('LIVEKIT_API_SECRET', default="")
 LIVEKIT_URL = env.str('LIVEKIT_URL', default='http://localhost:7880')
 LIVEKIT_WS_URL = env.str('LIVEKIT_WS_URL', default='ws://localhost:7881')
+# Call participants come from LiveKit webhooks instead of call sockets
+CALL_PARTICIPANTS_FROM_LIVEKIT = env.bool(
+    'CALL_PARTICIPANTS_FROM_LIVEKIT', default=False
+)
+
+# ICE servers by client region, see chat.ice_servers
+ICE_REGION_TABLE = env.str('ICE_REGION_TABLE', default="")
+ICE_DEFAULT_REGION = env.str('ICE_DEFAULT_REGION', default="")
+# Proxies whose X-Real-IP header locates the client, networks or host names
+ICE_TRUSTED_PROXIES = env.list('ICE_TRUSTED_PROXIES', default=['nginx'])
+
+# Messages older than this are moved to cold storage by `archive_messages`
+CHAT_ARCHIVE_AFTER_DAYS = env.int('CHAT_ARCHIVE_AFTER_DAYS', default=365)
 
 # Uncomment if Using RabbitMQ
 # RABBITMQ_HOST = env("RABBITMQ_HOST", default="")
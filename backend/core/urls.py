@@ -21,6 +21,8 @@ from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 from django.conf.urls.static import static
 from django.conf import settings
 
+from uploads.views import MediaView
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/v1/settings/",include("core.v1.urls",namespace="v1-settings")),
@@ -28,11 +30,16 @@ urlpatterns = [
     path("api/v1/posts/", include("posts.v1.urls", namespace="v1-posts")),
     path("api/v1/events/", include("events.v1.urls", namespace="v1-events")),
     path("api/v1/chat/", include("chat.v1.urls", namespace="v1-chat")),
+    path("api/v1/uploads/", include("uploads.v1.urls", namespace="v1-uploads")),
     path("api/v1/", include("main.v1.urls", namespace="v1-main")),
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
     path('api/schema/docs/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
     re_path(r'^api/auth/', include('drf_social_oauth2.urls', namespace='drf')),
+    re_path(
+        r'^%s(?P<name>.+)$' % settings.MEDIA_URL.lstrip('/'),
+        MediaView.as_view(),
+        name='media'
+    ),
 ]
 
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
@@ -27,7 +27,7 @@ class ValidateFileSize:
         if allowed_file_size is not None:
             self.allowed_file_size = allowed_file_size * 1024 * 1024  # Convert MB to bytes
         else:
-            self.allowed_file_size = settings.FILE_UPLOAD_MAX_MEMORY_SIZE
+            self.allowed_file_size = settings.MAX_UPLOAD_SIZE
 
         if message is not None:
             self.message = message
@@ -5,6 +5,7 @@ from django.core.management.utils import get_random_string
 from mptt.models import MPTTModel, TreeForeignKey
 
 from core.utils import UploadPath, BaseModel
+from uploads.storage import get_media_storage
 
 
 # Create your models here.
@@ -24,12 +25,16 @@ class Family(BaseModel):
     avatar = models.ImageField(
         verbose_name=_("Avatar"),
         upload_to=UploadPath(folder="pictures", sub_path="avatars"),
+        storage=get_media_storage,
+        db_index=True,
         blank=True,
         null=True,
     )
     bg_cover = models.ImageField(
         verbose_name=_("Background Cover"),
         upload_to=UploadPath(folder="pictures", sub_path="covers"),
+        storage=get_media_storage,
+        db_index=True,
         blank=True,
         null=True,
     )
@@ -110,6 +115,8 @@ class FamilyTree(MPTTModel):
     avatar = models.ImageField(
         verbose_name=_("Avatar"),
         upload_to=UploadPath(folder="pictures", sub_path="avatars"),
+        storage=get_media_storage,
+        db_index=True,
         blank=True,
         null=True,
     )
@@ -8,6 +8,8 @@ from mptt.models import MPTTModel, TreeForeignKey
 from main.models import Family, FamilyMembers
 from core.utils import BaseModel, UploadPath
 from core.validators import ValidateFileSize
+from uploads.models import ProcessedMedia
+from uploads.storage import get_media_storage
 
 
 # Create your models here.
@@ -28,10 +30,12 @@ class Post(BaseModel):
         return f"post-{self.id}"
 
 
-class PostMedia(BaseModel):
+class PostMedia(ProcessedMedia):
     post = models.ForeignKey(Post, verbose_name=_("Post"), on_delete=models.CASCADE, related_name="medias")
     file = models.FileField(
         upload_to=UploadPath(folder="posts", sub_path="media"),
+        storage=get_media_storage,
+        db_index=True,
         validators=[
             FileExtensionValidator(
                 allowed_extensions=[
@@ -2,6 +2,7 @@ from rest_framework import serializers
 
 from main.models import FamilyMembers
 from accounts.v1.serializers import PublicUserSerializer
+from uploads.v1.serializers import MediaVariantsField
 
 from posts.models import Post, PostMedia, PostLike, Comment, CommentLike
 
@@ -29,10 +30,12 @@ class PostMediaCreateSerializer(serializers.ModelSerializer):
 
 class PostMediaSerializer(serializers.ModelSerializer):
     ext = serializers.SerializerMethodField(read_only=True)
+    variants = MediaVariantsField()
 
     class Meta:
         model = PostMedia
-        fields = ['id', 'is_featured', 'file', 'ext']
+        fields = ['id', 'is_featured', 'file', 'ext', 'width', 'height',
+                  'placeholder', 'variants']
 
     def get_ext(self, obj):
         return obj.get_extension()
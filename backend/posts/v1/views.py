@@ -19,6 +19,7 @@ from drf_spectacular.utils import (
 from django.db import transaction
 
 from core.mixins import OptionalPaginationMixin
+from uploads.handlers import StreamingUploadMixin
 from main.models import FamilyMembers
 
 from posts.models import Post, PostMedia, PostLike, Comment, CommentLike
@@ -43,12 +44,17 @@ from .serializers import (
     ]
 )
 class PostListCreateView(
+    StreamingUploadMixin,
     OptionalPaginationMixin,
     ListAPIView,
     CreateAPIView
 ):
     serializer_class = PostSerializer
     permission_classes = [IsAuthenticated]
+    upload_fields = {
+        "media": PostMedia._meta.get_field("file"),
+        "cover_image": PostMedia._meta.get_field("file"),
+    }
 
     def get_queryset(self, *args, **kwargs):
         user = self.request.user
@@ -291,7 +297,7 @@ class PostRetrieveUpdateDeleteView(RetrieveUpdateDestroyAPIView):
 
 
 @extend_schema(tags=['Posts'])
-class PostMediaManageView(APIView):
+class PostMediaManageView(StreamingUploadMixin, APIView):
     """
     Manage media files for a specific post.
 
@@ -299,6 +305,7 @@ class PostMediaManageView(APIView):
     - **DELETE**: Delete a specific media from a post
     """
     permission_classes = [IsAuthenticated]
+    upload_fields = {"media": PostMedia._meta.get_field("file")}
 
     def get_post(self, post_id, user):
         try:
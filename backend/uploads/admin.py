@@ -0,0 +1,19 @@
+from django.contrib import admin
+
+from .models import Blob, Upload
+
+
+@admin.register(Upload)
+class UploadAdmin(admin.ModelAdmin):
+    list_display = ['pk', 'user', 'target', 'filename', 'offset', 'length',
+                    'media_id', 'completed_at', 'expires_at']
+    list_filter = ['target', 'completed_at', 'expires_at']
+    search_fields = ['filename']
+
+
+@admin.register(Blob)
+class BlobAdmin(admin.ModelAdmin):
+    list_display = ['name', 'size', 'refcount', 'updated_at']
+    list_filter = ['updated_at']
+    search_fields = ['name', 'sha256']
+    readonly_fields = ['name', 'sha256', 'size', 'refcount']
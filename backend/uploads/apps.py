@@ -0,0 +1,12 @@
+from django.apps import AppConfig
+
+
+class UploadsConfig(AppConfig):
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "uploads"
+
+    def ready(self):
+        import uploads.signals
+        from uploads.storage import track_references
+
+        track_references()
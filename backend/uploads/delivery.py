@@ -0,0 +1,196 @@
+"""
+Delivery of media files.
+
+``MEDIA_URL`` is served by ``MediaView``, which only decides whether the
+client may read the file: the bytes are sent by nginx, from the internal
+location ``settings.MEDIA_ACCEL_REDIRECT`` named in an ``X-Accel-Redirect``
+header. Without it (development), Django streams the file itself. Files in
+an object storage are redirected to, with a short-lived presigned URL.
+
+Files of ``PostMedia`` and ``MessageMedia`` rows, and their variants, are
+readable by the members of the family of the post, the participants of the
+room of the message, and the uploader of a message media not sent yet. The
+files of ``PUBLIC_FILE_FIELDS`` (avatars, covers) are public. A file
+referenced by a public row stays public, whatever media rows share it. The
+URLs the API hands out are signed (``uploads.signing``), which stands for
+these checks.
+
+Blob names are content hashes, so blob responses are immutable: they are
+cached for a year and revalidated against their hash as ``ETag``.
+"""
+import mimetypes
+import os
+import posixpath
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.http import (
+    FileResponse, HttpResponse, HttpResponseNotModified, HttpResponseRedirect,
+)
+from django.utils.http import quote_etag
+
+from chat.helpers import is_room_member
+from chat.models import MessageMedia, message_room_ids
+from main.models import FamilyMembers
+from posts.models import PostMedia
+
+from .models import MediaVariant, Upload
+from .storage import BLOB_PREFIX, get_media_storage
+
+MEDIA_MODELS = (MessageMedia, PostMedia)
+# Indexed file columns of the public files
+PUBLIC_FILE_FIELDS = (
+    ("accounts.User", ("avatar", "bg_cover")),
+    ("main.Family", ("avatar", "bg_cover")),
+    ("main.FamilyTree", ("avatar",)),
+    ("chat.Room", ("avatar",)),
+)
+MEDIA_OWNERS_CACHE_KEY = "media_owners_{}"
+MEDIA_OWNERS_CACHE_TIMEOUT = 60 * 10
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+MUTABLE_MAX_AGE = 60 * 60
+PRESIGNED_REDIRECT_MAX_AGE = 5 * 60
+
+
+def clean_name(name):
+    """The storage name of a requested path, None if it leaves the media root."""
+    name = posixpath.normpath(name).lstrip("/")
+    if name in ("", ".") or name.startswith("..") or "\\" in name:
+        return None
+    return name
+
+
+def find_media(model, name):
+    media = model.objects.filter(file=name)
+    if not media.exists():
+        # A variant: the rows of its original
+        media = model.objects.filter(
+            file__in=MediaVariant.objects.filter(name=name).values("original")
+        )
+    return media
+
+
+def is_public(name):
+    for label, fields in PUBLIC_FILE_FIELDS:
+        if apps.get_model(label)._base_manager.filter(
+                Q.create([(field, name) for field in fields], Q.OR)
+        ).exists():
+            return True
+    return False
+
+
+def media_owners(name):
+    """
+    Who may read a file: ``{"public": bool, "rooms": [...], "families":
+    [...], "users": [...]}``, or None if no row references it.
+    """
+    key = MEDIA_OWNERS_CACHE_KEY.format(name)
+    owners = cache.get(key)
+    if owners is not None:
+        return owners or None
+
+    messages = find_media(MessageMedia, name)
+    posts = find_media(PostMedia, name)
+    owners = {
+        "public": is_public(name),
+        # Archived messages keep their id, media rows still point to them
+        "rooms": list(message_room_ids(
+            messages.filter(message__isnull=False).values("message_id")
+        )),
+        "families": list(
+            posts.values_list("post__author__family_id", flat=True).distinct()
+        ),
+        "users": list(
+            Upload.objects.filter(
+                target=Upload.TargetChoices.MESSAGE_MEDIA,
+                media_id__in=messages.filter(
+                    message__isnull=True
+                ).values("pk")
+            ).values_list("user_id", flat=True)
+        ),
+    }
+    if not (owners["public"] or owners["rooms"] or owners["families"]
+            or owners["users"]):
+        owners = {}
+    cache.set(key, owners, MEDIA_OWNERS_CACHE_TIMEOUT)
+    return owners or None
+
+
+def invalidate_media_owners(names):
+    cache.delete_many([MEDIA_OWNERS_CACHE_KEY.format(name) for name in names])
+
+
+def invalidate_media(media_rows):
+    """Drop the cached owners of the files of media rows that changed."""
+    names = set()
+    for media in media_rows:
+        names.add(media.file.name or None)
+        names.update(
+            variant["name"] for variant in (media.variants or {}).values()
+        )
+    names.discard(None)
+    # Not before the change is visible to the requests refilling the cache
+    transaction.on_commit(lambda: invalidate_media_owners(names))
+
+
+def can_read(user, owners):
+    if owners["public"]:
+        return True
+    if not user.is_authenticated:
+        return False
+    if user.id in owners["users"]:
+        return True
+    if any(is_room_member(room_id, user.id) for room_id in owners["rooms"]):
+        return True
+    return bool(owners["families"]) and FamilyMembers.objects.filter(
+        member=user,
+        family_id__in=owners["families"]
+    ).exists()
+
+
+def cache_headers(name, owners):
+    """``ETag`` and ``Cache-Control`` of a readable file."""
+    if name.startswith(BLOB_PREFIX):
+        etag = os.path.splitext(os.path.basename(name))[0]
+        max_age = f"max-age={IMMUTABLE_MAX_AGE}, immutable"
+    else:
+        storage = get_media_storage()
+        etag = "%x-%x" % (
+            storage.size(name),
+            int(storage.get_modified_time(name).timestamp())
+        )
+        max_age = f"max-age={MUTABLE_MAX_AGE}"
+    return {
+        "ETag": quote_etag(etag),
+        "Cache-Control": f"{'public' if owners['public'] else 'private'}, {max_age}",
+    }
+
+
+def media_response(request, name, owners):
+    """The response sending a readable file, or a 304. None if it is missing."""
+    storage = get_media_storage()
+    if not storage.exists(name):
+        return None
+
+    headers = cache_headers(name, owners)
+    if headers["ETag"] in request.headers.get("If-None-Match", ""):
+        return HttpResponseNotModified(headers=headers)
+
+    if hasattr(storage, "presigned_download"):
+        # Object storage: the URL outlives the cached redirect
+        headers["Cache-Control"] = "private, max-age=%d" % PRESIGNED_REDIRECT_MAX_AGE
+        return HttpResponseRedirect(storage.presigned_download(name), headers=headers)
+
+    content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    accel = getattr(settings, "MEDIA_ACCEL_REDIRECT", "")
+    if accel:
+        headers["X-Accel-Redirect"] = accel.rstrip("/") + "/" + name
+        return HttpResponse(content_type=content_type, headers=headers)
+    return FileResponse(
+        storage.open(name, "rb"),
+        content_type=content_type,
+        headers=headers
+    )
@@ -0,0 +1,153 @@
+"""
+Direct uploads: the client sends the file to the object storage itself, so
+app servers never see its bytes.
+
+1. ``create_direct_upload``: the client announces the file name, length and
+   SHA-256 of the content; they are checked like a resumable upload, and the
+   client gets a presigned PUT request for a staging object of its own. The
+   bucket refuses a body of another length or hash.
+2. The client sends the PUT request.
+3. ``commit_upload``: the staging object is checked (length, checksum, first
+   bytes against the extension) and copied by the bucket into the blob of
+   its content, unless the blob is already stored. The blob becomes the file
+   of the media row or group avatar of the upload.
+
+A hash and a length prove nothing: only a client that may already read the
+stored blob skips the upload, others always send the bytes.
+
+Needs a media storage with presigned uploads, see ``uploads.s3``. Staging
+objects of uploads never committed are deleted with the expired uploads,
+see ``purge_uploads``.
+"""
+import hashlib
+import os
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from chat.helpers import is_room_member
+from chat.models import MessageMedia
+from posts.models import PostMedia
+
+from .delivery import can_read, media_owners
+from .helpers import (
+    UploadError, check_upload, complete_upload, discard_upload, set_room_avatar,
+)
+from .models import Upload
+from .sniffing import SNIFF_LENGTH, check_type
+from .storage import BLOB_GRACE_PERIOD, blob_name, get_media_storage, register_blob
+
+# Committed before collect_blobs may take the blob
+DIRECT_UPLOAD_EXPIRY = BLOB_GRACE_PERIOD - timedelta(minutes=5)
+STAGING_PREFIX = "staging/"
+
+
+def can_reuse_blob(user, name) -> bool:
+    """Whether ``user`` may skip uploading the stored blob ``name``."""
+    owners = media_owners(name)
+    return owners is not None and can_read(user, owners)
+
+
+def stored_checksum(storage, name):
+    """Hex SHA-256 of a stored object, hashed here if the bucket has none."""
+    checksum = storage.checksum(name)
+    if checksum is None:
+        digest = hashlib.sha256()
+        with storage.open(name, "rb") as file:
+            for chunk in file.chunks():
+                digest.update(chunk)
+        checksum = digest.hexdigest()
+    return checksum
+
+
+def create_direct_upload(user, sha256, content_type, length, metadata):
+    """
+    Returns the upload and the request sending its file, None if the blob
+    is stored in media ``user`` can read.
+    """
+    storage = get_media_storage()
+    if not hasattr(storage, "presigned_upload"):
+        raise UploadError(
+            "Direct uploads need an object storage, use resumable uploads.",
+            501
+        )
+    target, filename, options = check_upload(user, length, metadata)
+    name = blob_name(sha256, filename)
+    reused = storage.exists(name) and can_reuse_blob(user, name)
+    if reused:
+        register_blob(name, sha256, length)
+    upload = Upload.objects.create(
+        user=user,
+        target=target,
+        filename=filename,
+        length=length,
+        metadata=options | {
+            "name": name,
+            "sha256": sha256,
+            "content_type": content_type,
+        },
+        is_direct=True,
+        expires_at=timezone.now() + DIRECT_UPLOAD_EXPIRY,
+    )
+    if reused:
+        return upload, None
+    staging = f"{STAGING_PREFIX}{upload.pk}{os.path.splitext(name)[1]}"
+    upload.metadata["staging"] = staging
+    upload.save(update_fields=["metadata", "updated_at"])
+    return upload, storage.presigned_upload(staging, length, sha256, content_type)
+
+
+def commit_upload(upload):
+    """
+    Create the media row, or set the group avatar, of a direct upload whose
+    file is stored. Returns the row.
+    """
+    if not upload.is_direct:
+        raise UploadError("Upload is not direct.", 409)
+    if upload.is_complete:
+        raise UploadError("Upload is already complete.", 403)
+    if upload.expires_at < timezone.now():
+        raise UploadError("Upload expired.", 404)
+
+    storage = get_media_storage()
+    name = upload.metadata["name"]
+    staging = upload.metadata.get("staging")
+    sha256 = upload.metadata["sha256"]
+    if staging is None:
+        # Stored blob the user may read, nothing was sent
+        size = upload.length
+        register_blob(name, sha256, size)
+        if not storage.exists(name):
+            raise UploadError("The file has not been uploaded.", 409)
+    else:
+        try:
+            size = storage.size(staging)
+        except FileNotFoundError:
+            raise UploadError("The file has not been uploaded.", 409)
+        if size != upload.length:
+            raise UploadError("The file length does not match.", 400)
+        if stored_checksum(storage, staging) != sha256:
+            raise UploadError("The file checksum does not match.", 400)
+        if not check_type(upload.filename, storage.read_prefix(staging, SNIFF_LENGTH)):
+            discard_upload(upload)
+            raise UploadError("File content does not match its extension.", 400)
+        if not (register_blob(name, sha256, size) and storage.exists(name)):
+            storage.copy(staging, name)
+        storage.delete(staging)
+
+    with transaction.atomic():
+        if upload.target == Upload.TargetChoices.ROOM_AVATAR:
+            if not is_room_member(upload.metadata["room"], upload.user_id):
+                raise UploadError("You are not a member of this group.", 403)
+            row = set_room_avatar(upload.metadata["room"], name)
+        elif upload.target == Upload.TargetChoices.POST_MEDIA:
+            row = PostMedia.objects.create(
+                post_id=upload.metadata["post"],
+                is_featured=upload.metadata.get("is_featured", False),
+                file=name,
+            )
+        else:
+            row = MessageMedia.objects.create(file=name, size=size)
+        complete_upload(upload, row.pk)
+    return row
@@ -0,0 +1,190 @@
+"""
+Streaming multipart uploads for the API views receiving files.
+
+Django's default handlers keep a file in memory up to
+``FILE_UPLOAD_MAX_MEMORY_SIZE``, and the model validators only see it once
+the whole body is received. ``StreamingUploadHandler`` checks each file as
+it arrives, against the validators of the model field it is meant for:
+
+- its extension, before the first byte is written;
+- its first bytes against that extension (``uploads.sniffing``), as soon
+  as they are received;
+- its size, on every chunk.
+
+The bytes go to a temporary file, hashed on the way, so the content-addressed
+storage moves the file into place without reading it again. The first
+failure stops the parsing, without reading the rest of the body, and the
+view answers 400 with the errors of the field. A request longer than
+``max_files`` files at the size limit is refused with a 413 before it is
+read.
+"""
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import TemporaryUploadedFile, UploadedFile
+from django.core.files.uploadhandler import (
+    FileUploadHandler, SkipFile, StopUpload,
+)
+from django.http import QueryDict
+from django.utils.datastructures import MultiValueDict
+from rest_framework import exceptions
+
+from core.validators import ValidateFileSize
+
+from .helpers import UPLOAD_CHUNK_SIZE, UploadedPart
+from .sniffing import SNIFF_LENGTH, check_type
+
+
+class HashedUploadedFile(TemporaryUploadedFile):
+    """
+    A temporary upload with the hex SHA-256 of its content, in
+    ``UPLOAD_TEMP_DIR`` so that the file system storage renames it into place.
+    """
+    sha256 = None
+
+    def __init__(self, name, content_type, size, charset, content_type_extra=None):
+        os.makedirs(settings.UPLOAD_TEMP_DIR, exist_ok=True)
+        file = tempfile.NamedTemporaryFile(
+            suffix=".upload" + os.path.splitext(name)[1],
+            dir=settings.UPLOAD_TEMP_DIR
+        )
+        UploadedFile.__init__(self, file, name, content_type, size, charset, content_type_extra)
+
+    def __deepcopy__(self, memo):
+        # The views copy request.data, which holds the files, with QueryDict.copy()
+        return self
+
+
+class UploadTooLarge(exceptions.APIException):
+    status_code = 413
+    default_detail = "The request is too large."
+    default_code = "upload_too_large"
+
+
+def size_validator(field):
+    """The ``ValidateFileSize`` of a model file field."""
+    for validator in field.validators:
+        if isinstance(validator, ValidateFileSize):
+            return validator
+    return ValidateFileSize()
+
+
+class StreamingUploadHandler(FileUploadHandler):
+    chunk_size = UPLOAD_CHUNK_SIZE
+
+    def __init__(self, request, fields, max_files):
+        """
+        ``fields`` maps the form fields accepted to the model file fields
+        their files are saved in. Files of other form fields are skipped.
+        """
+        super().__init__(request)
+        self.fields = fields
+        self.max_files = max_files
+        self.files = 0
+        self.error = None
+
+    def discard(self):
+        # The parser closes the ``file`` of its handlers when it stops
+        if hasattr(self, "file"):
+            self.file.close()
+            del self.file
+
+    def reject(self, messages):
+        self.error = exceptions.ValidationError({self.field_name: messages})
+        self.discard()
+        raise StopUpload(connection_reset=True)
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        limit = max(
+            (size_validator(field).allowed_file_size for field in self.fields.values()),
+            default=0
+        )
+        if content_length > limit * self.max_files:
+            self.error = UploadTooLarge()
+            # Parsed as empty, the body is never read
+            return QueryDict(encoding=encoding), MultiValueDict()
+        return None
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None,
+                 content_type_extra=None):
+        super().new_file(
+            field_name, file_name, content_type, content_length, charset, content_type_extra
+        )
+        if field_name not in self.fields:
+            raise SkipFile()
+        self.files += 1
+        if self.files > self.max_files:
+            self.reject([f"At most {self.max_files} files are accepted."])
+        self.field = self.fields[field_name]
+        self.size_validator = size_validator(self.field)
+        try:
+            # Extension, and size when the part declares it
+            self.field.run_validators(
+                UploadedPart(None, file_name, content_length or 0)
+            )
+        except ValidationError as e:
+            self.reject(e.messages)
+
+        self.file = HashedUploadedFile(
+            file_name, content_type, 0, charset, content_type_extra
+        )
+        self.digest = hashlib.sha256()
+        self.prefix = b""
+        self.size = 0
+
+    def check_prefix(self):
+        if not check_type(self.file_name, self.prefix):
+            self.reject(["File content does not match its extension."])
+
+    def receive_data_chunk(self, raw_data, start):
+        self.size += len(raw_data)
+        try:
+            self.size_validator(UploadedPart(None, self.file_name, self.size))
+        except ValidationError as e:
+            self.reject(e.messages)
+        if len(self.prefix) < SNIFF_LENGTH:
+            self.prefix += raw_data[:SNIFF_LENGTH - len(self.prefix)]
+            if len(self.prefix) == SNIFF_LENGTH:
+                self.check_prefix()
+        self.digest.update(raw_data)
+        self.file.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if len(self.prefix) < SNIFF_LENGTH:
+            self.check_prefix()
+        file = self.file
+        del self.file
+        file.seek(0)
+        file.size = file_size
+        file.sha256 = self.digest.hexdigest()
+        return file
+
+    def upload_interrupted(self):
+        self.discard()
+
+
+class StreamingUploadMixin:
+    """
+    Parse the multipart body of an API view with ``StreamingUploadHandler``.
+    ``upload_fields`` maps its file form fields to model file fields.
+    """
+    upload_fields = {}
+    upload_max_files = 20
+
+    def initialize_request(self, request, *args, **kwargs):
+        self.upload_handler = StreamingUploadHandler(
+            request, self.upload_fields, self.upload_max_files
+        )
+        request.upload_handlers = [self.upload_handler]
+        return super().initialize_request(request, *args, **kwargs)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # Parsed here, out of the error handling of the handlers
+        request.data
+        if self.upload_handler.error is not None:
+            raise self.upload_handler.error
@@ -0,0 +1,332 @@
+"""
+Resumable uploads, following the tus protocol
+(https://tus.io/protocols/resumable-upload): the client declares the length
+of the file, then sends it in any number of chunks, each starting at the
+offset the server has acknowledged. A dropped connection only loses the
+chunk in flight, and the client resumes from the offset returned by
+``HEAD``.
+
+Chunks are streamed from the request to a part file in
+``settings.UPLOAD_TEMP_DIR``, never held in memory. The extension and the
+declared length are checked against the validators of the target file field
+before the first byte is accepted, and no chunk may go past the declared
+length. The complete part file, once its first bytes match its extension,
+is moved into the media storage as the file of a new ``MessageMedia`` or
+``PostMedia``, or as the avatar of a group.
+
+Message media are created unattached and attached to the message they are
+sent with, see ``attach_message_uploads``.
+"""
+import base64
+import fcntl
+import os
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
+from django.utils import timezone
+
+from chat.helpers import is_room_member
+from chat.models import MessageMedia, Room
+from posts.models import Post, PostMedia
+
+from .delivery import invalidate_media
+from .models import Upload
+from .sniffing import SNIFF_LENGTH, check_type
+from .storage import get_media_storage
+
+TUS_VERSION = "1.0.0"
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Unfinished uploads are dropped this long after their last chunk
+UPLOAD_EXPIRY = timedelta(days=1)
+
+
+class UploadError(Exception):
+    def __init__(self, detail, status):
+        super().__init__(detail)
+        self.detail = detail
+        self.status = status
+
+
+class UploadedPart(UploadedFile):
+    """
+    A file already on disk. The file system storage moves it into place
+    instead of copying it.
+    """
+
+    def __init__(self, path, name, size):
+        super().__init__(
+            file=open(path, "rb") if path else None,
+            name=name,
+            size=size
+        )
+        self.path = path
+
+    def temporary_file_path(self):
+        return self.path
+
+
+def parse_metadata(header):
+    """Decode a tus ``Upload-Metadata`` header into a dict of strings."""
+    metadata = {}
+    for pair in filter(None, (header or "").split(",")):
+        key, _, value = pair.strip().partition(" ")
+        try:
+            metadata[key] = base64.b64decode(value).decode() if value else ""
+        except ValueError:
+            raise UploadError("Invalid Upload-Metadata header.", 400)
+    return metadata
+
+
+def target_field(target):
+    return {
+        Upload.TargetChoices.MESSAGE_MEDIA: MessageMedia._meta.get_field("file"),
+        Upload.TargetChoices.POST_MEDIA: PostMedia._meta.get_field("file"),
+        Upload.TargetChoices.ROOM_AVATAR: Room._meta.get_field("avatar"),
+    }[target]
+
+
+def validate_file(target, filename, length):
+    """
+    Run the validators of the target file field on the declared file,
+    before any of it is received.
+    """
+    target_field(target).run_validators(UploadedPart(None, filename, length))
+
+
+def check_target(user, target, metadata):
+    """Target options of a new upload, checked against ``user``."""
+    if target == Upload.TargetChoices.POST_MEDIA:
+        post_id = metadata.get("post", "")
+        post = Post.objects.filter(
+            pk=post_id,
+            is_active=True
+        ).select_related("author").first() if post_id.isdigit() else None
+        if post is None:
+            raise UploadError("Post not found or inactive.", 400)
+        if post.author.member_id != user.id:
+            raise UploadError(
+                "You are not allowed to modify this post's media.", 403
+            )
+        return {
+            "post": post.pk,
+            "is_featured": metadata.get("is_featured", "").lower()
+            in ("1", "true"),
+        }
+    if target == Upload.TargetChoices.ROOM_AVATAR:
+        room_id = metadata.get("room", "")
+        if not (room_id.isdigit() and Room.objects.filter(
+                pk=room_id,
+                type=Room.TypeChoices.GROUP
+        ).exists()):
+            raise UploadError("Group not found.", 400)
+        if not is_room_member(room_id, user.id):
+            raise UploadError("You are not a member of this group.", 403)
+        return {"room": int(room_id)}
+    return {}
+
+
+def check_upload(user, length, metadata):
+    """
+    Target, file name and target options of a new upload, checked against
+    ``user`` and the target field.
+    """
+    target = metadata.get("target")
+    if target not in Upload.TargetChoices.values:
+        raise UploadError("Unknown upload target.", 400)
+    filename = os.path.basename(metadata.get("filename", ""))[:255]
+    if not filename:
+        raise UploadError("A filename is required.", 400)
+    try:
+        validate_file(target, filename, length)
+    except ValidationError as e:
+        raise UploadError(e.messages, 400)
+    return target, filename, check_target(user, target, metadata)
+
+
+def create_upload(user, length, metadata) -> Upload:
+    target, filename, options = check_upload(user, length, metadata)
+    upload = Upload(
+        user=user,
+        target=target,
+        filename=filename,
+        length=length,
+        metadata=options,
+        expires_at=timezone.now() + UPLOAD_EXPIRY,
+    )
+    os.makedirs(settings.UPLOAD_TEMP_DIR, exist_ok=True)
+    open(upload.part_path, "wb").close()
+    upload.save()
+    return upload
+
+
+def receive_chunk(upload, stream, offset, content_length) -> int:
+    """
+    Append ``content_length`` bytes read from ``stream`` at ``offset``.
+    What was received is kept if the client goes away mid-chunk.
+    Returns the new offset.
+    """
+    if upload.is_complete:
+        raise UploadError("Upload is already complete.", 403)
+    if upload.is_direct:
+        raise UploadError("Upload goes to the object storage.", 409)
+    if offset + content_length > upload.length:
+        raise UploadError("Chunk goes past the upload length.", 413)
+    try:
+        part = open(upload.part_path, "r+b")
+    except FileNotFoundError:
+        raise UploadError("Upload expired.", 404)
+
+    with part:
+        try:
+            fcntl.flock(part, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadError("Another chunk is being received.", 423)
+        upload.refresh_from_db(fields=["offset"])
+        if offset != upload.offset:
+            raise UploadError("Upload-Offset does not match.", 409)
+
+        part.seek(offset)
+        received = 0
+        try:
+            while received < content_length:
+                chunk = stream.read(
+                    min(UPLOAD_CHUNK_SIZE, content_length - received)
+                )
+                if not chunk:
+                    break
+                part.write(chunk)
+                received += len(chunk)
+        finally:
+            part.truncate()
+            part.flush()
+            upload.offset = offset + received
+            upload.expires_at = timezone.now() + UPLOAD_EXPIRY
+            upload.save(update_fields=["offset", "expires_at", "updated_at"])
+    return upload.offset
+
+
+def finalize_upload(upload):
+    """
+    Create the media of a fully received upload. Returns it, or raises
+    ``ValidationError`` after discarding the upload.
+    """
+    from chat.v1.serializers import MessageMediaCreateSerializer
+    from posts.v1.serializers import PostMediaCreateSerializer
+
+    file = UploadedPart(upload.part_path, upload.filename, upload.length)
+    try:
+        if not check_type(upload.filename, file.read(SNIFF_LENGTH)):
+            discard_upload(upload)
+            raise ValidationError(
+                {"file": ["File content does not match its extension."]}
+            )
+        if upload.target == Upload.TargetChoices.ROOM_AVATAR:
+            with transaction.atomic():
+                room = set_room_avatar(upload.metadata["room"], file)
+                complete_upload(upload, room.pk)
+            remove_part(upload)
+            return room
+        if upload.target == Upload.TargetChoices.POST_MEDIA:
+            serializer = PostMediaCreateSerializer(data={
+                "post": upload.metadata["post"],
+                "is_featured": upload.metadata.get("is_featured", False),
+                "file": file,
+            })
+        else:
+            serializer = MessageMediaCreateSerializer(data={"file": file})
+        if not serializer.is_valid():
+            discard_upload(upload)
+            raise ValidationError(serializer.errors)
+        with transaction.atomic():
+            media = serializer.save()
+            complete_upload(upload, media.pk)
+    finally:
+        file.close()
+    remove_part(upload)
+    return media
+
+
+def set_room_avatar(room_id, file):
+    """Replace the avatar of a group, ``file`` being a File or a stored name."""
+    room = Room.objects.select_for_update().get(pk=room_id)
+    if isinstance(file, str):
+        room.avatar = file
+    else:
+        room.avatar.save(file.name, file, save=False)
+    room.save(update_fields=["avatar", "updated_at"])
+    return room
+
+
+def complete_upload(upload, media_id):
+    upload.media_id = media_id
+    upload.completed_at = timezone.now()
+    upload.save(update_fields=["media_id", "completed_at", "updated_at"])
+
+
+def remove_part(upload):
+    if upload.is_direct:
+        # Staging object of a direct upload, see uploads.direct
+        if upload.metadata.get("staging"):
+            get_media_storage().delete(upload.metadata["staging"])
+        return
+    try:
+        os.remove(upload.part_path)
+    except FileNotFoundError:
+        pass
+
+
+def discard_upload(upload):
+    remove_part(upload)
+    upload.delete()
+
+
+def attach_message_uploads(user, upload_ids, message) -> int:
+    """
+    Attach the media of completed message uploads of ``user`` to
+    ``message``. Raises ``ValueError`` unless every upload is attachable.
+    """
+    upload_ids = {uuid.UUID(str(upload_id)) for upload_id in upload_ids}
+    if not upload_ids:
+        return 0
+    media_ids = list(Upload.objects.filter(
+        pk__in=upload_ids,
+        user=user,
+        target=Upload.TargetChoices.MESSAGE_MEDIA,
+        completed_at__isnull=False,
+    ).values_list("media_id", flat=True))
+    attached = MessageMedia.objects.filter(
+        pk__in=media_ids,
+        message__isnull=True
+    ).update(message=message)
+    if attached != len(upload_ids):
+        raise ValueError("Some uploads are incomplete or already attached.")
+    # Readable by the room from now on
+    invalidate_media(MessageMedia.objects.filter(pk__in=media_ids))
+    return attached
+
+
+def purge_uploads(now=None) -> int:
+    """
+    Delete expired uploads, their part files, and the message media that
+    were never attached. Returns the number of uploads deleted.
+    """
+    expired = list(Upload.objects.filter(expires_at__lt=now or timezone.now()))
+    orphans = MessageMedia.objects.filter(
+        pk__in=[
+            upload.media_id for upload in expired
+            if upload.target == Upload.TargetChoices.MESSAGE_MEDIA
+            and upload.media_id
+        ],
+        message__isnull=True
+    )
+    for media in orphans:
+        media.file.delete(save=False)
+        media.delete()
+    for upload in expired:
+        remove_part(upload)
+    Upload.objects.filter(pk__in=[upload.pk for upload in expired]).delete()
+    return len(expired)
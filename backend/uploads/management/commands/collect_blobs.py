@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from uploads.storage import collect_blobs, recount_blobs
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete the media blobs no longer referenced by any row. With "
+        "--recount, first recompute the reference counts from the rows."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recount',
+            action='store_true',
+            help="Recompute every reference count, after bulk changes.",
+        )
+
+    def handle(self, *args, **options):
+        if options['recount']:
+            self.stdout.write("Fixed %s reference counts" % recount_blobs())
+        self.stdout.write("Collected %s blobs" % collect_blobs())
@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from uploads.processing import process_pending, MEDIA_PROCESS_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = (
+        "Strip EXIF data from new media images and build their WebP "
+        "variants and placeholders. Runs until interrupted unless --once is "
+        "given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=MEDIA_PROCESS_BATCH_SIZE,
+            help="Number of media of each model processed per batch.",
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=2,
+            help="Seconds to wait when nothing is left to process.",
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help="Process what is pending and exit.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            count = process_pending(options['batch_size'])
+            if count:
+                self.stdout.write("Processed %s media" % count)
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from uploads.helpers import purge_uploads
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete expired uploads with their part files, and the message "
+        "media uploaded but never sent."
+    )
+
+    def handle(self, *args, **options):
+        self.stdout.write("Purged %s uploads" % purge_uploads())
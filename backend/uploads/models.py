@@ -0,0 +1,188 @@
+import os
+import uuid
+
+from django.conf import settings
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+from django.contrib.auth import get_user_model
+
+from core.utils import BaseModel
+
+
+class ProcessedMedia(BaseModel):
+    """
+    Media file with the attributes and variants computed after upload by
+    ``uploads.processing``.
+    """
+    width = models.PositiveIntegerField(
+        verbose_name=_("Width"),
+        blank=True,
+        null=True
+    )
+    height = models.PositiveIntegerField(
+        verbose_name=_("Height"),
+        blank=True,
+        null=True
+    )
+    placeholder = models.CharField(
+        verbose_name=_("Placeholder"),
+        max_length=64,
+        blank=True,
+        default="",
+        help_text=_("BlurHash of the image, shown while it loads.")
+    )
+    variants = models.JSONField(
+        verbose_name=_("Variants"),
+        default=dict,
+        blank=True,
+        help_text=_("Resized WebP copies: {label: {name, width, height}}.")
+    )
+    processed_at = models.DateTimeField(
+        verbose_name=_("Date Processed"),
+        blank=True,
+        null=True,
+        db_index=True
+    )
+
+    class Meta:
+        abstract = True
+
+
+class Upload(BaseModel):
+    """
+    A resumable upload: the file is received in chunks appended to a part
+    file, then becomes the media row of its target once complete. A direct
+    upload is sent by the client to the object storage instead, and
+    committed once there (see ``uploads.direct``).
+    """
+
+    class TargetChoices(models.TextChoices):
+        MESSAGE_MEDIA = "message_media", _("Message media")
+        POST_MEDIA = "post_media", _("Post media")
+        ROOM_AVATAR = "room_avatar", _("Room avatar")
+
+    id = models.UUIDField(
+        primary_key=True,
+        default=uuid.uuid4,
+        editable=False
+    )
+    user = models.ForeignKey(
+        get_user_model(),
+        verbose_name=_("User"),
+        on_delete=models.CASCADE,
+        related_name="uploads"
+    )
+    target = models.CharField(
+        verbose_name=_("Target"),
+        max_length=20,
+        choices=TargetChoices.choices
+    )
+    filename = models.CharField(
+        verbose_name=_("File Name"),
+        max_length=255
+    )
+    length = models.BigIntegerField(
+        verbose_name=_("Length")
+    )
+    offset = models.BigIntegerField(
+        verbose_name=_("Offset"),
+        default=0
+    )
+    metadata = models.JSONField(
+        verbose_name=_("Metadata"),
+        default=dict,
+        blank=True
+    )
+    is_direct = models.BooleanField(
+        verbose_name=_("Direct"),
+        default=False,
+        help_text=_("Uploaded by the client to the object storage.")
+    )
+    media_id = models.BigIntegerField(
+        verbose_name=_("Media"),
+        blank=True,
+        null=True
+    )
+    expires_at = models.DateTimeField(
+        verbose_name=_("Date Expires"),
+        db_index=True
+    )
+    completed_at = models.DateTimeField(
+        verbose_name=_("Date Completed"),
+        blank=True,
+        null=True
+    )
+
+    class Meta:
+        verbose_name = _("Upload")
+        verbose_name_plural = _("Uploads")
+        ordering = ("-created_at",)
+
+    def __str__(self):
+        return f"{self.id} - {self.filename} ({self.offset}/{self.length})"
+
+    @property
+    def is_complete(self):
+        return self.completed_at is not None
+
+    @property
+    def part_path(self):
+        return os.path.join(settings.UPLOAD_TEMP_DIR, f"{self.id}.part")
+
+
+class Blob(BaseModel):
+    """
+    A file of the content-addressed media storage, with the number of rows
+    referencing it. See ``uploads.storage``.
+    """
+    name = models.CharField(
+        verbose_name=_("Name"),
+        max_length=255,
+        unique=True
+    )
+    sha256 = models.CharField(
+        verbose_name=_("SHA-256"),
+        max_length=64,
+        db_index=True
+    )
+    size = models.BigIntegerField(
+        verbose_name=_("Size")
+    )
+    refcount = models.IntegerField(
+        verbose_name=_("References"),
+        default=0,
+        db_index=True
+    )
+
+    class Meta:
+        verbose_name = _("Blob")
+        verbose_name_plural = _("Blobs")
+        ordering = ("-created_at",)
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount})"
+
+
+class MediaVariant(BaseModel):
+    """
+    A variant file of a media original, so a variant request finds the rows
+    of its original without scanning ``ProcessedMedia.variants``.
+    """
+    name = models.CharField(
+        verbose_name=_("Name"),
+        max_length=255
+    )
+    original = models.CharField(
+        verbose_name=_("Original"),
+        max_length=255,
+        db_index=True
+    )
+
+    class Meta:
+        verbose_name = _("Media variant")
+        verbose_name_plural = _("Media variants")
+        # Also the index of the lookups by name
+        unique_together = ("name", "original")
+
+    def __str__(self):
+        return f"{self.name} ({self.original})"
@@ -0,0 +1,287 @@
+"""
+Processing of uploaded images, by the ``process_media`` worker.
+
+For every new ``MessageMedia`` and ``PostMedia`` image:
+
+- the original is re-encoded without its EXIF data (location, device),
+  rotated upright first since the orientation tag goes with it;
+- its ``width``, ``height`` and a BlurHash ``placeholder`` are recorded;
+- a WebP thumbnail and WebP copies at ``MEDIA_VARIANT_WIDTHS`` narrower than
+  the original are stored next to it, listed in ``variants`` and indexed
+  by ``MediaVariant``.
+
+Other files are only marked as processed. With
+``settings.MEDIA_PROCESSING_INLINE`` media are processed by the process
+that saved them, once the transaction commits.
+"""
+import io
+import logging
+import math
+import os
+
+from django.core.files.base import ContentFile
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from chat.models import MessageMedia
+from posts.models import PostMedia
+
+from .models import MediaVariant
+
+logger = logging.getLogger(__name__)
+
+MEDIA_MODELS = (MessageMedia, PostMedia)
+MEDIA_THUMBNAIL_SIZE = 256
+MEDIA_VARIANT_WIDTHS = (480, 960, 1600)
+MEDIA_WEBP_QUALITY = 80
+MEDIA_PROCESS_BATCH_SIZE = 20
+
+# Formats Pillow reads, with the format the original is re-encoded in
+REENCODED_FORMATS = {
+    "JPEG": "JPEG",
+    "MPO": "JPEG",
+    "PNG": "PNG",
+    "WEBP": "WEBP",
+    "TIFF": "TIFF",
+}
+IMAGE_EXTENSIONS = {
+    ".jpg", ".jpeg", ".pjpeg", ".png", ".webp", ".gif", ".bmp", ".tiff", ".tif",
+}
+
+BLURHASH_CHARACTERS = (
+    "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+    "#$%*+,-.:;=?@[]^_{|}~"
+)
+
+
+def encode_base83(value, length):
+    return "".join(
+        BLURHASH_CHARACTERS[value // 83 ** (length - i - 1) % 83]
+        for i in range(length)
+    )
+
+
+def srgb_to_linear(value):
+    value /= 255
+    if value <= 0.04045:
+        return value / 12.92
+    return ((value + 0.055) / 1.055) ** 2.4
+
+
+def linear_to_srgb(value):
+    value = max(0.0, min(1.0, value))
+    if value <= 0.0031308:
+        return int(value * 12.92 * 255 + 0.5)
+    return int((1.055 * value ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def blurhash(image, x_components=4, y_components=3):
+    """BlurHash (https://blurha.sh) of an image, from a 32px copy of it."""
+    image = image.convert("RGB")
+    image.thumbnail((32, 32))
+    width, height = image.size
+    pixels = [
+        tuple(srgb_to_linear(channel) for channel in pixel)
+        for pixel in image.getdata()
+    ]
+    cos_x = [
+        [math.cos(math.pi * i * x / width) for x in range(width)]
+        for i in range(x_components)
+    ]
+    cos_y = [
+        [math.cos(math.pi * j * y / height) for y in range(height)]
+        for j in range(y_components)
+    ]
+
+    factors = []
+    for j in range(y_components):
+        for i in range(x_components):
+            scale = (1 if i == 0 and j == 0 else 2) / (width * height)
+            r = g = b = 0.0
+            for y in range(height):
+                row = y * width
+                for x in range(width):
+                    basis = cos_x[i][x] * cos_y[j][y]
+                    pixel = pixels[row + x]
+                    r += basis * pixel[0]
+                    g += basis * pixel[1]
+                    b += basis * pixel[2]
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    result = encode_base83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        quantised = max(0, min(82, math.floor(
+            max(abs(value) for factor in ac for value in factor) * 166 - 0.5
+        )))
+        maximum = (quantised + 1) / 166
+    else:
+        quantised, maximum = 0, 1
+    result += encode_base83(quantised, 1)
+    result += encode_base83(
+        (linear_to_srgb(dc[0]) << 16)
+        + (linear_to_srgb(dc[1]) << 8)
+        + linear_to_srgb(dc[2]),
+        4
+    )
+
+    def quantise(value):
+        value /= maximum
+        return max(0, min(18, math.floor(
+            math.copysign(abs(value) ** 0.5, value) * 9 + 9.5
+        )))
+
+    for r, g, b in ac:
+        result += encode_base83(
+            quantise(r) * 19 * 19 + quantise(g) * 19 + quantise(b), 2
+        )
+    return result
+
+
+def is_image(media):
+    return os.path.splitext(media.file.name)[1].lower() in IMAGE_EXTENSIONS
+
+
+def encode_webp(image):
+    buffer = io.BytesIO()
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+    image.save(buffer, "WEBP", quality=MEDIA_WEBP_QUALITY, method=4)
+    return buffer.getvalue()
+
+
+def strip_metadata(media, image, source_format) -> bool:
+    """
+    Replace the original with ``image``, its upright copy, without EXIF
+    data. Returns False if the format cannot be written back.
+    """
+    if source_format not in REENCODED_FORMATS:
+        return False
+    options = {}
+    if image.info.get("icc_profile"):
+        options["icc_profile"] = image.info["icc_profile"]
+    if REENCODED_FORMATS[source_format] == "JPEG":
+        options["quality"] = 95
+    buffer = io.BytesIO()
+    image.save(buffer, REENCODED_FORMATS[source_format], **options)
+    storage, name = media.file.storage, media.file.name
+    storage.delete(name)
+    media.file.name = storage.save(name, ContentFile(buffer.getvalue()))
+    return True
+
+
+def build_variants(media, image):
+    """Store the WebP variants of an upright image, return their index."""
+    storage = media.file.storage
+    stem = os.path.splitext(media.file.name)[0]
+    variants = {}
+
+    thumbnail = image.copy()
+    thumbnail.thumbnail((MEDIA_THUMBNAIL_SIZE, MEDIA_THUMBNAIL_SIZE))
+    sizes = [("thumb", thumbnail)]
+    for width in MEDIA_VARIANT_WIDTHS:
+        if width >= image.width:
+            break
+        sizes.append((
+            f"w{width}",
+            image.resize(
+                (width, max(1, round(image.height * width / image.width))),
+                Image.Resampling.LANCZOS
+            )
+        ))
+
+    for label, resized in sizes:
+        name = storage.save(
+            f"{stem}_{label}.webp",
+            ContentFile(encode_webp(resized))
+        )
+        variants[label] = {
+            "name": name,
+            "width": resized.width,
+            "height": resized.height,
+        }
+    index_variants(media.file.name, variants)
+    return variants
+
+
+def index_variants(original, variants):
+    MediaVariant.objects.bulk_create(
+        [
+            MediaVariant(name=variant["name"], original=original)
+            for variant in variants.values()
+        ],
+        ignore_conflicts=True
+    )
+
+
+def index_all_variants() -> int:
+    """
+    Index the variants of the media processed before ``MediaVariant``
+    existed. Returns the number of media indexed.
+    """
+    count = 0
+    for model in MEDIA_MODELS:
+        rows = model.objects.exclude(variants={}).exclude(
+            Exists(MediaVariant.objects.filter(original=OuterRef("file")))
+        ).values_list("file", "variants")
+        for original, variants in rows.iterator():
+            index_variants(original, variants or {})
+            count += 1
+    return count
+
+
+def process_media(media):
+    """Process one media row and save the results."""
+    update_fields = ["processed_at", "updated_at"]
+    if is_image(media):
+        with media.file.open("rb") as file:
+            with Image.open(file) as source:
+                has_exif = bool(source.getexif())
+                image = ImageOps.exif_transpose(source)
+                image.load()
+                stripped = has_exif and strip_metadata(
+                    media, image, source.format
+                )
+        if stripped:
+            update_fields.append("file")
+            if isinstance(media, MessageMedia):
+                media.size = media.file.size
+                update_fields.append("size")
+        media.width, media.height = image.size
+        media.placeholder = blurhash(image)
+        media.variants = build_variants(media, image)
+        update_fields += ["width", "height", "placeholder", "variants"]
+    media.processed_at = timezone.now()
+    media.save(update_fields=update_fields)
+
+
+def process_pending(batch_size=MEDIA_PROCESS_BATCH_SIZE) -> int:
+    """
+    Process up to ``batch_size`` unprocessed media of each model. Returns
+    the number processed. A file that cannot be processed is logged and
+    marked as processed, so it is not retried forever.
+    """
+    count = 0
+    for model in MEDIA_MODELS:
+        for media in model.objects.filter(
+                processed_at__isnull=True
+        ).order_by("pk")[:batch_size]:
+            try:
+                process_media(media)
+            except Exception:
+                logger.exception(
+                    "Could not process %s %s", model.__name__, media.pk
+                )
+                model.objects.filter(pk=media.pk).update(
+                    processed_at=timezone.now()
+                )
+            count += 1
+    return count
+
+
+def process_inline():
+    try:
+        process_pending()
+    except Exception:
+        logger.exception("Inline media processing failed")
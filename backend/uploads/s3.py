@@ -0,0 +1,114 @@
+"""
+Content-addressed media storage in an S3-compatible bucket (AWS S3, MinIO).
+
+Selected with ``STORAGES["media"]["BACKEND"] =
+"uploads.s3.S3ContentAddressedStorage"``, the options being those of
+django-storages' ``S3Storage``. Blobs are named and counted as with
+``uploads.storage.ContentAddressedStorage``, and the bucket stays private:
+
+- ``url`` is a signed URL under ``MEDIA_URL``, where
+  ``uploads.views.MediaView`` checks access and redirects to a short-lived
+  ``presigned_download`` URL;
+- clients may upload straight to the bucket with a ``presigned_upload`` URL
+  (see ``uploads.direct``). The URL signs the length and SHA-256 of the
+  content, so the bucket refuses anything but the announced file, which is
+  then ``copy``-ed into its blob.
+"""
+import base64
+import hashlib
+
+from django.utils.deconstruct import deconstructible
+from storages.backends.s3 import S3Storage
+
+from .storage import ContentAddressedMixin, blob_name, register_blob
+
+PRESIGNED_UPLOAD_EXPIRY = 15 * 60
+PRESIGNED_DOWNLOAD_EXPIRY = 10 * 60
+
+
+@deconstructible
+class S3ContentAddressedStorage(ContentAddressedMixin, S3Storage):
+    def _save(self, name, content):
+        # Uploads hashed on receipt are only read to be sent
+        sha256 = getattr(content, "sha256", None)
+        size = getattr(content, "size", None)
+        if not sha256:
+            digest = hashlib.sha256()
+            size = 0
+            if hasattr(content, "seek"):
+                content.seek(0)
+            for chunk in content.chunks():
+                digest.update(chunk)
+                size += len(chunk)
+            sha256 = digest.hexdigest()
+        name = blob_name(sha256, name)
+        if not (register_blob(name, sha256, size) and self.exists(name)):
+            super()._save(name, content)
+        return name
+
+    def presigned_download(self, name):
+        # ``url`` is the signed MEDIA_URL of ContentAddressedMixin
+        return S3Storage.url(self, name, expire=PRESIGNED_DOWNLOAD_EXPIRY)
+
+    def presigned_upload(self, name, size, sha256, content_type):
+        """
+        URL and headers of a PUT request uploading the blob ``name``, of
+        ``size`` bytes hashing to the hex digest ``sha256``.
+        """
+        checksum = base64.b64encode(bytes.fromhex(sha256)).decode()
+        params = self._get_write_parameters(name)
+        params.update({
+            "Bucket": self.bucket_name,
+            "Key": self._normalize_name(name),
+            "ContentType": content_type,
+            "ContentLength": size,
+            "ChecksumSHA256": checksum,
+        })
+        url = self.connection.meta.client.generate_presigned_url(
+            "put_object",
+            Params=params,
+            ExpiresIn=PRESIGNED_UPLOAD_EXPIRY,
+            HttpMethod="PUT"
+        )
+        return {
+            "method": "PUT",
+            "url": url,
+            "headers": {
+                "Content-Type": content_type,
+                "x-amz-checksum-sha256": checksum,
+            },
+            "expires_in": PRESIGNED_UPLOAD_EXPIRY,
+        }
+
+    def checksum(self, name):
+        """Hex SHA-256 of an object as verified by the bucket, if it has one."""
+        response = self.connection.meta.client.head_object(
+            Bucket=self.bucket_name,
+            Key=self._normalize_name(name),
+            ChecksumMode="ENABLED"
+        )
+        checksum = response.get("ChecksumSHA256")
+        # Multipart uploads have a checksum of the part checksums
+        if not checksum or "-" in checksum:
+            return None
+        return base64.b64decode(checksum).hex()
+
+    def copy(self, source, name):
+        """Copy the object ``source`` to ``name`` within the bucket."""
+        self.connection.meta.client.copy_object(
+            Bucket=self.bucket_name,
+            Key=self._normalize_name(name),
+            CopySource={
+                "Bucket": self.bucket_name,
+                "Key": self._normalize_name(source),
+            }
+        )
+
+    def read_prefix(self, name, length):
+        # Ranged GET, S3File would download the whole object
+        response = self.connection.meta.client.get_object(
+            Bucket=self.bucket_name,
+            Key=self._normalize_name(name),
+            Range=f"bytes=0-{length - 1}"
+        )
+        return response["Body"].read()
@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, post_migrate
+from django.dispatch import receiver
+
+from chat.models import MessageMedia
+from posts.models import PostMedia
+
+from .delivery import invalidate_media
+from .processing import index_all_variants, process_inline
+
+
+@receiver(post_save, sender=MessageMedia)
+@receiver(post_save, sender=PostMedia)
+def process_new_media(sender, instance, created, **kwargs):
+    """Without a ``process_media`` worker, process from this process."""
+    if created and settings.MEDIA_PROCESSING_INLINE:
+        transaction.on_commit(process_inline)
+
+
+@receiver(post_save, sender=MessageMedia)
+@receiver(post_save, sender=PostMedia)
+@receiver(post_delete, sender=MessageMedia)
+@receiver(post_delete, sender=PostMedia)
+def invalidate_media_owners(sender, instance, **kwargs):
+    invalidate_media([instance])
+
+
+@receiver(post_migrate)
+def index_media_variants(sender, **kwargs):
+    # Variants built before MediaVariant existed
+    if sender.name == 'uploads':
+        index_all_variants()
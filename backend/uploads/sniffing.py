@@ -0,0 +1,101 @@
+"""
+File type detection from the first bytes of a file.
+
+The extension of an upload is only a claim of the client. ``check_type``
+compares it with the magic bytes at the start of the content, so that a
+script renamed ``photo.jpg`` is refused before it is stored. Extensions
+without a known signature (plain text formats) are accepted as they are.
+"""
+import os
+
+# Bytes needed to recognise every type below
+SNIFF_LENGTH = 512
+
+FTYP_IMAGE_BRANDS = {b"heic", b"heix", b"hevc", b"hevx", b"mif1", b"msf1", b"avif"}
+
+
+def sniff(prefix):
+    """The type of a file from its first bytes, None if it is unknown."""
+    if prefix.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if prefix.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if prefix[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    if prefix.startswith(b"BM"):
+        return "bmp"
+    if prefix[:4] in (b"II*\x00", b"MM\x00*"):
+        return "tiff"
+    if prefix.startswith(b"RIFF") and len(prefix) >= 12:
+        return {b"WEBP": "webp", b"AVI ": "avi", b"WAVE": "wav"}.get(prefix[8:12])
+    if prefix[4:8] == b"ftyp":
+        if prefix[8:12] in FTYP_IMAGE_BRANDS:
+            return "heif"
+        if prefix[8:10] == b"3g":
+            return "3gp"
+        if prefix[8:12] == b"qt  ":
+            return "mov"
+        return "mp4"
+    if prefix.startswith(b"\x1a\x45\xdf\xa3"):
+        return "matroska"
+    if prefix[:4] in (b"\x00\x00\x01\xba", b"\x00\x00\x01\xb3"):
+        return "mpeg"
+    if prefix.startswith(b"FLV"):
+        return "flv"
+    if prefix.startswith(b"\x30\x26\xb2\x75\x8e\x66\xcf\x11"):
+        return "asf"
+    if prefix.startswith(b"ID3") or prefix[:2] in (b"\xff\xfb", b"\xff\xf3", b"\xff\xf2"):
+        return "mp3"
+    if prefix.startswith(b"OggS"):
+        return "ogg"
+    if prefix.startswith(b"fLaC"):
+        return "flac"
+    if prefix.startswith(b"%PDF-"):
+        return "pdf"
+    if prefix.startswith(b"PK\x03\x04"):
+        return "zip"
+    if prefix.startswith(b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"):
+        return "ole"
+    if prefix.startswith(b"{\\rtf"):
+        return "rtf"
+    text = prefix.lstrip(b"\xef\xbb\xbf \t\r\n").lower()
+    if text.startswith(b"<svg") or (
+            text.startswith(b"<?xml") and b"<svg" in text
+    ):
+        return "svg"
+    return None
+
+
+# Types each extension may have
+EXTENSION_TYPES = {
+    "jpg": {"jpeg"}, "jpeg": {"jpeg"}, "pjpeg": {"jpeg"},
+    "png": {"png"},
+    "gif": {"gif"},
+    "webp": {"webp"},
+    "bmp": {"bmp"},
+    "tiff": {"tiff"}, "tif": {"tiff"},
+    "svg": {"svg"},
+    "heif": {"heif"}, "heic": {"heif"},
+    "mp4": {"mp4"}, "m4v": {"mp4"}, "mov": {"mov", "mp4"},
+    "3gp": {"3gp", "mp4"},
+    "webm": {"matroska"}, "mkv": {"matroska"},
+    "avi": {"avi"},
+    "mpeg": {"mpeg"}, "mpg": {"mpeg"},
+    "wmv": {"asf"},
+    "flv": {"flv"},
+    "mp3": {"mp3"},
+    "wav": {"wav"},
+    "ogg": {"ogg"},
+    "flac": {"flac"},
+    "pdf": {"pdf"},
+    "doc": {"ole"}, "xls": {"ole"}, "ppt": {"ole"},
+    "docx": {"zip"}, "xlsx": {"zip"}, "pptx": {"zip"},
+    "rtf": {"rtf"},
+}
+
+
+def check_type(filename, prefix) -> bool:
+    """Whether the first bytes of a file match the type of its extension."""
+    extension = os.path.splitext(filename)[1].lstrip(".").lower()
+    allowed = EXTENSION_TYPES.get(extension)
+    return allowed is None or sniff(prefix) in allowed
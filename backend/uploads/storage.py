@@ -0,0 +1,277 @@
+"""
+Content-addressed media storage.
+
+Files are stored once per content, as ``blobs/<aa>/<bb>/<sha256><ext>``,
+whatever name ``UploadPath`` gives them: the same photo forwarded to ten
+rooms is ten rows pointing to one blob. The hash is computed while the
+upload is copied into place, unless the upload handler already computed it
+(``uploads.handlers``), and each blob has a ``Blob`` row counting the
+references to it.
+
+References follow the rows of the models using the storage: saving a row
+with a new file takes a reference, deleting the row or replacing its file
+releases one (see ``track_references``). ``Storage.delete`` is a no-op,
+since other rows may share the blob; ``collect_blobs`` deletes the blobs
+left without references.
+
+Bulk inserts, updates and deletes bypass the signals. ``recount_blobs``
+recomputes every count from the rows.
+
+``ContentAddressedStorage`` keeps blobs under ``MEDIA_ROOT``;
+``uploads.s3.S3ContentAddressedStorage`` keeps them in an S3-compatible
+bucket. ``STORAGES["media"]`` selects one.
+"""
+import hashlib
+import os
+import tempfile
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files import locks
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage, storages
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.signals import post_init, post_save, post_delete
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+from django.utils.encoding import filepath_to_uri
+
+from .signing import sign_media_url
+
+BLOB_PREFIX = "blobs/"
+# Blobs are saved before the row referencing them is committed
+BLOB_GRACE_PERIOD = timedelta(hours=1)
+
+
+def get_media_storage():
+    return storages["media"]
+
+
+def blob_name(digest, name):
+    extension = os.path.splitext(name)[1].lower()
+    return f"{BLOB_PREFIX}{digest[:2]}/{digest[2:4]}/{digest}{extension}"
+
+
+def register_blob(name, digest, size) -> bool:
+    """
+    Record a blob, or touch its row to keep ``collect_blobs`` away from it.
+    Returns whether the row existed.
+    """
+    from .models import Blob
+
+    touched = Blob.objects.filter(name=name).update(updated_at=timezone.now())
+    if not touched:
+        Blob.objects.get_or_create(
+            name=name,
+            defaults={"sha256": digest, "size": size}
+        )
+    return bool(touched)
+
+
+class ContentAddressedMixin:
+    """Naming, deletion and URLs of the content-addressed storages."""
+
+    def url(self, name):
+        """Signed URL under ``MEDIA_URL``, see ``uploads.signing``."""
+        return sign_media_url(settings.MEDIA_URL + filepath_to_uri(name), name)
+
+    def get_available_name(self, name, max_length=None):
+        # The name is replaced by the blob name in _save
+        return name
+
+    def delete(self, name):
+        """Blobs may be shared, ``collect_blobs`` removes them."""
+        if name and not name.startswith(BLOB_PREFIX):
+            super().delete(name)
+
+    def delete_blob(self, name):
+        super().delete(name)
+
+    def checksum(self, name):
+        """Hex SHA-256 of a file, if the storage keeps it."""
+        return None
+
+    def read_prefix(self, name, length):
+        """The first ``length`` bytes of a file."""
+        with self.open(name, "rb") as file:
+            return file.read(length)
+
+
+@deconstructible
+class ContentAddressedStorage(ContentAddressedMixin, FileSystemStorage):
+    def _save(self, name, content):
+        if getattr(content, "sha256", None) and hasattr(content, "temporary_file_path"):
+            return self._save_hashed(name, content)
+        directory = self.path(BLOB_PREFIX)
+        os.makedirs(directory, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        descriptor, temporary = tempfile.mkstemp(dir=directory, suffix=".part")
+        try:
+            with os.fdopen(descriptor, "wb") as destination:
+                locks.lock(destination, locks.LOCK_EX)
+                if hasattr(content, "seek"):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    destination.write(chunk)
+                    size += len(chunk)
+            name = blob_name(digest.hexdigest(), name)
+            if register_blob(name, digest.hexdigest(), size) and self.exists(name):
+                os.remove(temporary)
+            else:
+                os.makedirs(os.path.dirname(self.path(name)), exist_ok=True)
+                os.replace(temporary, self.path(name))
+                if self.file_permissions_mode is not None:
+                    os.chmod(self.path(name), self.file_permissions_mode)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        return name
+
+    def _save_hashed(self, name, content):
+        """Move a temporary upload hashed on receipt into place."""
+        name = blob_name(content.sha256, name)
+        if not (register_blob(name, content.sha256, content.size) and self.exists(name)):
+            os.makedirs(os.path.dirname(self.path(name)), exist_ok=True)
+            file_move_safe(
+                content.temporary_file_path(), self.path(name), allow_overwrite=True
+            )
+            if self.file_permissions_mode is not None:
+                os.chmod(self.path(name), self.file_permissions_mode)
+        return name
+
+
+def referenced_names(values, fields):
+    """
+    Blob names referenced by a row, its files and their variants, from
+    ``{attname: file name}`` and ``variants``.
+    """
+    names = {
+        str(values[field.attname]) for field in fields
+        if str(values[field.attname] or "").startswith(BLOB_PREFIX)
+    }
+    for variant in (values.get("variants") or {}).values():
+        if variant.get("name", "").startswith(BLOB_PREFIX):
+            names.add(variant["name"])
+    return names
+
+
+def instance_names(instance, fields):
+    """Blob names of a model instance, None if its files are deferred."""
+    values = instance.__dict__
+    if any(field.attname not in values for field in fields):
+        return None
+    return referenced_names(
+        {
+            field.attname: getattr(values[field.attname], "name", values[field.attname])
+            for field in fields
+        } | {"variants": values.get("variants")},
+        fields
+    )
+
+
+def change_references(names, delta):
+    from .models import Blob
+
+    if names:
+        Blob.objects.filter(name__in=names).update(
+            refcount=F("refcount") + delta,
+            updated_at=timezone.now()
+        )
+
+
+def blob_fields(model):
+    return [
+        field for field in model._meta.concrete_fields
+        if hasattr(field, "storage")
+        and isinstance(field.storage, ContentAddressedMixin)
+    ]
+
+
+def track_references():
+    """Connect the reference counting signals of the models using blobs."""
+    for model in apps.get_models():
+        fields = blob_fields(model)
+        if not fields:
+            continue
+
+        def remember(sender, instance, fields=fields, **kwargs):
+            instance._blob_names = instance_names(instance, fields)
+
+        def update(sender, instance, created, fields=fields, **kwargs):
+            names = instance_names(instance, fields)
+            previous = set() if created else instance._blob_names
+            if names is None or previous is None:
+                # Loaded without its files, which the save cannot change
+                return
+            change_references(names - previous, 1)
+            change_references(previous - names, -1)
+            instance._blob_names = names
+
+        def release(sender, instance, fields=fields, **kwargs):
+            names = instance._blob_names
+            if names is None:
+                names = instance_names(instance, fields)
+            change_references(names or set(), -1)
+
+        post_init.connect(remember, sender=model, weak=False)
+        post_save.connect(update, sender=model, weak=False)
+        post_delete.connect(release, sender=model, weak=False)
+
+
+def recount_blobs():
+    """Recompute every reference count from the rows. Returns the count fixed."""
+    from .models import Blob
+
+    counts = {}
+    for model in apps.get_models():
+        fields = blob_fields(model)
+        if not fields:
+            continue
+        columns = [field.attname for field in fields]
+        if hasattr(model, "variants"):
+            columns.append("variants")
+        for row in model._base_manager.values(*columns).iterator():
+            for name in referenced_names(row, fields):
+                counts[name] = counts.get(name, 0) + 1
+
+    fixed = 0
+    for blob in Blob.objects.all().iterator():
+        if blob.refcount != counts.get(blob.name, 0):
+            Blob.objects.filter(pk=blob.pk).update(
+                refcount=counts.get(blob.name, 0)
+            )
+            fixed += 1
+    return fixed
+
+
+def collect_blobs(now=None) -> int:
+    """
+    Delete the blobs without references since ``BLOB_GRACE_PERIOD``.
+    Returns the number deleted.
+    """
+    from .models import Blob, MediaVariant
+
+    storage = get_media_storage()
+    unreferenced = Blob.objects.filter(
+        refcount__lte=0,
+        updated_at__lt=(now or timezone.now()) - BLOB_GRACE_PERIOD
+    )
+    deleted = 0
+    for pk in list(unreferenced.values_list("pk", flat=True)):
+        with transaction.atomic():
+            # Locked, so a concurrent save of the same content waits
+            blob = unreferenced.select_for_update().filter(pk=pk).first()
+            if blob is None:
+                continue
+            storage.delete_blob(blob.name)
+            MediaVariant.objects.filter(
+                Q(name=blob.name) | Q(original=blob.name)
+            ).delete()
+            blob.delete()
+            deleted += 1
+    return deleted
@@ -0,0 +1,96 @@
+from drf_spectacular.utils import extend_schema_field
+from rest_framework import serializers
+
+from uploads.models import Upload
+from uploads.storage import get_media_storage
+
+
+@extend_schema_field({
+    "type": "object",
+    "additionalProperties": {
+        "type": "object",
+        "properties": {
+            "url": {"type": "string"},
+            "width": {"type": "integer"},
+            "height": {"type": "integer"},
+        },
+    },
+    "example": {
+        "thumb": {"url": "https://.../media_thumb.webp", "width": 256, "height": 192},
+        "w480": {"url": "https://.../media_w480.webp", "width": 480, "height": 360},
+    },
+})
+class MediaVariantsField(serializers.Field):
+    """WebP variants of a processed media, by label, with their URL."""
+
+    def __init__(self, **kwargs):
+        kwargs["read_only"] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, variants):
+        request = self.context.get("request")
+        representation = {}
+        for label, variant in (variants or {}).items():
+            url = get_media_storage().url(variant["name"])
+            representation[label] = {
+                "url": request.build_absolute_uri(url) if request else url,
+                "width": variant["width"],
+                "height": variant["height"],
+            }
+        return representation
+
+
+class UploadSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Upload
+        fields = [
+            'id', 'target', 'filename', 'length', 'offset', 'metadata',
+            'is_direct', 'media_id', 'completed_at', 'expires_at',
+        ]
+        read_only_fields = fields
+
+
+class DirectUploadCreateSerializer(serializers.Serializer):
+    target = serializers.ChoiceField(choices=Upload.TargetChoices.choices)
+    filename = serializers.CharField(max_length=255)
+    length = serializers.IntegerField(min_value=1)
+    sha256 = serializers.RegexField(
+        r"^[0-9a-fA-F]{64}$",
+        help_text="Hex SHA-256 digest of the file."
+    )
+    content_type = serializers.CharField(
+        max_length=100,
+        default="application/octet-stream"
+    )
+    post = serializers.IntegerField(required=False)
+    is_featured = serializers.BooleanField(default=False)
+    room = serializers.IntegerField(required=False)
+
+    def validate_sha256(self, value):
+        return value.lower()
+
+    def get_metadata(self):
+        """The options as the string metadata of a resumable upload."""
+        data = self.validated_data
+        return {
+            "target": data["target"],
+            "filename": data["filename"],
+            "post": str(data.get("post", "")),
+            "is_featured": "true" if data["is_featured"] else "",
+            "room": str(data.get("room", "")),
+        }
+
+
+class PresignedRequestSerializer(serializers.Serializer):
+    method = serializers.CharField()
+    url = serializers.URLField()
+    headers = serializers.DictField(child=serializers.CharField())
+    expires_in = serializers.IntegerField()
+
+
+class DirectUploadSerializer(serializers.Serializer):
+    upload = UploadSerializer()
+    request = PresignedRequestSerializer(
+        allow_null=True,
+        help_text="Request sending the file, null if the user can already read it."
+    )
@@ -0,0 +1,14 @@
+from django.urls import path
+
+from .views import (
+    UploadCreateView, UploadDetailView, DirectUploadCreateView, UploadCommitView,
+)
+
+app_name = 'v1-uploads'
+
+urlpatterns = [
+    path('', UploadCreateView.as_view(), name='upload_create'),
+    path('<uuid:pk>/', UploadDetailView.as_view(), name='upload_detail'),
+    path('direct/', DirectUploadCreateView.as_view(), name='direct_upload_create'),
+    path('<uuid:pk>/commit/', UploadCommitView.as_view(), name='upload_commit'),
+]
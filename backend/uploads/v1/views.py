@@ -0,0 +1,240 @@
+from django.core.exceptions import ValidationError
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from drf_spectacular.utils import extend_schema, OpenApiResponse
+
+from uploads.models import Upload
+from uploads.direct import create_direct_upload, commit_upload
+from uploads.helpers import (
+    TUS_VERSION, UploadError, parse_metadata, create_upload, receive_chunk,
+    finalize_upload, discard_upload,
+)
+
+from .serializers import (
+    UploadSerializer, DirectUploadCreateSerializer, DirectUploadSerializer,
+)
+
+
+class TusMixin:
+    """Headers of the tus protocol on every response."""
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs
+        )
+        response["Tus-Resumable"] = TUS_VERSION
+        response["Tus-Version"] = TUS_VERSION
+        response["Tus-Extension"] = "creation,termination"
+        response["Cache-Control"] = "no-store"
+        return response
+
+    @staticmethod
+    def error(e):
+        return Response({"detail": e.detail}, status=e.status)
+
+    @staticmethod
+    def header_int(request, name):
+        value = request.headers.get(name, "")
+        return int(value) if value.isdigit() else None
+
+
+@extend_schema(tags=["Uploads"])
+class UploadCreateView(TusMixin, APIView):
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        request=None,
+        responses={
+            201: UploadSerializer,
+            400: OpenApiResponse(description="Invalid file or target."),
+            403: OpenApiResponse(description="Target not allowed."),
+        },
+        summary="Start a resumable upload",
+        description=(
+            "tus creation request. `Upload-Length` gives the size of the "
+            "file and `Upload-Metadata` its `filename`, `target` "
+            "(`message_media` or `post_media`) and, for posts, `post` and "
+            "`is_featured`. Send the file with PATCH requests to the "
+            "returned `Location`."
+        ),
+    )
+    def post(self, request, format=None):
+        length = self.header_int(request, "Upload-Length")
+        if not length:
+            return Response(
+                {"detail": "Upload-Length is required."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            upload = create_upload(
+                request.user,
+                length,
+                parse_metadata(request.headers.get("Upload-Metadata"))
+            )
+        except UploadError as e:
+            return self.error(e)
+
+        response = Response(
+            UploadSerializer(upload).data,
+            status=status.HTTP_201_CREATED
+        )
+        response["Location"] = request.build_absolute_uri(
+            reverse("v1-uploads:upload_detail", args=[upload.pk])
+        )
+        return response
+
+
+@extend_schema(tags=["Uploads"])
+class UploadDetailView(TusMixin, APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get_upload(self, request, pk):
+        return get_object_or_404(Upload, pk=pk, user=request.user)
+
+    @extend_schema(responses={200: UploadSerializer}, summary="Get an upload")
+    def get(self, request, pk, format=None):
+        return Response(UploadSerializer(self.get_upload(request, pk)).data)
+
+    def head(self, request, pk, format=None):
+        """Offset to resume the upload from."""
+        upload = self.get_upload(request, pk)
+        response = Response(status=status.HTTP_200_OK)
+        response["Upload-Offset"] = upload.offset
+        response["Upload-Length"] = upload.length
+        return response
+
+    @extend_schema(
+        request={"application/offset+octet-stream": bytes},
+        responses={
+            204: OpenApiResponse(description="Chunk received."),
+            409: OpenApiResponse(description="Upload-Offset does not match."),
+            413: OpenApiResponse(description="Chunk goes past the length."),
+        },
+        summary="Send a chunk of an upload",
+        description=(
+            "tus PATCH request: the body is appended at `Upload-Offset`, "
+            "which must be the offset of the upload. The response gives the "
+            "new offset; the media is created with the last chunk."
+        ),
+    )
+    def patch(self, request, pk, format=None):
+        upload = self.get_upload(request, pk)
+        if request.content_type != "application/offset+octet-stream":
+            return Response(
+                {"detail": "Content-Type must be application/offset+octet-stream."},
+                status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+            )
+        offset = self.header_int(request, "Upload-Offset")
+        content_length = self.header_int(request, "Content-Length")
+        if offset is None or content_length is None:
+            return Response(
+                {"detail": "Upload-Offset and Content-Length are required."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            # The body is read straight from the request stream
+            offset = receive_chunk(
+                upload, request._request, offset, content_length
+            )
+        except UploadError as e:
+            return self.error(e)
+
+        if offset == upload.length:
+            try:
+                finalize_upload(upload)
+            except ValidationError as e:
+                return Response(
+                    e.message_dict if hasattr(e, "error_dict") else e.messages,
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        response = Response(status=status.HTTP_204_NO_CONTENT)
+        response["Upload-Offset"] = offset
+        return response
+
+    @extend_schema(
+        responses={204: OpenApiResponse(description="Upload discarded.")},
+        summary="Discard an unfinished upload",
+    )
+    def delete(self, request, pk, format=None):
+        upload = self.get_upload(request, pk)
+        if upload.is_complete:
+            return Response(
+                {"detail": "Upload is already complete."},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        discard_upload(upload)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+@extend_schema(tags=["Uploads"])
+class DirectUploadCreateView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        request=DirectUploadCreateSerializer,
+        responses={
+            201: DirectUploadSerializer,
+            400: OpenApiResponse(description="Invalid file or target."),
+            403: OpenApiResponse(description="Target not allowed."),
+            501: OpenApiResponse(description="No object storage."),
+        },
+        summary="Start a direct upload",
+        description=(
+            "Returns a presigned request sending the file straight to the "
+            "object storage, with the `length`, `sha256` and `content_type` "
+            "given here: the storage refuses any other content. `request` "
+            "is null when the same content is stored in media the user can "
+            "already read. Then commit "
+            "the upload. Targets take the options of resumable uploads: "
+            "`post` and `is_featured` for post media, `room` for group "
+            "avatars."
+        ),
+    )
+    def post(self, request, format=None):
+        serializer = DirectUploadCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            upload, presigned = create_direct_upload(
+                request.user,
+                serializer.validated_data["sha256"],
+                serializer.validated_data["content_type"],
+                serializer.validated_data["length"],
+                serializer.get_metadata()
+            )
+        except UploadError as e:
+            return Response({"detail": e.detail}, status=e.status)
+        return Response(
+            DirectUploadSerializer({"upload": upload, "request": presigned}).data,
+            status=status.HTTP_201_CREATED
+        )
+
+
+@extend_schema(tags=["Uploads"])
+class UploadCommitView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        request=None,
+        responses={
+            200: UploadSerializer,
+            400: OpenApiResponse(description="Length or type mismatch."),
+            409: OpenApiResponse(description="File not uploaded yet."),
+        },
+        summary="Commit a direct upload",
+        description=(
+            "Checks the uploaded file and creates its media, unattached for "
+            "message media (send it with `uploads`), or sets the group "
+            "avatar. `media_id` gives the created row."
+        ),
+    )
+    def post(self, request, pk, format=None):
+        upload = get_object_or_404(Upload, pk=pk, user=request.user)
+        try:
+            commit_upload(upload)
+        except UploadError as e:
+            return Response({"detail": e.detail}, status=e.status)
+        return Response(UploadSerializer(upload).data)
@@ -0,0 +1,31 @@
+from django.http import Http404
+from rest_framework.permissions import AllowAny
+from rest_framework.views import APIView
+from drf_spectacular.utils import extend_schema
+
+from .delivery import clean_name, media_owners, can_read, media_response
+from .signing import check_media_signature
+
+
+@extend_schema(exclude=True)
+class MediaView(APIView):
+    """
+    Files under ``MEDIA_URL``, sent by nginx once the client is allowed to
+    read them, see ``uploads.delivery``: with the signed URL the API handed
+    out (``uploads.signing``), or as a user who may read the file.
+    Unreadable files are 404s.
+    """
+    permission_classes = [AllowAny]
+
+    def get(self, request, name):
+        name = clean_name(name)
+        owners = media_owners(name) if name else None
+        if owners is None or not (
+                check_media_signature(name, request.query_params)
+                or can_read(request.user, owners)
+        ):
+            raise Http404
+        response = media_response(request, name, owners)
+        if response is None:
+            raise Http404
+        return response
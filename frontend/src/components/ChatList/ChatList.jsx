@@ -87,7 +87,8 @@ const PrivateRoom = ({data, selected, handleSelect}) => {
 
 
     return (
-        <ListItem sx={ChatItemStyle} className={isSelected ? "active" : ""}>
+        <ListItem sx={ChatItemStyle} className={isSelected ? "active" : ""}
+                  secondaryAction={<Badge badgeContent={data?.unread_count} color={"primary"}/>}>
             <ListItemButton onClick={handleSelect}>
                 <ListItemAvatar>
                     <Badge variant={"dot"} overlap={"circular"}
@@ -115,7 +116,8 @@ const FamilyRoom = ({data, selected, handleSelect}) => {
     const isSelected = selected?.id === data?.id
 
     return (
-        <ListItem sx={ChatItemStyle} className={isSelected ? "active" : ""}>
+        <ListItem sx={ChatItemStyle} className={isSelected ? "active" : ""}
+                  secondaryAction={<Badge badgeContent={data?.unread_count} color={"primary"}/>}>
             <ListItemButton onClick={handleSelect}>
                 <ListItemAvatar>
                     <Avatar src={completeServerUrl(getAvatar(data))} alt={data?.title}>
@@ -138,7 +140,8 @@ const GroupRoom = ({data, selected, handleSelect}) => {
     const isSelected = selected?.id === data?.id
 
     return (
-        <ListItem sx={ChatItemStyle} className={isSelected ? "active" : ""}>
+        <ListItem sx={ChatItemStyle} className={isSelected ? "active" : ""}
+                  secondaryAction={<Badge badgeContent={data?.unread_count} color={"primary"}/>}>
             <ListItemButton onClick={handleSelect}>
                 <ListItemAvatar>
                     <Avatar src={completeServerUrl(getAvatar(data))} alt={data?.title}>
@@ -77,20 +77,11 @@ const ChatPanel = ({selected, setSelected, height, matches}) => {
                         return prevState.filter(item => item.id !== data)
                     })
                     break;
-                case "read_messages":
+                case "read_up_to":
                     updateMessagesRead(data)
                     break;
-                case "typing":
-                    setIsTyping(prevState => {
-                        if (prevState && !prevState.find(item => item === data.user)) {
-                            return [...prevState, data.user];
-                        }
-                        return prevState ? prevState : [data.user];
-                    });
-
-                    break
-                case "stop_typing":
-                    setIsTyping(prevState => prevState.filter(item => item !== data.user))
+                case "typing_state":
+                    setIsTyping(data.users.filter(item => item.id !== user.id).map(item => item.name))
                     break
                 default:
                     console.log("Unknown action on message", action);
@@ -104,29 +95,21 @@ const ChatPanel = ({selected, setSelected, height, matches}) => {
         const unReadedMessages = data.filter(item => !item.have_read.includes(user.id))
         if (unReadedMessages.length > 0) {
             const prepData = {
-                action: "read_messages",
-                messages: unReadedMessages
+                action: "read_up_to",
+                message: Math.max(...unReadedMessages.map(item => item.id))
             }
             sendJsonMessage(prepData)
         }
     }
 
     const updateMessagesRead = (data) => {
-        setMessages((prevState) => {
-            // Create a copy of the current messages state
-            const updatedMessages = [...prevState];
-
-            // Loop through the incoming data and update the read status of the corresponding messages
-            data.forEach(newMessage => {
-                const index = updatedMessages.findIndex(msg => msg.id === newMessage.id);
-                if (index !== -1) {
-                    updatedMessages[index] = newMessage;
-                }
-            });
-
-            // Return the updated messages state
-            return updatedMessages;
-        });
+        // Everything up to the reader's watermark is read by them
+        setMessages((prevState) => prevState.map(item => {
+            if (item.id <= data.message && !item.have_read.includes(data.user)) {
+                return {...item, have_read: [...item.have_read, data.user]};
+            }
+            return item;
+        }));
     };
 
     const handleStartCall = () => {
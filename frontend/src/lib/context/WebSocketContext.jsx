@@ -5,7 +5,7 @@ import {useAccessToken} from "@lib/hooks/useToken.jsx";
 import {parseData} from "@lib/utils/socket.js";
 import {useRoomsContext} from "@lib/context/RoomsContext.jsx";
 import useSearchParamChange from "@lib/hooks/useSearchParamChange.jsx";
-import {showMessageNotification, updateRoomLastMessage} from "@lib/utils/chat.jsx";
+import {showMessageNotification, updateRoomLastMessage, updateRoomPresence, updateRoomUnread} from "@lib/utils/chat.jsx";
 import {useUserContext} from "@lib/context/UserContext.jsx";
 import toast from "react-hot-toast";
 import {useNavigate} from "react-router-dom";
@@ -54,6 +54,12 @@ export const WebSocketProvider = ({children}) => {
                     case "new_message":
                         handleNewMessage(data)
                         break;
+                    case "unread_changed":
+                        setRooms(prevRooms => updateRoomUnread(prevRooms, data));
+                        break;
+                    case "presence_delta":
+                        setRooms(prevRooms => updateRoomPresence(prevRooms, data));
+                        break;
                     case "video_call_started":
                         ringingController.current = playRingingSound();
                         showIncomingCallToast({
@@ -90,7 +96,13 @@ export const WebSocketProvider = ({children}) => {
                 } else {
                     showMessageNotification(messageData);
                 }
-                setRooms(prevRooms => updateRoomLastMessage(prevRooms, messageData));
+                setRooms(prevRooms => {
+                    const updated = updateRoomLastMessage(prevRooms, messageData);
+                    // The notification carries the unread count of the room
+                    if (messageData.unread_count === undefined)
+                        return updated;
+                    return updateRoomUnread(updated, {room: roomId, unread: messageData.unread_count});
+                });
             } else {
                 sendJsonMessage({action: "pull_rooms"})
                 showMessageNotification(messageData);
@@ -30,6 +30,34 @@ export const updateRoomLastMessage = (rooms, message) => {
     });
 };
 
+export const updateRoomUnread = (rooms, data) => {
+    return rooms.map(room => {
+        if (room.id === parseInt(data.room)) {
+            return {
+                ...room,
+                unread_count: data.unread
+            };
+        }
+        return room;
+    });
+};
+
+export const updateRoomPresence = (rooms, deltas) => {
+    const presence = new Map(deltas.map(item => [item.id, item]));
+    return rooms.map(room => {
+        if (!room.participants?.some(p => presence.has(p.id))) {
+            return room;
+        }
+        return {
+            ...room,
+            participants: room.participants.map(p => {
+                const delta = presence.get(p.id);
+                return delta ? {...p, is_online: delta.is_online, last_seen: delta.last_seen} : p;
+            })
+        };
+    });
+};
+
 export const getChatName = (data, user = null) => {
     switch (data?.type) {
         case "family":
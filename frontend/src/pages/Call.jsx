@@ -63,6 +63,7 @@ const Call = () => {
             case "offer":
             case "answer":
             case "ice_candidate":
+            case "ice_candidates":
                 console.log(`Received signaling: ${action}`, data);
                 // Normally you would integrate this with a PeerConnection if not using LiveKit
                 break;